@@ -6,6 +6,7 @@ from sqlalchemy import pool
 from alembic import context
 from src.database.connection import Base
 from src.models.image import Image  # Import all models
+from src.models.outbox import OutboxMessage
 import os
 
 # this is the Alembic Config object, which provides
@@ -0,0 +1,27 @@
+"""Add probed dimensions and format to images
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('images', sa.Column('width', sa.Integer(), nullable=True))
+    op.add_column('images', sa.Column('height', sa.Integer(), nullable=True))
+    op.add_column('images', sa.Column('format', sa.String(length=10), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('images', 'format')
+    op.drop_column('images', 'height')
+    op.drop_column('images', 'width')
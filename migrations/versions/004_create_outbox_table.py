@@ -0,0 +1,46 @@
+"""Create outbox table
+
+Revision ID: 004
+Revises: 003
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '004'
+down_revision = '003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('outbox',
+        sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column('image_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('image_path', sa.String(length=500), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        'ix_outbox_unsent', 'outbox', ['id'], unique=False,
+        postgresql_where=sa.text('sent_at IS NULL')
+    )
+    op.create_index('ix_outbox_sent_at', 'outbox', ['sent_at'], unique=False)
+    
+    # Queue images that were left NEW by failed direct publishes
+    op.execute(
+        "INSERT INTO outbox (image_id, image_path, attempts, created_at) "
+        "SELECT id, original_path, 0, now() FROM images WHERE status = 'NEW'"
+    )
+    op.execute("UPDATE images SET status = 'PROCESSING' WHERE status = 'NEW'")
+
+
+def downgrade() -> None:
+    op.drop_index('ix_outbox_sent_at', table_name='outbox')
+    op.drop_index('ix_outbox_unsent', table_name='outbox')
+    op.drop_table('outbox')
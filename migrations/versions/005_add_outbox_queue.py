@@ -0,0 +1,23 @@
+"""Add lane queue to outbox
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('outbox', sa.Column('queue', sa.String(length=100), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('outbox', 'queue')
@@ -0,0 +1,35 @@
+"""Create image variants table
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '006'
+down_revision = '005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('image_variants',
+        sa.Column('image_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('size_name', sa.String(length=20), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('path', sa.String(length=500), nullable=True),
+        sa.Column('error_message', sa.Text(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['image_id'], ['images.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('image_id', 'size_name')
+    )
+    op.add_column('outbox', sa.Column('variant', sa.String(length=20), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('outbox', 'variant')
+    op.drop_table('image_variants')
@@ -0,0 +1,54 @@
+"""Move thumbnail paths to image variants and add listing indexes
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '007'
+down_revision = '006'
+branch_labels = None
+depends_on = None
+
+THUMBNAIL_COLUMNS = {
+    '100x100': 'thumbnail_100_path',
+    '300x300': 'thumbnail_300_path',
+    '1200x1200': 'thumbnail_1200_path',
+}
+
+
+def upgrade() -> None:
+    for size_name, column in THUMBNAIL_COLUMNS.items():
+        op.execute(
+            f"INSERT INTO image_variants (image_id, size_name, status, path, updated_at) "
+            f"SELECT id, '{size_name}', 'DONE', {column}, updated_at FROM images "
+            f"WHERE {column} IS NOT NULL "
+            f"ON CONFLICT (image_id, size_name) DO NOTHING"
+        )
+        op.drop_column('images', column)
+
+    # The primary key already indexes id
+    op.drop_index('ix_images_id', table_name='images')
+    op.create_index(
+        'ix_images_status_created_at', 'images', ['status', 'created_at', 'id'], unique=False
+    )
+    op.create_index('ix_images_created_at', 'images', ['created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_images_created_at', table_name='images')
+    op.drop_index('ix_images_status_created_at', table_name='images')
+    op.create_index('ix_images_id', 'images', ['id'], unique=False)
+
+    for size_name, column in THUMBNAIL_COLUMNS.items():
+        op.add_column('images', sa.Column(column, sa.String(length=500), nullable=True))
+        op.execute(
+            f"UPDATE images SET {column} = image_variants.path FROM image_variants "
+            f"WHERE image_variants.image_id = images.id "
+            f"AND image_variants.size_name = '{size_name}' "
+            f"AND image_variants.status = 'DONE'"
+        )
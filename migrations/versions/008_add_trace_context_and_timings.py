@@ -0,0 +1,25 @@
+"""Add trace context to outbox and stage timings to images
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '008'
+down_revision = '007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('outbox', sa.Column('traceparent', sa.String(length=55), nullable=True))
+    op.add_column('images', sa.Column('timings', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('images', 'timings')
+    op.drop_column('outbox', 'traceparent')
@@ -0,0 +1,23 @@
+"""Add the error of the latest failed publish to outbox
+
+Revision ID: 009
+Revises: 008
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '009'
+down_revision = '008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('outbox', sa.Column('last_error', sa.String(length=500), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('outbox', 'last_error')
@@ -1,10 +1,17 @@
 """Main FastAPI application."""
 
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
-from src.api.routes import images, health
+from src.api.middleware import MetricsMiddleware, TracingMiddleware
+from src.api.routes import images, health, metrics, static
+from src.services.health import health_prober
+from src.services.image_cache import image_cache
+from src.services.outbox_relay import outbox_relay
 from src.services.rabbitmq_service import rabbitmq_service
+from src.services.render_cache import render_cache
+from src.services.status_events import status_event_bus
+from src.services.storage import storage
 from src.services.logger import setup_logging, get_logger
 from src.config import settings
 import os
@@ -19,23 +26,51 @@ async def lifespan(app: FastAPI):
     """Handle application lifespan events."""
     # Startup
     logger.info("Starting image processing API")
+    for message in settings.ignored_settings():
+        logger.warning(message)
     
-    # Ensure storage directories exist
+    # Ensure storage directories exist (uploads are spooled to tmp/)
     os.makedirs(os.path.join(settings.STORAGE_PATH, "originals"), exist_ok=True)
     os.makedirs(os.path.join(settings.STORAGE_PATH, "thumbnails"), exist_ok=True)
     
-    # Connect to RabbitMQ
+    # Connect to RabbitMQ; drop cached image responses and wake waiting
+    # clients on status changes
+    reconnecting = None
     try:
-        await rabbitmq_service.connect()
+        await rabbitmq_service.subscribe_status_events(
+            image_cache.handle_status_event,
+            render_cache.handle_status_event,
+            status_event_bus.handle_status_event
+        )
         logger.info("Connected to RabbitMQ")
     except Exception as e:
         logger.error(f"Failed to connect to RabbitMQ: {e}")
+        # The subscription is set up once a connection succeeds
+        reconnecting = asyncio.create_task(
+            rabbitmq_service.keep_connecting(settings.RABBITMQ_RECONNECT_INTERVAL)
+        )
+    
+    # Publish outbox tasks (retries until RabbitMQ is reachable)
+    if settings.OUTBOX_ENABLED:
+        outbox_relay.start()
+    
+    # Dependency checks answering /readyz
+    health_prober.start()
     
     yield
     
     # Shutdown
     logger.info("Shutting down image processing API")
+    await health_prober.stop()
+    if reconnecting is not None:
+        reconnecting.cancel()
+        try:
+            await reconnecting
+        except asyncio.CancelledError:
+            pass
+    await outbox_relay.stop()
     await rabbitmq_service.disconnect()
+    await storage.close()
 
 
 # Create FastAPI application
@@ -46,13 +81,14 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+app.add_middleware(TracingMiddleware)
+app.add_middleware(MetricsMiddleware)
+
 # Include routers
 app.include_router(health.router)
+app.include_router(metrics.router)
 app.include_router(images.router)
-
-# Mount static files if storage directory exists
-if os.path.exists(settings.STORAGE_PATH):
-    app.mount("/static", StaticFiles(directory=settings.STORAGE_PATH), name="static")
+app.include_router(static.router)
 
 
 @app.get("/")
@@ -0,0 +1,67 @@
+"""ASGI middleware of the API."""
+
+import time
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from src.services.metrics import HTTP_REQUEST_DURATION, HTTP_REQUESTS_IN_PROGRESS
+from src.services.tracing import TRACEPARENT_HEADER, SpanContext, span
+
+
+class MetricsMiddleware:
+    """Time every HTTP request, labelled by route template rather than raw path."""
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        status_code = 500
+        
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+        
+        started = time.perf_counter()
+        HTTP_REQUESTS_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUESTS_IN_PROGRESS.dec()
+            # Set by the router once a route matched
+            route = scope.get("route")
+            HTTP_REQUEST_DURATION.labels(
+                scope["method"], route.path if route else "unmatched", str(status_code)
+            ).observe(time.perf_counter() - started)
+
+
+class TracingMiddleware:
+    """Run every HTTP request as a span, continuing the client's ``traceparent``.
+    
+    The response carries the request span's ``traceparent`` so a client can
+    find its trace; tasks queued by the request continue it.
+    """
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        header = dict(scope["headers"]).get(TRACEPARENT_HEADER.encode())
+        parent = SpanContext.parse(header.decode("latin-1")) if header else None
+        with span("http_request", parent, method=scope["method"], path=scope["path"]) as context:
+            async def send_with_traceparent(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        (TRACEPARENT_HEADER.encode(), context.to_header().encode())
+                    ]
+                await send(message)
+            
+            await self.app(scope, receive, send_with_traceparent)
@@ -1,45 +1,59 @@
 """Health check routes."""
 
 from datetime import datetime
-from fastapi import APIRouter, Depends
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import text
-from src.api.dependencies import get_db
-from src.api.schemas import HealthResponse
-from src.services.rabbitmq_service import rabbitmq_service
-from src.services.logger import get_logger
-
-logger = get_logger(__name__)
+from typing import Any, Dict, Union
+from fastapi import APIRouter, Query
+from fastapi.responses import JSONResponse
+from src.api.schemas import CheckStatus, HealthResponse, ProbeResponse
+from src.database.connection import pool_stats
+from src.services.health import health_prober
 
 router = APIRouter(tags=["health"])
 
 
-@router.get("/health", response_model=HealthResponse)
-async def health_check(db: AsyncSession = Depends(get_db)):
-    """Check service health including database and RabbitMQ."""
-    services = {
-        "database": False,
-        "rabbitmq": False
-    }
-    
-    # Check database
-    try:
-        await db.execute(text("SELECT 1"))
-        services["database"] = True
-    except Exception as e:
-        logger.error(f"Database health check failed: {e}")
-    
-    # Check RabbitMQ
-    try:
-        services["rabbitmq"] = await rabbitmq_service.is_healthy()
-    except Exception as e:
-        logger.error(f"RabbitMQ health check failed: {e}")
+@router.get("/livez", response_model=ProbeResponse)
+async def liveness() -> ProbeResponse:
+    """Liveness probe: the process answers requests; dependencies are not checked."""
+    return ProbeResponse(status="alive")
+
+
+@router.get("/readyz", response_model=ProbeResponse, responses={503: {"model": ProbeResponse}})
+async def readiness() -> Union[ProbeResponse, JSONResponse]:
+    """Readiness probe answered from the cached results of the background checks."""
+    ready, checks = health_prober.readiness()
+    response = ProbeResponse(
+        status="ready" if ready else "unready",
+        checks={name: CheckStatus(**check) for name, check in checks.items()}
+    )
+    if not ready:
+        return JSONResponse(status_code=503, content=response.model_dump())
+    return response
+
+
+@router.get("/health", response_model=HealthResponse, response_model_exclude_none=True)
+async def health_check(
+    deep: bool = Query(False, description="Add queue depths and database pool usage")
+) -> HealthResponse:
+    """Check service health including database and RabbitMQ.
     
-    # Determine overall status
-    overall_status = "healthy" if all(services.values()) else "unhealthy"
+    Answered from the cached results of the background checks, like
+    ``/readyz``; meant for operators, while orchestrators should poll
+    ``/livez`` and ``/readyz``.
+    """
+    ready, checks = health_prober.readiness()
+    services = {name: bool(check["ok"]) for name, check in checks.items()}
     
     return HealthResponse(
-        status=overall_status,
+        status="healthy" if ready else "unhealthy",
         services=services,
-        timestamp=datetime.utcnow()
+        timestamp=datetime.utcnow(),
+        details=_details(checks) if deep else None
     )
+
+
+def _details(checks: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Queue depths and consumers, database pool usage and the background check state."""
+    details: Dict[str, Any] = {"database_pool": pool_stats()}
+    details["queues"] = health_prober.reports_state.get("queues", {"error": "Not collected yet"})
+    details["checks"] = checks
+    return details
@@ -1,10 +1,44 @@
 """Image routes for FastAPI."""
 
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+import asyncio
+import json
+from datetime import timezone
+from typing import Any, AsyncIterator, Dict, List, Literal, Optional, Union
+from fastapi import (
+    APIRouter,
+    Depends,
+    File,
+    HTTPException,
+    Query,
+    Response,
+    UploadFile,
+    WebSocket,
+    WebSocketDisconnect,
+)
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from src.api.dependencies import get_db
-from src.api.schemas import ImageResponse, ImageCreateResponse
+from src.api.schemas import (
+    BatchUploadResponse,
+    BatchUploadResult,
+    BulkImageRequest,
+    BulkImageResponse,
+    ImageDebugResponse,
+    ImageResponse,
+    ImageTimings,
+    ImageCreateResponse,
+    ImageListResponse,
+)
+from src.config import settings
+from src.services.image_cache import FINAL_STATUSES, canonical_id, image_cache
+from src.services.image_processor import ImageProcessor
 from src.services.image_service import ImageService
+from src.services.rabbitmq_service import rabbitmq_service
+from src.services.render_cache import RenderCache, render_cache
+from src.services.status_events import Subscription, status_event_bus
+from src.services.metrics import UPLOAD_DURATION
+from src.services.pack_storage import is_packed
+from src.services.storage import storage
 from src.models.image import ImageStatus
 from src.services.logger import get_logger
 
@@ -12,6 +46,214 @@ logger = get_logger(__name__)
 
 router = APIRouter(prefix="/images", tags=["images"])
 
+# Status of the event published when an image is deleted
+DELETED = "DELETED"
+
+
+def _static_url(path: str) -> str:
+    """Public URL of a stored file."""
+    if is_packed(path):
+        # Packed thumbnails only exist on the API's disk
+        return f"/static/{path}"
+    return storage.url(path)
+
+
+def _image_payload(image: Any, variants: Optional[List[Any]] = None) -> Dict[str, Any]:
+    """Public representation of an image row (ORM object or selected row).
+    
+    Selected rows carry no variants, so theirs are passed in ``variants``;
+    ORM objects load them eagerly.
+    """
+    if variants is None:
+        variants = image.variants
+    thumbnail_paths = {
+        variant.size_name: variant.path
+        for variant in variants if variant.status == ImageStatus.DONE
+    }
+    return _build_payload(
+        str(image.id),
+        image.status,
+        image.original_path,
+        thumbnail_paths,
+        {
+            variant.size_name: {"status": variant.status, "path": variant.path}
+            for variant in variants
+        }
+    )
+
+
+def _event_payload(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Public representation of an image built from a status event."""
+    thumbnail_paths = event.get("thumbnail_paths") or {}
+    # Without fan-out the event only lists the finished thumbnails
+    variants = event.get("variants") or {
+        size_name: {"status": ImageStatus.DONE, "path": path}
+        for size_name, path in thumbnail_paths.items()
+    }
+    return _build_payload(
+        event["image_id"],
+        event["status"],
+        event.get("original_path"),
+        thumbnail_paths,
+        variants
+    )
+
+
+def _build_payload(
+    image_id: str,
+    status: str,
+    original_path: Optional[str],
+    thumbnail_paths: Dict[str, Optional[str]],
+    variants: Optional[Dict[str, Dict[str, Optional[str]]]] = None
+) -> Dict[str, Any]:
+    """Response payload shared by all image endpoints."""
+    
+    # Build thumbnail URLs
+    thumbnails = {
+        size_name: _static_url(path)
+        for size_name, path in thumbnail_paths.items() if path
+    }
+    
+    return {
+        "id": image_id,
+        "status": status,
+        "original_url": (
+            _static_url(original_path)
+            if status == ImageStatus.DONE and original_path else None
+        ),
+        "thumbnails": thumbnails,
+        "variants": {
+            size_name: {
+                "status": variant["status"],
+                "url": _static_url(variant["path"]) if variant["path"] else None
+            }
+            for size_name, variant in (variants or {}).items()
+        }
+    }
+
+
+async def _load_payload(db: AsyncSession, image_id: str) -> Optional[Dict[str, Any]]:
+    """Payload of an image from the response cache or the database."""
+    payload = image_cache.get(image_id)
+    if payload is None:
+        # Taken first: an invalidation during the read keeps the payload out
+        generation = image_cache.generation()
+        image = await ImageService.get_image(db, image_id)
+        if not image:
+            return None
+        
+        payload = _image_payload(image)
+        image_cache.put(image_id, payload, generation)
+    return payload
+
+
+async def _wait_for_final(
+    subscription: Subscription,
+    payload: Dict[str, Any],
+    timeout: float
+) -> Optional[Dict[str, Any]]:
+    """Wait for DONE/ERROR, returning the latest payload (``None`` if deleted)."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while payload["status"] not in FINAL_STATUSES:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        event = await subscription.get(timeout=remaining)
+        if event is None:
+            break
+        if event["status"] == DELETED:
+            return None
+        payload = _event_payload(event)
+    return payload
+
+
+def _event_key(image_id: str) -> str:
+    """Canonical id form used by status events (invalid ids are kept as is)."""
+    return canonical_id(image_id)
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _sse_stream(subscription: Subscription, payload: Dict[str, Any]) -> AsyncIterator[str]:
+    """Stream status changes of one image until it is DONE, ERROR or deleted."""
+    with subscription:
+        yield _sse("status", payload)
+        while payload["status"] not in FINAL_STATUSES:
+            event = await subscription.get(timeout=settings.EVENTS_KEEPALIVE_INTERVAL)
+            if event is None:
+                # Comment line keeps proxies from closing an idle stream
+                yield ": keepalive\n\n"
+                continue
+            if event["status"] == DELETED:
+                yield _sse("deleted", {"id": event["image_id"]})
+                return
+            payload = _event_payload(event)
+            yield _sse("status", payload)
+
+
+async def _bulk_status(db: AsyncSession, image_ids: List[str]) -> JSONResponse:
+    """Resolve many image ids with one query and serialize without models."""
+    if len(image_ids) > settings.BULK_LOOKUP_MAX_IDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many ids. Max per request: {settings.BULK_LOOKUP_MAX_IDS}"
+        )
+    
+    rows, variants = await ImageService.get_image_statuses(db, image_ids)
+    images = [_image_payload(row, variants.get(row.id, [])) for row in rows]
+    found = {image["id"] for image in images}
+    
+    # Ids may come in any form uuid.UUID accepts; images carry the canonical one
+    missing = [image_id for image_id in image_ids if _event_key(image_id) not in found]
+    return JSONResponse({
+        "images": images,
+        "missing": list(dict.fromkeys(missing))
+    })
+
+
+@router.get("", response_model=Union[BulkImageResponse, ImageListResponse])
+@router.get(
+    "/",
+    response_model=Union[BulkImageResponse, ImageListResponse],
+    include_in_schema=False
+)
+async def get_images(
+    ids: Optional[List[str]] = Query(
+        None, description="Image ids, comma-separated or repeated"
+    ),
+    status: Optional[ImageStatus] = Query(None, description="List only images in this status"),
+    after: Optional[str] = Query(None, description="Cursor from the previous page"),
+    limit: int = Query(settings.LIST_DEFAULT_LIMIT, ge=1, le=settings.LIST_MAX_LIMIT),
+    db: AsyncSession = Depends(get_db)
+) -> JSONResponse:
+    """Get the status of many images at once, or list images page by page.
+    
+    With ``ids`` the given images are looked up. Otherwise images are listed
+    newest first; pass ``next_cursor`` of a page as ``after`` to get the next.
+    """
+    if ids is not None:
+        image_ids = [image_id for value in ids for image_id in value.split(",") if image_id]
+        return await _bulk_status(db, image_ids)
+    
+    images, next_cursor = await ImageService.list_images(db, status, after, limit)
+    return JSONResponse({
+        "images": [_image_payload(image) for image in images],
+        "next_cursor": next_cursor
+    })
+
+
+@router.post("/lookup", response_model=BulkImageResponse)
+async def lookup_images(
+    request: BulkImageRequest,
+    db: AsyncSession = Depends(get_db)
+) -> JSONResponse:
+    """Get the status of many images at once (for id sets too long for a URL)."""
+    return await _bulk_status(db, request.ids)
+
 
 @router.post("/", response_model=ImageCreateResponse)
 async def upload_image(
@@ -20,12 +262,18 @@ async def upload_image(
 ):
     """Upload and process image."""
     try:
-        image = await ImageService.create_image(db, file)
+        with UPLOAD_DURATION.labels("single").time():
+            image = await ImageService.create_image(db, file)
+        
+        if image.status == ImageStatus.DONE:
+            message = "Image uploaded successfully, thumbnails reused from identical content"
+        else:
+            message = "Image uploaded successfully and queued for processing"
         
         return ImageCreateResponse(
             id=str(image.id),
             status=image.status,
-            message="Image uploaded successfully and queued for processing"
+            message=message
         )
     except HTTPException:
         raise
@@ -34,29 +282,302 @@ async def upload_image(
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
-@router.get("/{image_id}", response_model=ImageResponse)
+@router.post("/batch", response_model=BatchUploadResponse)
+async def upload_images_batch(
+    files: List[UploadFile] = File(...),
+    db: AsyncSession = Depends(get_db)
+) -> BatchUploadResponse:
+    """Upload many images in one request.
+    
+    Rows are inserted in a single transaction and tasks are published as one
+    pipelined batch; each file gets its own result or error.
+    """
+    try:
+        with UPLOAD_DURATION.labels("batch").time():
+            results = await ImageService.create_images(db, files)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Unexpected error uploading batch: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+    
+    failed = sum(1 for result in results if result["error"])
+    return BatchUploadResponse(
+        results=[BatchUploadResult(**result) for result in results],
+        succeeded=len(results) - failed,
+        failed=failed
+    )
+
+
+@router.get("/cache/stats")
+async def get_cache_stats() -> Dict[str, Any]:
+    """Hit/miss counters of this replica's image response cache."""
+    return image_cache.stats()
+
+
+@router.websocket("/ws")
+async def image_events_ws(
+    websocket: WebSocket,
+    db: AsyncSession = Depends(get_db)
+) -> None:
+    """Push status changes of many images over one WebSocket.
+    
+    Clients send ``{"subscribe": [ids]}`` or ``{"unsubscribe": [ids]}``.
+    Each subscribe is answered with the current state of the ids (one bulk
+    query); afterwards only status events are pushed. Ids are dropped once
+    they reach DONE or ERROR.
+    """
+    await websocket.accept()
+    with status_event_bus.subscribe() as subscription:
+        receive = asyncio.create_task(websocket.receive_json())
+        event = asyncio.create_task(subscription.get())
+        try:
+            while True:
+                done, _ = await asyncio.wait(
+                    {receive, event}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if receive in done:
+                    try:
+                        message = receive.result()
+                    except ValueError:
+                        await websocket.send_json({"event": "error", "detail": "Invalid JSON"})
+                    else:
+                        await _ws_command(websocket, db, subscription, message)
+                    receive = asyncio.create_task(websocket.receive_json())
+                if event in done:
+                    # Without a timeout get() never returns None
+                    pushed = event.result()
+                    if pushed is not None:
+                        await _ws_push(websocket, subscription, pushed)
+                    event = asyncio.create_task(subscription.get())
+        except WebSocketDisconnect:
+            pass
+        finally:
+            receive.cancel()
+            event.cancel()
+
+
+async def _ws_command(
+    websocket: WebSocket,
+    db: AsyncSession,
+    subscription: Subscription,
+    message: Any
+) -> None:
+    """Apply one subscribe/unsubscribe message from a WebSocket client."""
+    subscribe = unsubscribe = None
+    if isinstance(message, dict):
+        subscribe = message.get("subscribe") or []
+        unsubscribe = message.get("unsubscribe") or []
+    if not isinstance(unsubscribe, list) or not isinstance(subscribe, list):
+        await websocket.send_json({
+            "event": "error",
+            "detail": 'Expected {"subscribe": [ids]} or {"unsubscribe": [ids]}'
+        })
+        return
+    
+    subscription.remove([_event_key(str(image_id)) for image_id in unsubscribe])
+    
+    image_ids = [_event_key(str(image_id)) for image_id in subscribe]
+    if not image_ids:
+        return
+    if len(subscription.image_ids) + len(image_ids) > settings.BULK_LOOKUP_MAX_IDS:
+        await websocket.send_json({
+            "event": "error",
+            "detail": f"Too many ids. Max per connection: {settings.BULK_LOOKUP_MAX_IDS}"
+        })
+        return
+    
+    # Subscribe before reading so no event can slip in between
+    subscription.add(image_ids)
+    rows, variants = await ImageService.get_image_statuses(db, image_ids)
+    # Release the pooled connection while the socket idles
+    await db.commit()
+    
+    found = set()
+    for row in rows:
+        payload = _image_payload(row, variants.get(row.id, []))
+        found.add(payload["id"])
+        await websocket.send_json({"event": "status", "image": payload})
+        if payload["status"] in FINAL_STATUSES:
+            subscription.remove([payload["id"]])
+    
+    missing = [image_id for image_id in image_ids if image_id not in found]
+    if missing:
+        subscription.remove(missing)
+        await websocket.send_json({"event": "missing", "ids": missing})
+
+
+async def _ws_push(
+    websocket: WebSocket,
+    subscription: Subscription,
+    event: Dict[str, Any]
+) -> None:
+    """Forward one status event to a WebSocket client."""
+    image_id = event["image_id"]
+    if event["status"] == DELETED:
+        subscription.remove([image_id])
+        await websocket.send_json({"event": "deleted", "id": image_id})
+        return
+    
+    payload = _event_payload(event)
+    if payload["status"] in FINAL_STATUSES:
+        subscription.remove([image_id])
+    await websocket.send_json({"event": "status", "image": payload})
+
+
+@router.get("/{image_id}", response_model=Union[ImageResponse, ImageDebugResponse])
 async def get_image(
     image_id: str,
+    wait: float = Query(
+        0,
+        ge=0,
+        le=settings.EVENTS_MAX_WAIT,
+        description="Seconds to wait for DONE/ERROR before answering"
+    ),
+    debug: Optional[Literal["timings"]] = Query(
+        None,
+        description="timings: add the processing timing breakdown (read from the database)"
+    ),
     db: AsyncSession = Depends(get_db)
 ):
-    """Get image information by ID."""
+    """Get image information by ID.
+    
+    With ``wait`` the request is held until the image is processed, answered
+    by the worker's completion event rather than by re-reading the row.
+    """
+    if not wait:
+        payload = await _load_payload(db, image_id)
+    else:
+        # Subscribe before reading so no event can slip in between
+        with status_event_bus.subscribe([_event_key(image_id)]) as subscription:
+            payload = await _load_payload(db, image_id)
+            if payload is not None and payload["status"] not in FINAL_STATUSES:
+                # Release the pooled connection before waiting
+                await db.commit()
+                payload = await _wait_for_final(subscription, payload, wait)
+    
+    if payload is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    if debug == "timings":
+        image = await ImageService.get_image(db, image_id)
+        if image is None:
+            raise HTTPException(status_code=404, detail="Image not found")
+        return ImageDebugResponse(**_image_payload(image), timings=_timings_view(image))
+    
+    return ImageResponse(**payload)
+
+
+def _timings_view(image: Any) -> Optional[ImageTimings]:
+    """Stored processing milestones as offsets from the upload."""
+    if not image.timings:
+        return None
+    
+    origin = image.created_at.replace(tzinfo=timezone.utc).timestamp()
+    marks = sorted(
+        (
+            (name, value) for name, value in image.timings.items()
+            if isinstance(value, (int, float))
+        ),
+        key=lambda mark: mark[1]
+    )
+    stages_ms = {}
+    previous = origin
+    for name, value in marks:
+        stages_ms[name] = round((value - previous) * 1000, 1)
+        previous = value
+    return ImageTimings(
+        trace_id=image.timings.get("trace_id"),
+        marks_ms={name: round((value - origin) * 1000, 1) for name, value in marks},
+        stages_ms=stages_ms
+    )
+
+
+@router.get(
+    "/{image_id}/events",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"text/event-stream": {}}}}
+)
+async def image_events(
+    image_id: str,
+    db: AsyncSession = Depends(get_db)
+) -> StreamingResponse:
+    """Stream status changes of an image as server-sent events.
+    
+    The current state is sent first; the stream ends once the image is
+    DONE, ERROR or deleted.
+    """
+    subscription = status_event_bus.subscribe([_event_key(image_id)])
+    try:
+        payload = await _load_payload(db, image_id)
+        # Release the pooled connection for the lifetime of the stream
+        await db.commit()
+    except BaseException:
+        subscription.close()
+        raise
+    
+    if payload is None:
+        subscription.close()
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    return StreamingResponse(
+        _sse_stream(subscription, payload),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.delete("/{image_id}", status_code=204, response_class=Response)
+async def delete_image(
+    image_id: str,
+    db: AsyncSession = Depends(get_db)
+) -> Response:
+    """Delete an image; stored files shared with other images are kept."""
+    if not await ImageService.delete_image(db, image_id):
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    # Other replicas drop their cached copy on the event
+    await rabbitmq_service.publish_status_event(image_id, DELETED)
+    
+    return Response(status_code=204)
+
+
+@router.get(
+    "/{image_id}/render",
+    response_class=Response,
+    responses={200: {"content": {"image/jpeg": {}}}}
+)
+async def render_image(
+    image_id: str,
+    w: int = Query(..., ge=1, le=settings.RENDER_MAX_DIMENSION),
+    h: int = Query(..., ge=1, le=settings.RENDER_MAX_DIMENSION),
+    fit: Literal["cover", "contain", "fill"] = "cover",
+    db: AsyncSession = Depends(get_db)
+) -> Response:
+    """Render an arbitrary-size variant of the original on demand."""
     image = await ImageService.get_image(db, image_id)
     
     if not image:
         raise HTTPException(status_code=404, detail="Image not found")
     
-    # Build thumbnail URLs
-    thumbnails = {}
-    if image.thumbnail_100_path:
-        thumbnails["100x100"] = f"/static/thumbnails/{image_id}_100x100.jpg"
-    if image.thumbnail_300_path:
-        thumbnails["300x300"] = f"/static/thumbnails/{image_id}_300x300.jpg"
-    if image.thumbnail_1200_path:
-        thumbnails["1200x1200"] = f"/static/thumbnails/{image_id}_1200x1200.jpg"
-    
-    return ImageResponse(
-        id=str(image.id),
-        status=image.status,
-        original_url=f"/static/originals/{image.original_filename}" if image.status == ImageStatus.DONE else None,
-        thumbnails=thumbnails
+    key = RenderCache.key(str(image.id), w, h, fit)
+    location = str(image.original_path)
+    
+    async def render() -> bytes:
+        # Only on a cache miss: from S3 this downloads the original
+        async with storage.local_file(location) as original_path:
+            return await asyncio.to_thread(
+                ImageProcessor.render_variant, original_path, w, h, fit
+            )
+    
+    try:
+        data = await render_cache.get_or_render(key, render)
+    except Exception as e:
+        logger.error(f"Failed to render {key}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to render image")
+    
+    return Response(
+        content=data,
+        media_type="image/jpeg",
+        headers={"Cache-Control": "public, max-age=86400"}
     )
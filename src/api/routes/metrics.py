@@ -0,0 +1,12 @@
+"""Metrics route."""
+
+from fastapi import APIRouter, Response
+from src.services.metrics import CONTENT_TYPE, registry
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics() -> Response:
+    """Expose metrics in the Prometheus text format."""
+    return Response(registry.render(), headers={"Content-Type": CONTENT_TYPE})
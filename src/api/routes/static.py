@@ -0,0 +1,229 @@
+"""Routes serving stored originals and thumbnails."""
+
+import asyncio
+import hashlib
+import mimetypes
+from typing import Dict, Optional, Tuple
+from urllib.parse import quote
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+from src.config import settings
+from src.services.pack_storage import is_packed, pack_store, packed_name
+from src.services.storage import storage
+
+router = APIRouter(prefix="/static", tags=["static"])
+
+
+class FileRangeResponse(Response):
+    """A local file, or a byte range of it, read in chunks off the event loop.
+    
+    uvicorn offers no ``sendfile`` path to ASGI apps; zero-copy serving is
+    left to a fronting proxy (``STATIC_ACCEL_REDIRECT_PREFIX``).
+    """
+    
+    chunk_size = 64 * 1024
+    
+    def __init__(
+        self,
+        path: str,
+        offset: int,
+        count: int,
+        status_code: int = 200,
+        headers: Optional[Dict[str, str]] = None,
+        media_type: Optional[str] = None,
+        send_body: bool = True
+    ):
+        self.path = path
+        self.offset = offset
+        self.count = count
+        self.send_body = send_body
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = None
+        self.init_headers({**(headers or {}), "content-length": str(count)})
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers
+        })
+        if not self.send_body or not self.count:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        
+        f = await asyncio.to_thread(open, self.path, "rb")
+        try:
+            f.seek(self.offset)
+            remaining = self.count
+            while remaining > 0:
+                chunk = await asyncio.to_thread(f.read, min(self.chunk_size, remaining))
+                remaining = remaining - len(chunk) if chunk else 0
+                await send({
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": remaining > 0
+                })
+        finally:
+            f.close()
+
+
+def _etag(key: str) -> str:
+    """Strong ETag of a stored file.
+    
+    Originals are named by their content hash and thumbnails carry one in
+    their name, so the key identifies the bytes and the tag needs no I/O.
+    """
+    return '"' + hashlib.md5(key.encode(), usedforsecurity=False).hexdigest() + '"'
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    """Whether an ``If-None-Match`` header matches ``etag`` (weak comparison)."""
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+def _parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Inclusive byte range of a single-range ``Range`` header.
+    
+    Returns ``None`` when the whole file should be sent (no, malformed or
+    multi-range header) and raises ``ValueError`` when it is unsatisfiable.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, separator, end_text = header[len("bytes="):].strip().partition("-")
+    if (
+        not separator
+        or not (start_text or end_text)
+        # isdigit() alone also accepts digits int() rejects, such as "²"
+        or (start_text and not (start_text.isascii() and start_text.isdigit()))
+        or (end_text and not (end_text.isascii() and end_text.isdigit()))
+    ):
+        return None
+    
+    if not start_text:
+        # Suffix range: the last N bytes
+        length = int(end_text)
+        if not length or not size:
+            raise ValueError("Range not satisfiable")
+        return max(size - length, 0), size - 1
+    
+    start = int(start_text)
+    end = int(end_text) if end_text else size - 1
+    if end_text and end < start:
+        return None
+    if start >= size:
+        raise ValueError("Range not satisfiable")
+    return start, min(end, size - 1)
+
+
+def _requested_range(request: Request, size: int, headers: Dict[str, str]) -> Tuple[int, int, int]:
+    """Status code, offset and length to send, honouring ``Range`` and ``If-Range``.
+    
+    Adds ``Content-Range`` to ``headers`` for partial responses and raises
+    ``ValueError`` when the range is unsatisfiable.
+    """
+    if_range = request.headers.get("if-range")
+    if if_range and if_range != headers["ETag"]:
+        return 200, 0, size
+    byte_range = _parse_range(request.headers.get("range"), size)
+    if byte_range is None:
+        return 200, 0, size
+    
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return 206, start, end - start + 1
+
+
+def _packed_response(
+    request: Request,
+    data: bytes,
+    headers: Dict[str, str],
+    media_type: str
+) -> Response:
+    """Response for a thumbnail sliced out of the pack store."""
+    try:
+        status_code, offset, count = _requested_range(request, len(data), headers)
+    except ValueError:
+        return Response(
+            status_code=416, headers={**headers, "Content-Range": f"bytes */{len(data)}"}
+        )
+    
+    if request.method == "HEAD":
+        headers["Content-Length"] = str(count)
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+    return Response(
+        data[offset:offset + count],
+        status_code=status_code,
+        headers=headers,
+        media_type=media_type
+    )
+
+
+@router.api_route("/{key:path}", methods=["GET", "HEAD"])
+async def get_file(key: str, request: Request) -> Response:
+    """Serve a stored file by its storage key (``thumbnails/ab/cd/<name>``).
+    
+    Files never change once written, so responses are cacheable forever
+    and ``If-None-Match`` is answered from the key alone. Single byte ranges
+    are supported. With ``STATIC_ACCEL_REDIRECT_PREFIX`` the bytes are left
+    to a fronting proxy (``X-Accel-Redirect``). Keys under ``pack/`` are
+    sliced out of the pack store.
+    """
+    packed = is_packed(key)
+    location = None if packed else storage.resolve(key)
+    if location is None and not packed:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    etag = _etag(key)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={settings.STATIC_MAX_AGE}, immutable",
+        "Accept-Ranges": "bytes"
+    }
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    media_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+    if packed:
+        data = await asyncio.to_thread(pack_store.get, packed_name(key))
+        if data is None:
+            raise HTTPException(status_code=404, detail="File not found")
+        return _packed_response(request, data, headers, media_type)
+    # Every other key was resolved above
+    assert location is not None
+    
+    if settings.STATIC_ACCEL_REDIRECT_PREFIX:
+        headers["X-Accel-Redirect"] = (
+            f"{settings.STATIC_ACCEL_REDIRECT_PREFIX.rstrip('/')}/{quote(key)}"
+        )
+        return Response(headers=headers, media_type=media_type)
+    
+    size = await storage.size(location)
+    if size is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    try:
+        status_code, offset, count = _requested_range(request, size, headers)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    
+    send_body = request.method != "HEAD"
+    local_path = storage.local_path(location)
+    if local_path is not None:
+        return FileRangeResponse(
+            local_path, offset, count, status_code, headers, media_type, send_body
+        )
+    
+    headers["Content-Length"] = str(count)
+    if not send_body:
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+    return StreamingResponse(
+        storage.read(location, offset=offset, length=count),
+        status_code=status_code,
+        headers=headers,
+        media_type=media_type
+    )
@@ -1,22 +1,60 @@
 """Pydantic schemas for API."""
 
 from datetime import datetime
-from typing import Optional, Dict
+from typing import Any, Optional, Dict, List
 from pydantic import BaseModel
 from src.models.image import ImageStatus
 
 
+class VariantResponse(BaseModel):
+    """Status and URL of one thumbnail size."""
+    status: ImageStatus
+    url: Optional[str] = None
+
+
 class ImageResponse(BaseModel):
     """Response model for image data."""
     id: str
     status: ImageStatus
     original_url: Optional[str] = None
     thumbnails: Dict[str, Optional[str]] = {}
+    variants: Dict[str, VariantResponse] = {}
     
     class Config:
         from_attributes = True
 
 
+class ImageTimings(BaseModel):
+    """Where the processing time of an image went (``?debug=timings``)."""
+    trace_id: Optional[str] = None
+    # Milliseconds from the upload to each milestone, in order
+    marks_ms: Dict[str, float] = {}
+    # Milliseconds from the previous milestone to each one
+    stages_ms: Dict[str, float] = {}
+
+
+class ImageDebugResponse(ImageResponse):
+    """Image data with its processing timings."""
+    timings: Optional[ImageTimings] = None
+
+
+class BulkImageRequest(BaseModel):
+    """Request model for bulk status lookup."""
+    ids: List[str]
+
+
+class BulkImageResponse(BaseModel):
+    """Response model for bulk status lookup."""
+    images: List[ImageResponse]
+    missing: List[str]
+
+
+class ImageListResponse(BaseModel):
+    """Response model for one page of the image listing."""
+    images: List[ImageResponse]
+    next_cursor: Optional[str] = None
+
+
 class ImageCreateResponse(BaseModel):
     """Response model for image creation."""
     id: str
@@ -27,8 +65,39 @@ class ImageCreateResponse(BaseModel):
         from_attributes = True
 
 
+class BatchUploadResult(BaseModel):
+    """Per-file result of a batch upload."""
+    filename: Optional[str] = None
+    id: Optional[str] = None
+    status: Optional[ImageStatus] = None
+    error: Optional[str] = None
+
+
+class BatchUploadResponse(BaseModel):
+    """Response model for batch upload."""
+    results: List[BatchUploadResult]
+    succeeded: int
+    failed: int
+
+
 class HealthResponse(BaseModel):
     """Response model for health check."""
     status: str
     services: Dict[str, bool]
     timestamp: datetime
+    # Queue depths and database pool usage (``?deep=1``)
+    details: Optional[Dict[str, Any]] = None
+
+
+class CheckStatus(BaseModel):
+    """Cached outcome of one background dependency check."""
+    ok: bool
+    latency_ms: Optional[float] = None
+    age_s: Optional[float] = None
+    error: Optional[str] = None
+
+
+class ProbeResponse(BaseModel):
+    """Response model for the liveness and readiness probes."""
+    status: str
+    checks: Dict[str, CheckStatus] = {}
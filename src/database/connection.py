@@ -1,8 +1,14 @@
 """Database connection and session management."""
 
+import time
+from typing import Any, Dict
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 from src.config import settings
+from src.services.metrics import DB_STATEMENT_DURATION
 
 
 class Base(DeclarativeBase):
@@ -17,6 +23,41 @@ engine = create_async_engine(
     future=True
 )
 
+
+def instrument_engine(sync_engine: Engine) -> None:
+    """Record the execution time of every statement, by SQL verb."""
+    
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _started(conn: Any, cursor: Any, statement: str, *args: Any) -> None:
+        conn.info["statement_started"] = time.perf_counter()
+    
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _finished(conn: Any, cursor: Any, statement: str, *args: Any) -> None:
+        operation = statement.split(None, 1)[0].upper() if statement.strip() else ""
+        DB_STATEMENT_DURATION.labels(operation).observe(
+            time.perf_counter() - conn.info["statement_started"]
+        )
+
+
+instrument_engine(engine.sync_engine)
+
+
+def pool_stats() -> Dict[str, Any]:
+    """Connections of the engine's pool in use, and the share of its capacity they take."""
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return {"class": type(pool).__name__}
+    # QueuePool has no public accessor for its overflow limit (-1 is unlimited)
+    max_overflow = pool._max_overflow
+    capacity = pool.size() + max_overflow if max_overflow >= 0 else None
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0),
+        "saturation": round(pool.checkedout() / capacity, 3) if capacity else None,
+    }
+
+
 # Create async session factory
 AsyncSessionLocal = async_sessionmaker(
     engine,
@@ -2,8 +2,9 @@
 
 from datetime import datetime
 from enum import Enum
-from sqlalchemy import Column, String, DateTime, Integer, Text
+from sqlalchemy import JSON, Column, ForeignKey, Index, String, DateTime, Integer, Text
 from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import relationship
 from uuid import uuid4
 from src.database.connection import Base
 
@@ -24,8 +25,7 @@ class Image(Base):
     id = Column(
         UUID(as_uuid=True),
         primary_key=True,
-        default=uuid4,
-        index=True
+        default=uuid4
     )
     
     status = Column(
@@ -38,12 +38,61 @@ class Image(Base):
     original_path = Column(String(500), nullable=False)
     original_size = Column(Integer, nullable=True)
     
-    # Thumbnail paths (JSON would be better, but keeping it simple)
-    thumbnail_100_path = Column(String(500), nullable=True)
-    thumbnail_300_path = Column(String(500), nullable=True)
-    thumbnail_1200_path = Column(String(500), nullable=True)
+    # SHA-256 of the original; rows sharing it share the stored files
+    content_hash = Column(String(64), nullable=True, index=True)
+    
+    # Probed from the header at upload time
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    format = Column(String(10), nullable=True)
     
     error_message = Column(Text, nullable=True)
     
+    # Unix times of processing milestones ("queued", "started", "decoded",
+    # "encoded_<size>", "committed") and the trace id, see ?debug=timings
+    timings = Column(JSON, nullable=True)
+    
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
     updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # One row per thumbnail size, keyed by its spec ("300x300")
+    variants = relationship(
+        "ImageVariant",
+        lazy="selectin",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+        order_by="ImageVariant.size_name"
+    )
+    
+    __table_args__ = (
+        # Keyset pagination of GET /images, with and without a status filter
+        Index("ix_images_status_created_at", "status", "created_at", "id"),
+        Index("ix_images_created_at", "created_at", "id"),
+    )
+
+
+class ImageVariant(Base):
+    """Status and output of one thumbnail size of an image.
+    
+    In fan-out mode rows are created PROCESSING with the image and finish one
+    by one; otherwise all of them are written when the image is done.
+    """
+    
+    __tablename__ = "image_variants"
+    
+    image_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("images.id", ondelete="CASCADE"),
+        primary_key=True
+    )
+    size_name = Column(String(20), primary_key=True)
+    
+    status = Column(
+        String(20),
+        nullable=False,
+        default=ImageStatus.PROCESSING
+    )
+    path = Column(String(500), nullable=True)
+    error_message = Column(Text, nullable=True)
+    
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
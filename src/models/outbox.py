@@ -0,0 +1,45 @@
+"""Outbox model for reliable task publication."""
+
+from datetime import datetime
+from sqlalchemy import BigInteger, Column, DateTime, Index, Integer, String, text
+from sqlalchemy.dialects.postgresql import UUID
+from src.database.connection import Base
+
+
+class OutboxMessage(Base):
+    """Processing task written in the same transaction as its image.
+    
+    The outbox relay publishes unsent rows to RabbitMQ and marks them sent,
+    so a task is never lost between the commit and the broker.
+    """
+    
+    __tablename__ = "outbox"
+    
+    id = Column(
+        BigInteger().with_variant(Integer, "sqlite"),
+        primary_key=True,
+        autoincrement=True
+    )
+    
+    image_id = Column(UUID(as_uuid=True), nullable=False)
+    image_path = Column(String(500), nullable=False)
+    # Lane queue chosen at upload time; NULL means QUEUE_NAME
+    queue = Column(String(100), nullable=True)
+    # Thumbnail size of a fan-out subtask; NULL means all sizes
+    variant = Column(String(20), nullable=True)
+    # W3C trace context of the upload, continued by the worker
+    traceparent = Column(String(55), nullable=True)
+    
+    # Failed publish attempts, for monitoring
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    # Error of the latest failed attempt
+    last_error = Column(String(500), nullable=True)
+    
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+    
+    __table_args__ = (
+        # Only unsent rows are scanned by the relay
+        Index("ix_outbox_unsent", "id", postgresql_where=text("sent_at IS NULL")),
+        Index("ix_outbox_sent_at", "sent_at"),
+    )
@@ -0,0 +1,161 @@
+"""Background dependency checks behind the readiness probe."""
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from sqlalchemy import text
+from src.config import settings
+from src.database.connection import AsyncSessionLocal
+from src.services.rabbitmq_service import rabbitmq_service
+from src.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Raises (or times out) when the dependency is unusable
+Check = Callable[[], Awaitable[None]]
+# Collects operator details, such as queue depths
+Report = Callable[[], Awaitable[Any]]
+
+
+async def check_database() -> None:
+    async with AsyncSessionLocal() as db:
+        await db.execute(text("SELECT 1"))
+
+
+async def check_rabbitmq() -> None:
+    # Only reads the connection state: the robust connection reconnects by itself
+    if not await rabbitmq_service.is_healthy():
+        raise ConnectionError("RabbitMQ connection is unavailable")
+
+
+@dataclass
+class CheckResult:
+    """Outcome of the latest run of a check."""
+    ok: bool
+    latency: float
+    # time.monotonic() of the end of the run
+    checked_at: float
+    error: Optional[str] = None
+
+
+class HealthProber:
+    """Run dependency checks periodically so that probes only read cached state.
+    
+    Every ``interval`` seconds all checks run concurrently, each bounded by
+    ``timeout``: a slow dependency fails its check instead of hanging the
+    probe. Results older than three intervals count as failed, so a stuck
+    prober makes the service unready rather than leaving it ready forever.
+    
+    ``reports`` run along with the checks; their latest values (or errors)
+    are kept in ``reports_state`` for ``/health?deep=1``.
+    """
+    
+    def __init__(
+        self,
+        checks: Optional[Dict[str, Check]] = None,
+        interval: Optional[float] = None,
+        timeout: Optional[float] = None,
+        reports: Optional[Dict[str, Report]] = None
+    ):
+        self.checks = checks if checks is not None else {
+            "database": check_database,
+            "rabbitmq": check_rabbitmq,
+        }
+        self.interval = settings.HEALTH_CHECK_INTERVAL if interval is None else interval
+        self.timeout = settings.HEALTH_CHECK_TIMEOUT if timeout is None else timeout
+        self.reports = reports if reports is not None else {
+            "queues": rabbitmq_service.queue_stats,
+        }
+        self.results: Dict[str, CheckResult] = {}
+        self.reports_state: Dict[str, Any] = {}
+        self._task: Optional["asyncio.Task[None]"] = None
+    
+    def start(self) -> None:
+        """Start probing in the background."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self) -> None:
+        """Stop probing; cached results go stale."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def probe_once(self) -> None:
+        """Run every check and report once and cache the results."""
+        await asyncio.gather(
+            *(self._run_check(name, check) for name, check in self.checks.items()),
+            *(self._run_report(name, report) for name, report in self.reports.items())
+        )
+    
+    async def _run_check(self, name: str, check: Check) -> None:
+        started = time.monotonic()
+        error = None
+        try:
+            await asyncio.wait_for(check(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            error = f"Timed out after {self.timeout}s"
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        finished = time.monotonic()
+        
+        previous = self.results.get(name)
+        self.results[name] = CheckResult(error is None, finished - started, finished, error)
+        # Log transitions only, not every failed probe
+        if error and (previous is None or previous.ok):
+            logger.warning(f"Health check {name} failed: {error}")
+        elif not error and previous is not None and not previous.ok:
+            logger.info(f"Health check {name} recovered")
+    
+    async def _run_report(self, name: str, report: Report) -> None:
+        try:
+            self.reports_state[name] = await asyncio.wait_for(report(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.reports_state[name] = {"error": f"Timed out after {self.timeout}s"}
+        except Exception as e:
+            self.reports_state[name] = {"error": str(e) or type(e).__name__}
+    
+    def readiness(self) -> Tuple[bool, Dict[str, Dict[str, Any]]]:
+        """Whether every check passed recently, and the cached state of each."""
+        now = time.monotonic()
+        max_age = 3 * self.interval
+        ready = bool(self.checks)
+        checks: Dict[str, Dict[str, Any]] = {}
+        for name in self.checks:
+            result = self.results.get(name)
+            if result is None:
+                ready = False
+                checks[name] = {"ok": False, "error": "Not checked yet"}
+                continue
+            age = now - result.checked_at
+            error = result.error
+            if error is None and age > max_age:
+                error = f"Last checked {age:.0f}s ago"
+            ready = ready and error is None
+            checks[name] = {
+                "ok": error is None,
+                "latency_ms": round(result.latency * 1000, 1),
+                "age_s": round(age, 1),
+                "error": error,
+            }
+        return ready, checks
+    
+    async def _run(self) -> None:
+        """Probe every ``interval`` seconds, starting right away."""
+        while True:
+            try:
+                await self.probe_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Health prober failed: {e}")
+            await asyncio.sleep(self.interval)
+
+
+# Global health prober instance
+health_prober = HealthProber()
@@ -0,0 +1,131 @@
+"""In-process cache of image responses."""
+
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from src.config import settings
+from src.models.image import ImageStatus
+from src.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Statuses that only change again when the image is deleted
+FINAL_STATUSES = {ImageStatus.DONE, ImageStatus.ERROR}
+
+
+def canonical_id(image_id: str) -> str:
+    """Canonical form of an image id (invalid ids are kept as is)."""
+    try:
+        return str(uuid.UUID(image_id))
+    except ValueError:
+        return image_id
+
+
+class ImageCache:
+    """TTL + LRU cache of ``GET /images/{id}`` payloads.
+    
+    Final (DONE/ERROR) entries live for ``final_ttl`` seconds, in-progress
+    ones only for ``pending_ttl`` so polling clients still see progress even
+    if a status event is missed. Entries are dropped early on status events.
+    
+    A payload read from the database before an invalidation must not be
+    cached after it: readers take ``generation()`` before the read and pass
+    it to ``put()``, which drops the payload if the image was invalidated
+    since.
+    """
+    
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        final_ttl: Optional[float] = None,
+        pending_ttl: Optional[float] = None
+    ):
+        self.max_entries = (
+            settings.IMAGE_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        )
+        self.final_ttl = settings.IMAGE_CACHE_FINAL_TTL if final_ttl is None else final_ttl
+        self.pending_ttl = (
+            settings.IMAGE_CACHE_PENDING_TTL if pending_ttl is None else pending_ttl
+        )
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        # Generation of the latest invalidation of recently invalidated images
+        self._invalidated: "OrderedDict[str, int]" = OrderedDict()
+        self._generation = 0
+        # Latest generation forgotten from _invalidated
+        self._forgotten = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+    
+    def get(self, image_id: str) -> Optional[Dict[str, Any]]:
+        """Return a fresh cached payload, counting the hit or miss."""
+        image_id = canonical_id(image_id)
+        entry = self._entries.get(image_id)
+        if entry is not None:
+            expires_at, payload = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(image_id)
+                self.hits += 1
+                return payload
+            del self._entries[image_id]
+        self.misses += 1
+        return None
+    
+    def generation(self) -> int:
+        """Current invalidation generation, to take before reading a payload."""
+        return self._generation
+    
+    def put(self, image_id: str, payload: Dict[str, Any], generation: Optional[int] = None) -> None:
+        """Cache a payload with a TTL chosen by its status.
+        
+        With ``generation`` (see ``generation()``), the payload is dropped if
+        the image may have been invalidated after it was read.
+        """
+        if self.max_entries <= 0:
+            return
+        ttl = self.final_ttl if payload["status"] in FINAL_STATUSES else self.pending_ttl
+        if ttl <= 0:
+            return
+        image_id = canonical_id(image_id)
+        if generation is not None and (
+            self._invalidated.get(image_id, 0) > generation or self._forgotten > generation
+        ):
+            return
+        self._entries[image_id] = (time.monotonic() + ttl, payload)
+        self._entries.move_to_end(image_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def invalidate(self, image_id: str) -> None:
+        """Drop the entry of an image, if cached, and refuse older payloads."""
+        image_id = canonical_id(image_id)
+        self._generation += 1
+        self._invalidated[image_id] = self._generation
+        self._invalidated.move_to_end(image_id)
+        while len(self._invalidated) > max(self.max_entries, 1):
+            _, self._forgotten = self._invalidated.popitem(last=False)
+        if self._entries.pop(image_id, None) is not None:
+            self.invalidations += 1
+    
+    async def handle_status_event(self, event: Dict[str, Any]) -> None:
+        """Invalidate on a status-change event from the fanout exchange."""
+        image_id = event.get("image_id")
+        if image_id:
+            self.invalidate(str(image_id))
+    
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+# Global image response cache instance
+image_cache = ImageCache()
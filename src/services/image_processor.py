@@ -1,89 +1,373 @@
 """Image processing service for creating thumbnails."""
 
-import os
-from typing import Dict, Optional
+import hashlib
+import time
+from io import BytesIO
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
 from PIL import Image, ImageOps
 from src.config import settings
-from src.services.logger import get_logger
+from src.services.pack_storage import pack_store
+from src.services.storage import storage
+from src.services.logger import get_logger, get_sampled_logger
 
 logger = get_logger(__name__)
+# Per-size messages, sampled with LOG_VARIANT_SAMPLE_RATE
+variant_logger = get_sampled_logger(f"{__name__}.variants", settings.LOG_VARIANT_SAMPLE_RATE)
+
+# Hex digits of the content hash in thumbnail file names
+THUMBNAIL_VERSION_LENGTH = 16
+
+# Leading bytes of supported formats (WebP is checked separately: RIFF....WEBP)
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+)
 
 
 class ImageProcessor:
     """Service for processing images and creating thumbnails."""
     
     @staticmethod
-    def create_thumbnails(image_id: str, original_path: str) -> Dict[str, str]:
-        """Create thumbnails for an image."""
-        thumbnails = {}
+    def create_thumbnails(
+        image_id: str,
+        original_path: str,
+        timings: Optional[Dict[str, float]] = None,
+        strict: Optional[bool] = None
+    ) -> Dict[str, str]:
+        """Create thumbnails for an image.
+        
+        The original is decoded once at reduced scale and every size is
+        resized from the previous, larger one. With ``strict`` (defaults to
+        ``settings.THUMBNAIL_STRICT``) each size is fitted from the
+        full-resolution original instead, matching the historical output.
+        Per-stage durations in seconds are recorded into ``timings``.
+        """
+        if strict is None:
+            strict = settings.THUMBNAIL_STRICT
+        if timings is None:
+            timings = {}
         
+        started = time.perf_counter()
         try:
-            # Open original image
-            with Image.open(original_path) as img:
-                # Convert to RGB if necessary (for PNG with transparency, etc.)
-                if img.mode in ('RGBA', 'LA', 'P'):
-                    background = Image.new('RGB', img.size, (255, 255, 255))
-                    if img.mode == 'P':
-                        img = img.convert('RGBA')
-                    background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                    img = background
-                elif img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # Create thumbnails for each size
-                for width, height in settings.THUMBNAIL_SIZES:
-                    size_name = f"{width}x{height}"
-                    
-                    # Create thumbnail
-                    thumbnail = img.copy()
-                    
-                    # Use ImageOps.fit to crop and resize maintaining aspect ratio
-                    thumbnail = ImageOps.fit(
-                        thumbnail, 
-                        (width, height), 
-                        Image.Resampling.LANCZOS
-                    )
-                    
-                    # Generate thumbnail filename
-                    thumbnail_filename = f"{image_id}_{size_name}.jpg"
-                    thumbnail_path = os.path.join(
-                        settings.STORAGE_PATH,
-                        "thumbnails",
-                        thumbnail_filename
-                    )
-                    
-                    # Ensure thumbnails directory exists
-                    os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
-                    
-                    # Save thumbnail with optimization
-                    thumbnail.save(
-                        thumbnail_path,
-                        'JPEG',
-                        quality=85,
-                        optimize=True
-                    )
-                    
-                    thumbnails[size_name] = thumbnail_path
-                    logger.info(f"Created thumbnail {size_name} for image {image_id}")
-                
-                logger.info(f"Successfully created all thumbnails for image {image_id}")
-                return thumbnails
-                
+            if strict:
+                thumbnails = ImageProcessor._create_thumbnails_strict(
+                    image_id, original_path, timings
+                )
+            else:
+                thumbnails = ImageProcessor._create_thumbnails_cascaded(
+                    image_id, original_path, timings
+                )
         except Exception as e:
             logger.error(f"Failed to create thumbnails for image {image_id}: {e}")
             raise
+        timings["total"] = time.perf_counter() - started
+        
+        logger.info(
+            "Successfully created all thumbnails for image %s",
+            image_id,
+            extra={"timings_ms": {k: round(v * 1000, 2) for k, v in timings.items()}}
+        )
+        return thumbnails
     
     @staticmethod
-    def get_image_info(image_path: str) -> Optional[Dict]:
-        """Get image information."""
+    def create_variant(
+        image_id: str,
+        original_path: str,
+        size: Tuple[int, int],
+        timings: Optional[Dict[str, float]] = None
+    ) -> str:
+        """Create a single thumbnail size (one fan-out subtask) and return its path."""
+        if timings is None:
+            timings = {}
+        width, height = size
+        size_name = f"{width}x{height}"
+        scale = settings.THUMBNAIL_DECODE_SCALE
+        
+        started = time.perf_counter()
+        try:
+            with Image.open(original_path) as source:
+                img = ImageProcessor._decode_reduced(source, (width * scale, height * scale))
+                img = ImageProcessor._to_rgb(img)
+                timings["decode"] = time.perf_counter() - started
+                
+                stage = time.perf_counter()
+                thumbnail = img.resize(
+                    (width, height),
+                    Image.Resampling.LANCZOS,
+                    box=ImageProcessor._cover_box(img.size, (width, height))
+                )
+                timings[f"resize_{size_name}"] = time.perf_counter() - stage
+            
+            stage = time.perf_counter()
+            thumbnail_path = ImageProcessor._save_thumbnail(thumbnail, image_id, size_name)
+            timings[f"encode_{size_name}"] = time.perf_counter() - stage
+        except Exception as e:
+            logger.error(f"Failed to create thumbnail {size_name} for image {image_id}: {e}")
+            raise
+        timings["total"] = time.perf_counter() - started
+        
+        variant_logger.info(
+            "Created thumbnail %s for image %s",
+            size_name,
+            image_id,
+            extra={"timings_ms": {k: round(v * 1000, 2) for k, v in timings.items()}}
+        )
+        return thumbnail_path
+    
+    @staticmethod
+    def _create_thumbnails_cascaded(
+        image_id: str,
+        original_path: str,
+        timings: Dict[str, float]
+    ) -> Dict[str, str]:
+        """Decode once near the largest size and cascade to smaller sizes."""
+        thumbnails: Dict[str, str] = {}
+        sizes = sorted(
+            settings.THUMBNAIL_SIZES,
+            key=lambda size: size[0] * size[1],
+            reverse=True
+        )
+        largest = sizes[0]
+        scale = settings.THUMBNAIL_DECODE_SCALE
+        
+        stage = time.perf_counter()
+        with Image.open(original_path) as source:
+            img = ImageProcessor._decode_reduced(
+                source, (largest[0] * scale, largest[1] * scale)
+            )
+            img = ImageProcessor._to_rgb(img)
+            timings["decode"] = time.perf_counter() - stage
+            
+            ImageProcessor._cascade(image_id, img, sizes, thumbnails, timings)
+        
+        return thumbnails
+    
+    @staticmethod
+    def _cascade(
+        image_id: str,
+        img: Image.Image,
+        sizes: List[Tuple[int, int]],
+        thumbnails: Dict[str, str],
+        timings: Dict[str, float]
+    ) -> None:
+        """Build each size from the previous output, largest first."""
+        previous: Optional[Image.Image] = None
+        for width, height in sizes:
+            size_name = f"{width}x{height}"
+            
+            stage = time.perf_counter()
+            if previous is not None and previous.width * height == previous.height * width:
+                # Same aspect ratio: no crop needed, shrink the previous output
+                thumbnail = previous.resize((width, height), Image.Resampling.LANCZOS)
+            else:
+                # Crop and resize in one pass from the reduced decode
+                thumbnail = img.resize(
+                    (width, height),
+                    Image.Resampling.LANCZOS,
+                    box=ImageProcessor._cover_box(img.size, (width, height))
+                )
+            timings[f"resize_{size_name}"] = time.perf_counter() - stage
+            
+            stage = time.perf_counter()
+            thumbnail_path = ImageProcessor._save_thumbnail(thumbnail, image_id, size_name)
+            timings[f"encode_{size_name}"] = time.perf_counter() - stage
+            
+            thumbnails[size_name] = thumbnail_path
+            previous = thumbnail
+            variant_logger.info("Created thumbnail %s for image %s", size_name, image_id)
+    
+    @staticmethod
+    def _create_thumbnails_strict(
+        image_id: str,
+        original_path: str,
+        timings: Dict[str, float]
+    ) -> Dict[str, str]:
+        """Fit every size from the full-resolution original."""
+        thumbnails = {}
+        
+        stage = time.perf_counter()
+        with Image.open(original_path) as source:
+            source.load()
+            img = ImageProcessor._to_rgb(source)
+            timings["decode"] = time.perf_counter() - stage
+            
+            for width, height in settings.THUMBNAIL_SIZES:
+                size_name = f"{width}x{height}"
+                
+                stage = time.perf_counter()
+                # Use ImageOps.fit to crop and resize maintaining aspect ratio
+                thumbnail = ImageOps.fit(
+                    img.copy(),
+                    (width, height),
+                    Image.Resampling.LANCZOS
+                )
+                timings[f"resize_{size_name}"] = time.perf_counter() - stage
+                
+                stage = time.perf_counter()
+                thumbnail_path = ImageProcessor._save_thumbnail(thumbnail, image_id, size_name)
+                timings[f"encode_{size_name}"] = time.perf_counter() - stage
+                
+                thumbnails[size_name] = thumbnail_path
+                variant_logger.info("Created thumbnail %s for image %s", size_name, image_id)
+        
+        return thumbnails
+    
+    @staticmethod
+    def _decode_reduced(img: Image.Image, min_size: Tuple[int, int]) -> Image.Image:
+        """Decode an image at the smallest scale still covering ``min_size``.
+        
+        JPEGs use DCT scaling via ``draft``; other formats are decoded fully
+        and shrunk with the cheap box filter of ``reduce``.
+        """
+        if img.format == "JPEG":
+            img.draft("RGB", min_size)
+        img.load()
+        
+        if img.mode == "P":
+            img = img.convert("RGBA")
+        elif img.mode not in ("RGB", "RGBA", "L", "LA"):
+            img = img.convert("RGB")
+        
+        factor = min(img.width // min_size[0], img.height // min_size[1])
+        if factor > 1:
+            img = img.reduce(factor)
+        return img
+    
+    @staticmethod
+    def _to_rgb(img: Image.Image) -> Image.Image:
+        """Convert to RGB, flattening transparency onto a white background."""
+        if img.mode in ('RGBA', 'LA', 'P'):
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            if img.mode == 'P':
+                img = img.convert('RGBA')
+            background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
+            return background
+        if img.mode != 'RGB':
+            return img.convert('RGB')
+        return img
+    
+    @staticmethod
+    def _cover_box(
+        size: Tuple[int, int],
+        target: Tuple[int, int]
+    ) -> Tuple[float, float, float, float]:
+        """Centered crop box of ``size`` with the aspect ratio of ``target``."""
+        width, height = size
+        target_width, target_height = target
+        if width * target_height > height * target_width:
+            crop_width, crop_height = height * target_width / target_height, float(height)
+        else:
+            crop_width, crop_height = float(width), width * target_height / target_width
+        left = (width - crop_width) / 2
+        top = (height - crop_height) / 2
+        return (left, top, left + crop_width, top + crop_height)
+    
+    @staticmethod
+    def _save_thumbnail(thumbnail: Image.Image, image_id: str, size_name: str) -> str:
+        """Encode a thumbnail as JPEG into its staging path.
+        
+        The name carries a hash of the content (``<id>_<size>.<hash>.jpg``),
+        so a file never changes once written and its URL can be cached
+        forever. The caller hands the file to ``storage.save`` (a no-op for
+        local storage). With ``PACK_ENABLED``, thumbnails up to
+        ``PACK_MAX_VARIANT_BYTES`` are appended to the pack store instead and
+        their ``pack/`` location is returned.
+        """
+        # Save thumbnail with optimization
+        buffer = BytesIO()
+        ImageProcessor._encode_jpeg(thumbnail, buffer)
+        data = buffer.getvalue()
+        
+        version = hashlib.sha256(data).hexdigest()[:THUMBNAIL_VERSION_LENGTH]
+        name = f"{image_id}_{size_name}.{version}.jpg"
+        if settings.PACK_ENABLED and len(data) <= settings.PACK_MAX_VARIANT_BYTES:
+            return pack_store.put(name, data)
+        
+        thumbnail_path = storage.stage("thumbnails", name)
+        with open(thumbnail_path, "wb") as f:
+            f.write(data)
+        return thumbnail_path
+    
+    @staticmethod
+    def _encode_jpeg(img: Image.Image, fp: Union[str, BinaryIO]) -> None:
+        """Encode an RGB image with the service-wide JPEG settings."""
+        img.save(
+            fp,
+            'JPEG',
+            quality=85,
+            optimize=True
+        )
+    
+    @staticmethod
+    def render_variant(original_path: str, width: int, height: int, fit: str = "cover") -> bytes:
+        """Render an arbitrary-size JPEG variant of an original.
+        
+        ``fit`` is ``cover`` (crop to fill the box), ``contain`` (fit inside
+        the box keeping aspect ratio) or ``fill`` (stretch to the box).
+        """
+        scale = settings.THUMBNAIL_DECODE_SCALE
+        with Image.open(original_path) as source:
+            img = ImageProcessor._decode_reduced(source, (width * scale, height * scale))
+            img = ImageProcessor._to_rgb(img)
+            
+            if fit == "cover":
+                variant = img.resize(
+                    (width, height),
+                    Image.Resampling.LANCZOS,
+                    box=ImageProcessor._cover_box(img.size, (width, height))
+                )
+            elif fit == "contain":
+                variant = ImageOps.contain(img, (width, height), Image.Resampling.LANCZOS)
+            elif fit == "fill":
+                variant = img.resize((width, height), Image.Resampling.LANCZOS)
+            else:
+                raise ValueError(f"Unknown fit mode: {fit}")
+        
+        buffer = BytesIO()
+        ImageProcessor._encode_jpeg(variant, buffer)
+        return buffer.getvalue()
+    
+    @staticmethod
+    def sniff_format(header: bytes) -> Optional[str]:
+        """Identify a supported image format from its leading magic bytes."""
+        for magic, image_format in IMAGE_SIGNATURES:
+            if header.startswith(magic):
+                return image_format
+        if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+            return "WEBP"
+        return None
+    
+    @staticmethod
+    def probe_image(image_path: str) -> Dict:
+        """Read format, dimensions, mode and frame count without decoding pixels.
+        
+        Only the header is parsed (``Image.open`` is lazy). Raises ``ValueError``
+        when the content is not a supported image.
+        """
+        with open(image_path, "rb") as f:
+            sniffed_format = ImageProcessor.sniff_format(f.read(16))
+        if sniffed_format is None:
+            raise ValueError("Unrecognized image signature")
+        
         try:
             with Image.open(image_path) as img:
                 return {
                     "width": img.width,
                     "height": img.height,
                     "format": img.format,
-                    "mode": img.mode
+                    "mode": img.mode,
+                    "frames": getattr(img, "n_frames", 1)
                 }
+        except Image.DecompressionBombError as e:
+            raise ValueError(str(e))
+        except (OSError, SyntaxError) as e:
+            raise ValueError(f"Corrupt {sniffed_format} header: {e}")
+    
+    @staticmethod
+    def get_image_info(image_path: str) -> Optional[Dict]:
+        """Get image information."""
+        try:
+            return ImageProcessor.probe_image(image_path)
         except Exception as e:
             logger.error(f"Failed to get image info for {image_path}: {e}")
             return None
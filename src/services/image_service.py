@@ -1,13 +1,27 @@
 """Service for image operations."""
 
+import asyncio
+import base64
+import hashlib
 import os
+import tempfile
 import uuid
-from typing import Optional
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple, cast
 from fastapi import UploadFile, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from src.models.image import Image, ImageStatus
-from src.services.rabbitmq_service import rabbitmq_service
+from sqlalchemy import Row, Table, any_, bindparam, delete, insert, literal, select, text, tuple_, update
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
+from src.models.image import Image, ImageStatus, ImageVariant
+from src.models.outbox import OutboxMessage
+from src.services.image_cache import image_cache
+from src.services.image_processor import ImageProcessor
+from src.services.outbox_relay import outbox_relay
+from src.services.rabbitmq_service import lane_queue, rabbitmq_service, select_lane
+from src.services.render_cache import render_cache
+from src.services.pack_storage import is_packed, pack_store, packed_name
+from src.services.storage import storage
+from src.services.tracing import current_traceparent
 from src.config import settings
 from src.services.logger import get_logger
 
@@ -22,7 +36,254 @@ class ImageService:
         db: AsyncSession,
         file: UploadFile
     ) -> Image:
-        """Create new image record and save file."""
+        """Create new image record and save file.
+        
+        With ``OUTBOX_ENABLED`` the image is stored as PROCESSING together
+        with its outbox task in a single commit; otherwise the task is
+        published directly and the image stays NEW if that fails.
+        """
+        file_ext = ImageService._validate_upload(file)
+        temp_path, file_size, content_hash = await ImageService._receive_upload(file)
+        probe = await ImageService._admit_upload(temp_path)
+        
+        await ImageService._lock_content(db, content_hash)
+        try:
+            file_path = await ImageService._place_original(temp_path, content_hash, file_ext)
+        except HTTPException:
+            await db.rollback()
+            raise
+        
+        # Reuse thumbnails already produced for the same content
+        processed = (await ImageService._find_processed(db, [content_hash])).get(content_hash)
+        
+        if processed:
+            status = ImageStatus.DONE
+        elif settings.OUTBOX_ENABLED:
+            status = ImageStatus.PROCESSING
+        else:
+            status = ImageStatus.NEW
+        
+        # Route by decode cost so small images are not stuck behind large ones
+        queue = lane_queue(select_lane(probe["width"] * probe["height"], file_size))
+        
+        # Create database record
+        image_id = uuid.uuid4()
+        outbox_rows: List[Dict[str, Any]] = []
+        variant_rows: List[Dict[str, Any]] = []
+        if status == ImageStatus.PROCESSING:
+            outbox_rows, variant_rows = ImageService._outbox_rows(image_id, file_path, queue)
+        image = Image(
+            id=image_id,
+            status=status,
+            original_filename=file.filename,
+            original_path=file_path,
+            original_size=file_size,
+            content_hash=content_hash,
+            width=probe["width"],
+            height=probe["height"],
+            format=probe["format"],
+            variants=[
+                ImageVariant(**row)
+                for row in variant_rows + ImageService._reused_variants(processed, image_id)
+            ]
+        )
+        
+        db.add(image)
+        # The tasks commit with the row; the outbox relay publishes them
+        db.add_all([OutboxMessage(**row) for row in outbox_rows])
+        await db.commit()
+        
+        if processed:
+            logger.info("Image %s reuses thumbnails of image %s", image_id, processed.id)
+            return image
+        
+        if status == ImageStatus.PROCESSING:
+            outbox_relay.notify()
+            return image
+        
+        # Send task to queue
+        try:
+            await rabbitmq_service.send_image_processing_task(str(image_id), file_path, queue)
+            
+            # Update status to PROCESSING
+            image.status = ImageStatus.PROCESSING
+            await db.commit()
+            await db.refresh(image)
+            
+        except Exception as e:
+            logger.error(f"Failed to send processing task for image {image_id}: {e}")
+            # Keep status as NEW so it can be retried later
+        
+        return image
+    
+    @staticmethod
+    async def create_images(
+        db: AsyncSession,
+        files: List[UploadFile]
+    ) -> List[Dict[str, Any]]:
+        """Create image records for many uploads in a single transaction.
+        
+        Returns one result per file, in order, with ``filename``, ``id``,
+        ``status`` and ``error``. Files failing validation or storage get an
+        ``error`` and do not affect the rest. Identical files share one image,
+        stored and queued once, whose ``id`` each of their results carries.
+        Tasks go to the outbox in the same transaction; without the outbox,
+        rows whose task could not be published stay NEW.
+        """
+        if len(files) > settings.MAX_BATCH_FILES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Too many files. Max per batch: {settings.MAX_BATCH_FILES}"
+            )
+        
+        results: List[Dict[str, Any]] = []
+        received = []
+        for file in files:
+            result: Dict[str, Any] = {
+                "filename": file.filename, "id": None, "status": None, "error": None
+            }
+            results.append(result)
+            try:
+                file_ext = ImageService._validate_upload(file)
+                temp_path, file_size, content_hash = await ImageService._receive_upload(file)
+                probe = await ImageService._admit_upload(temp_path)
+            except HTTPException as e:
+                result["error"] = e.detail
+                continue
+            received.append((result, file_ext, temp_path, file_size, content_hash, probe))
+        
+        if not received:
+            return results
+        
+        # Lock in a stable order so concurrent batches cannot deadlock
+        content_hashes = sorted({item[4] for item in received})
+        for content_hash in content_hashes:
+            await ImageService._lock_content(db, content_hash)
+        processed_by_hash = await ImageService._find_processed(db, content_hashes)
+        
+        rows = []
+        tasks = []
+        outbox_rows = []
+        variant_rows = []
+        # Result of the image created for each content hash of this batch
+        created: Dict[str, Dict[str, Any]] = {}
+        for result, file_ext, temp_path, file_size, content_hash, probe in received:
+            first = created.get(content_hash)
+            if first is not None:
+                ImageService._unlink_files([temp_path])
+                result["id"], result["status"] = first["id"], first["status"]
+                continue
+            try:
+                file_path = await ImageService._place_original(temp_path, content_hash, file_ext)
+            except HTTPException as e:
+                result["error"] = e.detail
+                continue
+            
+            processed = processed_by_hash.get(content_hash)
+            if processed:
+                status = ImageStatus.DONE
+            elif settings.OUTBOX_ENABLED:
+                status = ImageStatus.PROCESSING
+            else:
+                status = ImageStatus.NEW
+            image_id = uuid.uuid4()
+            rows.append({
+                "id": image_id,
+                "status": status,
+                "original_filename": result["filename"],
+                "original_path": file_path,
+                "original_size": file_size,
+                "content_hash": content_hash,
+                "width": probe["width"],
+                "height": probe["height"],
+                "format": probe["format"]
+            })
+            variant_rows.extend(ImageService._reused_variants(processed, image_id))
+            result["id"] = str(image_id)
+            result["status"] = rows[-1]["status"]
+            created[content_hash] = result
+            if not processed:
+                queue = lane_queue(select_lane(probe["width"] * probe["height"], file_size))
+                tasks.append((str(image_id), file_path, queue, None))
+                if settings.OUTBOX_ENABLED:
+                    image_outbox, image_variants = ImageService._outbox_rows(
+                        image_id, file_path, queue
+                    )
+                    outbox_rows.extend(image_outbox)
+                    variant_rows.extend(image_variants)
+        
+        if rows:
+            await db.execute(insert(Image), rows)
+        if variant_rows:
+            await db.execute(insert(ImageVariant), variant_rows)
+        if outbox_rows:
+            await db.execute(insert(OutboxMessage), outbox_rows)
+        await db.commit()
+        
+        if settings.OUTBOX_ENABLED:
+            if tasks:
+                outbox_relay.notify()
+            logger.info(
+                "Created %d of %d batch images, queued %d tasks in the outbox",
+                len(rows), len(files), len(tasks)
+            )
+            return results
+        
+        # Publish the whole batch at once and mark confirmed rows PROCESSING
+        published = {
+            tasks[index][0]
+            for index in await rabbitmq_service.send_image_processing_tasks(tasks)
+        }
+        if published:
+            await db.execute(
+                update(Image)
+                .where(Image.id.in_([uuid.UUID(image_id) for image_id in published]))
+                .values(status=ImageStatus.PROCESSING)
+            )
+            await db.commit()
+            for result in results:
+                if result["id"] in published:
+                    result["status"] = ImageStatus.PROCESSING
+        
+        logger.info(
+            "Created %d of %d batch images, published %d of %d tasks",
+            len(rows), len(files), len(published), len(tasks)
+        )
+        return results
+    
+    @staticmethod
+    def _outbox_rows(
+        image_id: uuid.UUID,
+        image_path: str,
+        queue: str
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Outbox rows queuing an image, and its variant rows in fan-out mode.
+        
+        With ``VARIANT_FANOUT`` every thumbnail size is a separate task,
+        smallest first since the relay publishes in insertion order.
+        """
+        task = {
+            "image_id": image_id,
+            "image_path": image_path,
+            "queue": queue,
+            "traceparent": current_traceparent()
+        }
+        if not settings.VARIANT_FANOUT:
+            return [task], []
+        
+        sizes = sorted(settings.THUMBNAIL_SIZES, key=lambda size: size[0] * size[1])
+        size_names = [f"{width}x{height}" for width, height in sizes]
+        return (
+            [{**task, "variant": size_name} for size_name in size_names],
+            [
+                {"image_id": image_id, "size_name": size_name, "status": ImageStatus.PROCESSING}
+                for size_name in size_names
+            ]
+        )
+    
+    @staticmethod
+    def _validate_upload(file: UploadFile) -> str:
+        """Validate upload metadata and return its lower-cased extension."""
         
         # Validate file
         if not file.filename:
@@ -36,62 +297,221 @@ class ImageService:
                 detail=f"File type {file_ext} not allowed. Allowed types: {settings.ALLOWED_EXTENSIONS}"
             )
         
-        # Check file size
-        file.file.seek(0, 2)  # Go to end of file
-        file_size = file.file.tell()
-        file.file.seek(0)  # Go back to beginning
-        
-        if file_size > settings.MAX_FILE_SIZE:
+        # Reject early when the multipart parser already knows the size
+        if file.size is not None and file.size > settings.MAX_FILE_SIZE:
             raise HTTPException(
                 status_code=400, 
                 detail=f"File too large. Max size: {settings.MAX_FILE_SIZE} bytes"
             )
         
-        # Generate unique filename
-        image_id = str(uuid.uuid4())
-        file_extension = os.path.splitext(file.filename)[1]
-        filename = f"{image_id}{file_extension}"
-        file_path = os.path.join(settings.STORAGE_PATH, "originals", filename)
+        return file_ext
+    
+    @staticmethod
+    async def _receive_upload(file: UploadFile) -> Tuple[str, int, str]:
+        """Stream an upload to a temporary file outside the served directories.
+        
+        The scratch directory is on the storage filesystem, so a local
+        ``save()`` renames the file into place.
+        """
+        try:
+            return await ImageService._spool_upload(file, storage.scratch_directory)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to save file {file.filename}: {e}")
+            raise HTTPException(status_code=500, detail="Failed to save file")
+    
+    @staticmethod
+    async def _admit_upload(temp_path: str) -> Dict[str, Any]:
+        """Probe a spooled upload's header and reject unusable images.
+        
+        Invalid content and images above ``MAX_IMAGE_PIXELS`` are refused
+        here, before anything is queued or a worker pays for a full decode.
+        """
+        try:
+            probe = await asyncio.to_thread(ImageProcessor.probe_image, temp_path)
+        except ValueError as e:
+            ImageService._unlink_files([temp_path])
+            raise HTTPException(status_code=400, detail=f"Invalid image: {e}")
         
-        # Ensure directory exists
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        pixels = probe["width"] * probe["height"]
+        if pixels > settings.MAX_IMAGE_PIXELS:
+            ImageService._unlink_files([temp_path])
+            raise HTTPException(
+                status_code=400,
+                detail=(
+                    f"Image too large: {probe['width']}x{probe['height']} pixels. "
+                    f"Max: {settings.MAX_IMAGE_PIXELS} pixels"
+                )
+            )
         
-        # Save file
+        return probe
+    
+    @staticmethod
+    async def _place_original(temp_path: str, content_hash: str, file_ext: str) -> str:
+        """Move a spooled upload to its content-addressed storage location.
+        
+        Identical uploads share one original; callers hold the content lock.
+        """
+        name = f"{content_hash}{file_ext}"
         try:
-            contents = await file.read()
-            with open(file_path, "wb") as f:
-                f.write(contents)
+            return await storage.save(temp_path, "originals", name)
         except Exception as e:
-            logger.error(f"Failed to save file {filename}: {e}")
+            logger.error(f"Failed to save file {name}: {e}")
+            ImageService._unlink_files([temp_path])
             raise HTTPException(status_code=500, detail="Failed to save file")
+    
+    @staticmethod
+    async def _spool_upload(file: UploadFile, directory: str) -> Tuple[str, int, str]:
+        """Stream an upload to a temporary file in ``directory``.
         
-        # Create database record
-        image = Image(
-            id=uuid.UUID(image_id),
-            status=ImageStatus.NEW,
-            original_filename=file.filename,
-            original_path=file_path,
-            original_size=file_size
+        Chunks are hashed and written off the event loop and the size limit
+        is enforced as data arrives. Returns the temporary path, the size and
+        the SHA-256 hex digest; the caller renames the file into place.
+        """
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+        
+        digest = hashlib.sha256()
+        file_size = 0
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                while True:
+                    chunk = await file.read(settings.UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    
+                    file_size += len(chunk)
+                    if file_size > settings.MAX_FILE_SIZE:
+                        raise HTTPException(
+                            status_code=400, 
+                            detail=f"File too large. Max size: {settings.MAX_FILE_SIZE} bytes"
+                        )
+                    
+                    await asyncio.to_thread(ImageService._write_chunk, temp_file, digest, chunk)
+        except BaseException:
+            ImageService._unlink_files([temp_path])
+            raise
+        
+        return temp_path, file_size, digest.hexdigest()
+    
+    @staticmethod
+    def _write_chunk(temp_file: BinaryIO, digest: "hashlib._Hash", chunk: bytes) -> None:
+        """Hash and write one chunk (both release the GIL for large buffers)."""
+        digest.update(chunk)
+        temp_file.write(chunk)
+    
+    @staticmethod
+    def _unlink_files(paths: List[str]) -> None:
+        """Remove files, ignoring ones that are already gone."""
+        for path in paths:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+    
+    @staticmethod
+    async def _lock_content(db: AsyncSession, content_hash: str) -> None:
+        """Serialize creates and deletes of the same content.
+        
+        Uses a transaction-scoped advisory lock on PostgreSQL, released on
+        commit or rollback; other databases rely on their own locking.
+        """
+        if db.get_bind().dialect.name == "postgresql":
+            await db.execute(
+                text("SELECT pg_advisory_xact_lock(hashtextextended(:content_hash, 0))"),
+                {"content_hash": content_hash}
+            )
+    
+    @staticmethod
+    async def _find_processed(
+        db: AsyncSession,
+        content_hashes: List[str]
+    ) -> Dict[str, Image]:
+        """Find, per content hash, an image whose thumbnails are done."""
+        result = await db.execute(
+            select(Image).where(
+                Image.content_hash.in_(content_hashes),
+                Image.status == ImageStatus.DONE
+            )
         )
+        return {str(image.content_hash): image for image in result.scalars()}
+    
+    @staticmethod
+    def _reused_variants(
+        processed: Optional[Image],
+        image_id: uuid.UUID
+    ) -> List[Dict[str, Any]]:
+        """Variant rows copied from an already processed image."""
+        if not processed:
+            return []
+        return [
+            {
+                "image_id": image_id,
+                "size_name": variant.size_name,
+                "status": ImageStatus.DONE,
+                "path": variant.path
+            }
+            for variant in processed.variants
+            if variant.status == ImageStatus.DONE and variant.path
+        ]
+    
+    @staticmethod
+    async def delete_image(
+        db: AsyncSession,
+        image_id: str
+    ) -> bool:
+        """Delete an image and the stored files no other image references."""
+        image = await ImageService.get_image(db, image_id)
         
-        db.add(image)
+        if not image:
+            return False
+        
+        content_hash = str(image.content_hash) if image.content_hash else None
+        if content_hash:
+            await ImageService._lock_content(db, content_hash)
+        
+        paths = [image.original_path] + [
+            variant.path for variant in image.variants if variant.path
+        ]
+        
+        # Commit before touching files, so a failed commit leaves no row
+        # pointing at deleted files
+        await db.delete(image)
         await db.commit()
-        await db.refresh(image)
+        image_cache.invalidate(image_id)
+        await render_cache.invalidate_image(str(image.id))
         
-        # Send task to queue
+        # Files are shared by every image with the same content. The lock is
+        # taken again, so an upload of the same content committed meanwhile
+        # keeps its files.
+        if content_hash:
+            await ImageService._lock_content(db, content_hash)
         try:
-            await rabbitmq_service.send_image_processing_task(image_id, file_path)
-            
-            # Update status to PROCESSING
-            image.status = ImageStatus.PROCESSING
-            await db.commit()
-            await db.refresh(image)
+            result = await db.execute(
+                select(Image.original_path)
+                .where(Image.original_path.in_(paths))
+                .union_all(
+                    select(ImageVariant.path).where(ImageVariant.path.in_(paths))
+                )
+            )
+            referenced = {path for path, in result}
+            orphaned = [path for path in paths if path not in referenced]
             
+            await storage.delete([path for path in orphaned if not is_packed(path)])
+            await asyncio.to_thread(
+                pack_store.delete, [packed_name(path) for path in orphaned if is_packed(path)]
+            )
         except Exception as e:
-            logger.error(f"Failed to send processing task for image {image_id}: {e}")
-            # Keep status as NEW so it can be retried later
+            # The image is gone either way; leftover files are only wasted space
+            logger.error(f"Failed to delete files of image {image_id}: {e}")
+            orphaned = []
+        finally:
+            # Releases the content lock
+            await db.commit()
         
-        return image
+        logger.info(f"Deleted image {image_id} and {len(orphaned)} unreferenced files")
+        return True
     
     @staticmethod
     async def get_image(
@@ -104,11 +524,118 @@ class ImageService:
         except ValueError:
             return None
         
+        # Reload an instance already in the session so its variants are current
         result = await db.execute(
-            select(Image).where(Image.id == uuid_obj)
+            select(Image)
+            .where(Image.id == uuid_obj)
+            .execution_options(populate_existing=True)
         )
         return result.scalar_one_or_none()
     
+    @staticmethod
+    async def list_images(
+        db: AsyncSession,
+        status: Optional[ImageStatus] = None,
+        after: Optional[str] = None,
+        limit: int = 50
+    ) -> Tuple[List[Image], Optional[str]]:
+        """Page through images, newest first, optionally of one status.
+        
+        Uses keyset pagination on ``(created_at, id)``: ``after`` is the
+        cursor returned with the previous page, and every page is a range
+        scan of ``ix_images_status_created_at`` (``ix_images_created_at``
+        without a status), so deep pages cost as much as the first one.
+        Returns the page and the cursor of the next one, if any.
+        """
+        query = select(Image)
+        if status:
+            query = query.where(Image.status == status)
+        if after:
+            created_at, image_id = ImageService._decode_cursor(after)
+            query = query.where(
+                tuple_(Image.created_at, Image.id) < tuple_(
+                    literal(created_at, Image.created_at.type), literal(image_id, Image.id.type)
+                )
+            )
+        
+        # One extra row tells whether there is a next page
+        result = await db.execute(
+            query.order_by(Image.created_at.desc(), Image.id.desc()).limit(limit + 1)
+        )
+        images = list(result.scalars())
+        
+        if len(images) <= limit:
+            return images, None
+        images = images[:limit]
+        return images, ImageService._encode_cursor(images[-1])
+    
+    @staticmethod
+    def _encode_cursor(image: Image) -> str:
+        """Opaque pagination cursor pointing just past ``image``."""
+        key = f"{image.created_at.isoformat()}|{image.id}"
+        return base64.urlsafe_b64encode(key.encode()).decode().rstrip("=")
+    
+    @staticmethod
+    def _decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+        """Parse a cursor from ``_encode_cursor``."""
+        try:
+            key = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+            created_at, image_id = key.split("|")
+            return datetime.fromisoformat(created_at), uuid.UUID(image_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    @staticmethod
+    async def get_image_statuses(
+        db: AsyncSession,
+        image_ids: List[str]
+    ) -> Tuple[List[Row], Dict[uuid.UUID, List[Row]]]:
+        """Get the columns needed for status responses of many images.
+        
+        Returns the image rows and their variant rows by image id, read with
+        one query each. Invalid ids are skipped. On PostgreSQL the ids are
+        sent as a single array parameter (``id = ANY(:ids)``) so the
+        statement text, and with it asyncpg's prepared statement, is the
+        same for any number of ids.
+        """
+        uuids = []
+        for image_id in image_ids:
+            try:
+                uuids.append(uuid.UUID(image_id))
+            except ValueError:
+                continue
+        
+        if not uuids:
+            return [], {}
+        
+        def id_filter(column: Any) -> Any:
+            if db.get_bind().dialect.name == "postgresql":
+                return column == any_(
+                    bindparam("ids", list(set(uuids)), type_=ARRAY(UUID(as_uuid=True)))
+                )
+            return column.in_(set(uuids))
+        
+        result = await db.execute(
+            select(Image.id, Image.status, Image.original_path).where(id_filter(Image.id))
+        )
+        rows = list(result.all())
+        
+        variants: Dict[uuid.UUID, List[Row]] = {}
+        if rows:
+            result = await db.execute(
+                select(
+                    ImageVariant.image_id,
+                    ImageVariant.size_name,
+                    ImageVariant.status,
+                    ImageVariant.path
+                )
+                .where(id_filter(ImageVariant.image_id))
+                .order_by(ImageVariant.size_name)
+            )
+            for variant in result:
+                variants.setdefault(variant.image_id, []).append(variant)
+        return rows, variants
+    
     @staticmethod
     async def update_image_status(
         db: AsyncSession,
@@ -117,31 +644,237 @@ class ImageService:
         thumbnail_paths: Optional[dict] = None,
         error_message: Optional[str] = None
     ) -> Optional[Image]:
-        """Update image status and thumbnail paths."""
+        """Update image status and thumbnail paths.
+        
+        Issues a single ``UPDATE ... RETURNING`` instead of select, mutate,
+        commit and refresh; thumbnails are written as variant rows.
+        """
         try:
             uuid_obj = uuid.UUID(image_id)
         except ValueError:
             return None
         
         result = await db.execute(
-            select(Image).where(Image.id == uuid_obj)
+            update(Image)
+            .where(Image.id == uuid_obj)
+            .values(**ImageService._status_values(status, error_message))
+            .returning(Image)
+            .execution_options(populate_existing=True)
         )
         image = result.scalar_one_or_none()
+        if image is not None and thumbnail_paths:
+            await ImageService._replace_variants(
+                db, ImageService._done_variants(uuid_obj, thumbnail_paths)
+            )
+            await db.refresh(image, ["variants"])
+        await db.commit()
+        image_cache.invalidate(image_id)
         
-        if not image:
+        return image
+    
+    @staticmethod
+    async def set_image_status(
+        db: AsyncSession,
+        image_id: str,
+        status: ImageStatus,
+        thumbnail_paths: Optional[dict] = None,
+        error_message: Optional[str] = None,
+        timings: Optional[Dict[str, Any]] = None
+    ) -> bool:
+        """Update image status without reading the row back.
+        
+        ``timings`` replaces the stored processing milestones. Returns
+        whether the image exists.
+        """
+        try:
+            uuid_obj = uuid.UUID(image_id)
+        except ValueError:
+            return False
+        
+        result = await db.execute(
+            update(Image)
+            .where(Image.id == uuid_obj)
+            .values(**ImageService._status_values(status, error_message, timings))
+            .execution_options(synchronize_session=False)
+        )
+        # The UPDATE locked the row, so it cannot vanish before the variants land
+        if result.rowcount and thumbnail_paths:
+            await ImageService._replace_variants(
+                db, ImageService._done_variants(uuid_obj, thumbnail_paths)
+            )
+        await db.commit()
+        image_cache.invalidate(image_id)
+        
+        return bool(result.rowcount)
+    
+    @staticmethod
+    async def set_image_statuses(
+        db: AsyncSession,
+        updates: List[Dict[str, Any]]
+    ) -> None:
+        """Apply many status updates in one transaction.
+        
+        Each update holds ``image_id``, ``status`` and optionally
+        ``thumbnail_paths``, ``error_message`` and ``timings``. Rows are written as
+        one Core ``executemany`` UPDATE per column set, followed by one bulk
+        write of the thumbnails of images still present. Images deleted
+        meanwhile match no row and are skipped.
+        """
+        # Column set -> parameters; Core (unlike the ORM bulk UPDATE) does not
+        # require every row to be matched
+        groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+        variant_rows = []
+        for item in updates:
+            try:
+                uuid_obj = uuid.UUID(item["image_id"])
+            except ValueError:
+                continue
+            values = ImageService._status_values(
+                item["status"], item.get("error_message"), item.get("timings")
+            )
+            groups.setdefault(tuple(sorted(values)), []).append({"b_id": uuid_obj, **values})
+            variant_rows.extend(
+                ImageService._done_variants(uuid_obj, item.get("thumbnail_paths"))
+            )
+        
+        table = cast(Table, Image.__table__)
+        for rows in groups.values():
+            await db.execute(update(table).where(table.c.id == bindparam("b_id")), rows)
+        if variant_rows:
+            # Rows updated above are locked; skip images deleted meanwhile
+            result = await db.execute(
+                select(Image.id).where(
+                    Image.id.in_({row["image_id"] for row in variant_rows})
+                )
+            )
+            existing = set(result.scalars())
+            await ImageService._replace_variants(
+                db, [row for row in variant_rows if row["image_id"] in existing]
+            )
+        await db.commit()
+        for item in updates:
+            image_cache.invalidate(item["image_id"])
+    
+    @staticmethod
+    async def complete_variant(
+        db: AsyncSession,
+        image_id: str,
+        size_name: str,
+        path: Optional[str] = None,
+        error_message: Optional[str] = None,
+        timings: Optional[Dict[str, Any]] = None
+    ) -> Optional[Tuple[ImageStatus, Dict[str, Dict[str, Optional[str]]]]]:
+        """Record the outcome of one fan-out subtask and derive the image status.
+        
+        The image row is locked first so that the last two variants finishing
+        concurrently cannot both miss the transition to DONE/ERROR, and so
+        their ``timings`` are merged into the image's. Returns
+        the image status and ``{size_name: {"status", "path"}}`` of all variants,
+        or ``None`` if the image does not exist.
+        """
+        try:
+            uuid_obj = uuid.UUID(image_id)
+        except ValueError:
             return None
         
-        image.status = status
+        locked = (await db.execute(
+            select(Image.id, Image.timings).where(Image.id == uuid_obj).with_for_update()
+        )).one_or_none()
+        if locked is None:
+            await db.rollback()
+            return None
+        if timings:
+            timings = {**(locked.timings or {}), **timings}
         
-        if error_message:
-            image.error_message = error_message
+        await db.execute(
+            update(ImageVariant)
+            .where(ImageVariant.image_id == uuid_obj, ImageVariant.size_name == size_name)
+            .values(
+                status=ImageStatus.ERROR if error_message else ImageStatus.DONE,
+                path=path,
+                error_message=error_message,
+                updated_at=datetime.utcnow()
+            )
+            .execution_options(synchronize_session=False)
+        )
+        result = await db.execute(
+            select(
+                ImageVariant.size_name,
+                ImageVariant.status,
+                ImageVariant.path,
+                ImageVariant.error_message
+            )
+            .where(ImageVariant.image_id == uuid_obj)
+        )
+        variants = result.all()
         
-        if thumbnail_paths:
-            image.thumbnail_100_path = thumbnail_paths.get("100x100")
-            image.thumbnail_300_path = thumbnail_paths.get("300x300")
-            image.thumbnail_1200_path = thumbnail_paths.get("1200x1200")
+        failed = [variant for variant in variants if variant.status == ImageStatus.ERROR]
+        if any(variant.status == ImageStatus.PROCESSING for variant in variants):
+            status = ImageStatus.PROCESSING
+        elif failed:
+            status = ImageStatus.ERROR
+        else:
+            status = ImageStatus.DONE
         
+        image_error = None
+        if status == ImageStatus.ERROR:
+            image_error = "; ".join(
+                f"{variant.size_name}: {variant.error_message}" for variant in failed
+            )
+        await db.execute(
+            update(Image)
+            .where(Image.id == uuid_obj)
+            .values(**ImageService._status_values(status, image_error, timings))
+            .execution_options(synchronize_session=False)
+        )
         await db.commit()
-        await db.refresh(image)
+        image_cache.invalidate(image_id)
         
-        return image
+        return status, {
+            variant.size_name: {"status": variant.status, "path": variant.path}
+            for variant in variants
+        }
+    
+    @staticmethod
+    def _status_values(
+        status: ImageStatus,
+        error_message: Optional[str] = None,
+        timings: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Column values for a status transition."""
+        values: Dict[str, Any] = {"status": status, "updated_at": datetime.utcnow()}
+        
+        if error_message:
+            values["error_message"] = error_message
+        if timings:
+            values["timings"] = timings
+        
+        return values
+    
+    @staticmethod
+    def _done_variants(
+        image_id: uuid.UUID,
+        thumbnail_paths: Optional[dict]
+    ) -> List[Dict[str, Any]]:
+        """Variant rows of finished thumbnails (``{size_name: path}``)."""
+        return [
+            {
+                "image_id": image_id,
+                "size_name": size_name,
+                "status": ImageStatus.DONE,
+                "path": path
+            }
+            for size_name, path in (thumbnail_paths or {}).items() if path
+        ]
+    
+    @staticmethod
+    async def _replace_variants(db: AsyncSession, variant_rows: List[Dict[str, Any]]) -> None:
+        """Replace all variant rows of the images in ``variant_rows``."""
+        if not variant_rows:
+            return
+        await db.execute(
+            delete(ImageVariant)
+            .where(ImageVariant.image_id.in_({row["image_id"] for row in variant_rows}))
+            .execution_options(synchronize_session=False)
+        )
+        await db.execute(insert(ImageVariant), variant_rows)
@@ -1,12 +1,27 @@
 """JSON logging configuration."""
 
+import atexit
 import json
 import logging
+import logging.handlers
+import queue
+import random
 import sys
-from datetime import datetime
-from typing import Any, Dict
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
 from src.config import settings
 
+# Attributes every LogRecord has; anything else was passed through ``extra``
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message", "asctime"
+}
+
+# Reused across records; ``default=str`` keeps odd extras from dropping the line
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=str)
+
+# Background writer started by setup_logging()
+_listener: Optional[logging.handlers.QueueListener] = None
+
 
 class JSONFormatter(logging.Formatter):
     """Custom JSON formatter for structured logging."""
@@ -14,7 +29,9 @@ class JSONFormatter(logging.Formatter):
     def format(self, record: logging.LogRecord) -> str:
         """Format log record as JSON."""
         log_entry: Dict[str, Any] = {
-            "timestamp": datetime.utcnow().isoformat() + "Z",
+            # Time the event happened, not the time the writer thread got to it
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc)
+            .isoformat(timespec="microseconds").replace("+00:00", "Z"),
             "level": record.levelname,
             "logger": record.name,
             "message": record.getMessage(),
@@ -28,21 +45,63 @@ class JSONFormatter(logging.Formatter):
             log_entry["exception"] = self.formatException(record.exc_info)
         
         # Add extra fields if present
-        if hasattr(record, "__dict__"):
-            for key, value in record.__dict__.items():
-                if key not in {
-                    "name", "msg", "args", "levelname", "levelno", "pathname",
-                    "filename", "module", "exc_info", "exc_text", "stack_info",
-                    "lineno", "funcName", "created", "msecs", "relativeCreated",
-                    "thread", "threadName", "processName", "process", "message"
-                }:
-                    log_entry[key] = value
+        for key in record.__dict__.keys() - _RECORD_ATTRIBUTES:
+            log_entry[key] = record.__dict__[key]
         
-        return json.dumps(log_entry, ensure_ascii=False)
+        return _encoder.encode(log_entry)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Hand records to the writer thread without formatting them.
+    
+    The stock ``QueueHandler`` formats every record in the calling thread so
+    it can be pickled; records here never leave the process, so message
+    interpolation and JSON encoding happen on the writer thread instead.
+    Records arriving while the bounded queue is full are dropped and
+    counted rather than blocking the event loop.
+    """
+    
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+    
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of records at INFO and below; warnings and errors always pass.
+    
+    Kept records carry ``sample_rate`` so counts can be scaled back up.
+    """
+    
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO or self.rate >= 1:
+            return True
+        if random.random() >= self.rate:
+            return False
+        record.sample_rate = self.rate
+        return True
 
 
 def setup_logging() -> None:
-    """Setup JSON logging configuration."""
+    """Setup JSON logging configuration.
+    
+    With ``LOG_ASYNC`` records are queued and written to stdout by a
+    background thread, so callers never wait on formatting or the stream.
+    """
+    global _listener
+    
     # Create root logger
     root_logger = logging.getLogger()
     root_logger.setLevel(getattr(logging, settings.LOG_LEVEL))
@@ -50,6 +109,7 @@ def setup_logging() -> None:
     # Remove existing handlers
     for handler in root_logger.handlers[:]:
         root_logger.removeHandler(handler)
+    shutdown_logging()
     
     # Create console handler
     console_handler = logging.StreamHandler(sys.stdout)
@@ -63,7 +123,13 @@ def setup_logging() -> None:
             )
         )
     
-    root_logger.addHandler(console_handler)
+    if settings.LOG_ASYNC:
+        log_queue: queue.Queue = queue.Queue(settings.LOG_QUEUE_SIZE)
+        _listener = logging.handlers.QueueListener(log_queue, console_handler)
+        _listener.start()
+        root_logger.addHandler(DeferredQueueHandler(log_queue))
+    else:
+        root_logger.addHandler(console_handler)
     
     # Set specific loggers levels
     logging.getLogger("sqlalchemy").setLevel(logging.WARNING)
@@ -71,6 +137,39 @@ def setup_logging() -> None:
     logging.getLogger("uvicorn").setLevel(logging.INFO)
 
 
+def shutdown_logging() -> None:
+    """Write out queued records and stop the background writer."""
+    global _listener
+    
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def dropped_records() -> int:
+    """Records dropped so far because the ``LOG_ASYNC`` queue was full."""
+    return sum(
+        handler.dropped for handler in logging.getLogger().handlers
+        if isinstance(handler, DeferredQueueHandler)
+    )
+
+
 def get_logger(name: str) -> logging.Logger:
     """Get logger instance."""
     return logging.getLogger(name)
+
+
+def get_sampled_logger(name: str, rate: float) -> logging.Logger:
+    """Logger keeping only ``rate`` of its INFO and DEBUG records.
+    
+    Meant for messages logged per variant or per message on hot paths; use a
+    dedicated name (``<module>.variants``) so the module's other logs are
+    unaffected.
+    """
+    logger = logging.getLogger(name)
+    if not any(isinstance(f, SamplingFilter) for f in logger.filters):
+        logger.addFilter(SamplingFilter(rate))
+    return logger
+
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,302 @@
+"""In-process stand-in for RabbitMQ, selected with a ``memory://`` RABBITMQ_URL.
+
+Implements the part of the aio-pika API the service uses: robust
+connections, channels with prefetch, durable and exclusive queues, the
+default exchange, fanout exchanges and consumers acknowledging through
+``message.process()``. Every connection of the process shares one broker,
+so the API and a worker running in the same event loop exchange tasks and
+status events as they would through RabbitMQ. Nothing is persisted.
+"""
+
+import asyncio
+import itertools
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+import aio_pika
+from src.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+Callback = Callable[["MemoryIncomingMessage"], Awaitable[Any]]
+
+
+@dataclass
+class DeclarationResult:
+    """Counters of a queue, as returned by a queue declaration in aio-pika."""
+    message_count: int
+    consumer_count: int
+
+
+@dataclass
+class _Consumer:
+    channel: "MemoryChannel"
+    callback: Callback
+    no_ack: bool
+
+
+@dataclass
+class _QueueState:
+    """Messages and consumers of a queue, shared by every channel declaring it."""
+    name: str
+    owner: Optional["MemoryConnection"] = None
+    messages: Deque[Tuple[aio_pika.Message, str]] = field(default_factory=deque)
+    consumers: Dict[str, _Consumer] = field(default_factory=dict)
+    turn: "itertools.count[int]" = field(default_factory=itertools.count)
+
+
+class MemoryIncomingMessage:
+    """Delivered message; settled once by ``ack``, ``reject`` or ``process()``."""
+    
+    def __init__(
+        self,
+        broker: "MemoryBroker",
+        queue: _QueueState,
+        message: aio_pika.Message,
+        routing_key: str,
+        delivery_tag: int,
+        channel: Optional["MemoryChannel"]
+    ):
+        self._broker = broker
+        self._queue = queue
+        self._message = message
+        self._channel = channel
+        self.routing_key = routing_key
+        self.delivery_tag = delivery_tag
+        # no_ack deliveries are settled on delivery
+        self.processed = channel is None
+    
+    @property
+    def body(self) -> bytes:
+        return self._message.body
+    
+    @property
+    def headers(self) -> Dict[str, Any]:
+        return self._message.headers
+    
+    @property
+    def content_type(self) -> Optional[str]:
+        return self._message.content_type
+    
+    async def ack(self) -> None:
+        self._settle(requeue=False)
+    
+    async def reject(self, requeue: bool = False) -> None:
+        self._settle(requeue=requeue)
+    
+    async def nack(self, requeue: bool = True) -> None:
+        self._settle(requeue=requeue)
+    
+    @asynccontextmanager
+    async def process(self, requeue: bool = False) -> AsyncIterator["MemoryIncomingMessage"]:
+        """Ack if the block succeeds, reject (dropping the message by default) if it raises."""
+        try:
+            yield self
+        except BaseException:
+            if not self.processed:
+                self._settle(requeue=requeue)
+            raise
+        if not self.processed:
+            self._settle(requeue=False)
+    
+    def _settle(self, requeue: bool) -> None:
+        if self.processed:
+            raise RuntimeError(f"Message {self.delivery_tag} was already processed")
+        self.processed = True
+        if self._channel is not None:
+            self._channel._unacked.pop(self.delivery_tag, None)
+        if requeue:
+            self._queue.messages.appendleft((self._message, self.routing_key))
+        self._broker._dispatch(self._queue)
+
+
+class MemoryQueue:
+    """A queue as declared on one channel, whose prefetch its consumers use."""
+    
+    def __init__(self, channel: "MemoryChannel", state: _QueueState):
+        self.channel = channel
+        self._state = state
+        self.name = state.name
+    
+    @property
+    def declaration_result(self) -> DeclarationResult:
+        return DeclarationResult(len(self._state.messages), len(self._state.consumers))
+    
+    async def bind(self, exchange: "MemoryExchange", routing_key: str = "") -> None:
+        exchange._bindings.add(self.name)
+    
+    async def consume(self, callback: Callback, no_ack: bool = False) -> str:
+        consumer_tag = f"ctag.{next(self.channel.broker._tags)}"
+        self._state.consumers[consumer_tag] = _Consumer(self.channel, callback, no_ack)
+        self.channel.broker._dispatch(self._state)
+        return consumer_tag
+    
+    async def cancel(self, consumer_tag: str) -> None:
+        self._state.consumers.pop(consumer_tag, None)
+
+
+class MemoryExchange:
+    """The default exchange (routing by queue name) or a fanout exchange."""
+    
+    def __init__(self, broker: "MemoryBroker", name: str = "", fanout: bool = False):
+        self._broker = broker
+        self.name = name
+        self.fanout = fanout
+        self._bindings: Set[str] = set()
+    
+    async def publish(self, message: aio_pika.Message, routing_key: str) -> None:
+        """Route a message; confirmed as soon as it is queued."""
+        names = self._bindings if self.fanout else {routing_key}
+        for name in list(names):
+            state = self._broker._queues.get(name)
+            if state is None:
+                # Unroutable messages are dropped, as without the mandatory flag
+                self._bindings.discard(name)
+                continue
+            state.messages.append((message, routing_key))
+            self._broker._dispatch(state)
+
+
+class MemoryChannel:
+    """Channel of a connection; tracks its unacknowledged deliveries."""
+    
+    def __init__(self, connection: "MemoryConnection"):
+        self.connection = connection
+        self.broker: "MemoryBroker" = connection.broker
+        self.prefetch_count = 0
+        self._unacked: Dict[int, MemoryIncomingMessage] = {}
+        self.default_exchange = self.broker._default_exchange
+    
+    @property
+    def is_closed(self) -> bool:
+        return self.connection.is_closed
+    
+    async def set_qos(self, prefetch_count: int = 0, **kwargs: Any) -> None:
+        self.prefetch_count = prefetch_count
+    
+    async def declare_queue(
+        self,
+        name: Optional[str] = None,
+        durable: bool = False,
+        exclusive: bool = False,
+        passive: bool = False,
+        auto_delete: bool = False,
+        **kwargs: Any
+    ) -> MemoryQueue:
+        name = name or f"amq.gen-{next(self.broker._tags)}"
+        state = self.broker._queues.get(name)
+        if state is None:
+            if passive:
+                raise LookupError(f"Queue {name} does not exist")
+            state = self.broker._queues[name] = _QueueState(
+                name, self.connection if exclusive or auto_delete else None
+            )
+        return MemoryQueue(self, state)
+    
+    async def declare_exchange(
+        self,
+        name: str,
+        type: Any = aio_pika.ExchangeType.DIRECT,
+        **kwargs: Any
+    ) -> MemoryExchange:
+        exchange = self.broker._exchanges.get(name)
+        if exchange is None:
+            exchange = self.broker._exchanges[name] = MemoryExchange(
+                self.broker, name, fanout=type == aio_pika.ExchangeType.FANOUT
+            )
+        return exchange
+    
+    async def close(self) -> None:
+        pass
+    
+    def _has_capacity(self) -> bool:
+        return not self.prefetch_count or len(self._unacked) < self.prefetch_count
+
+
+class MemoryConnection:
+    """Connection to the in-process broker."""
+    
+    def __init__(self, broker: "MemoryBroker"):
+        self.broker = broker
+        self.is_closed = False
+        self._channels: List[MemoryChannel] = []
+    
+    async def channel(self, publisher_confirms: bool = True, **kwargs: Any) -> MemoryChannel:
+        channel = MemoryChannel(self)
+        self._channels.append(channel)
+        return channel
+    
+    async def close(self) -> None:
+        """Close, requeueing unacknowledged deliveries and dropping exclusive queues."""
+        if self.is_closed:
+            return
+        self.is_closed = True
+        for channel in self._channels:
+            for incoming in list(channel._unacked.values()):
+                await incoming.reject(requeue=True)
+        for name, state in list(self.broker._queues.items()):
+            for tag, consumer in list(state.consumers.items()):
+                if consumer.channel.connection is self:
+                    del state.consumers[tag]
+            if state.owner is self:
+                del self.broker._queues[name]
+            else:
+                self.broker._dispatch(state)
+
+
+class MemoryBroker:
+    """Queues and exchanges shared by all in-process connections."""
+    
+    def __init__(self) -> None:
+        self._queues: Dict[str, _QueueState] = {}
+        self._exchanges: Dict[str, MemoryExchange] = {}
+        self._default_exchange = MemoryExchange(self)
+        self._tags = itertools.count(1)
+        self._deliveries: Set["asyncio.Task[None]"] = set()
+    
+    async def connect(self) -> MemoryConnection:
+        return MemoryConnection(self)
+    
+    def queue_stats(self, name: str) -> Optional[DeclarationResult]:
+        """Ready messages and consumers of a queue, if it exists."""
+        state = self._queues.get(name)
+        if state is None:
+            return None
+        return DeclarationResult(len(state.messages), len(state.consumers))
+    
+    def _dispatch(self, state: _QueueState) -> None:
+        """Hand ready messages to consumers with free prefetch slots, round-robin."""
+        while state.messages:
+            consumers = [
+                consumer for consumer in state.consumers.values()
+                if not consumer.channel.is_closed and consumer.channel._has_capacity()
+            ]
+            if not consumers:
+                return
+            consumer = consumers[next(state.turn) % len(consumers)]
+            message, routing_key = state.messages.popleft()
+            delivery_tag = next(self._tags)
+            channel = None if consumer.no_ack else consumer.channel
+            incoming = MemoryIncomingMessage(
+                self, state, message, routing_key, delivery_tag, channel
+            )
+            if channel is not None:
+                channel._unacked[delivery_tag] = incoming
+            task = asyncio.get_running_loop().create_task(
+                self._deliver(state.name, consumer, incoming)
+            )
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+    
+    @staticmethod
+    async def _deliver(queue: str, consumer: _Consumer, incoming: MemoryIncomingMessage) -> None:
+        try:
+            await consumer.callback(incoming)
+        except Exception as e:
+            # As with aio-pika, a failing consumer callback does not stop consumption
+            logger.debug(f"Consumer of {queue} failed: {e}")
+
+
+# Shared by every ``memory://`` connection of the process
+memory_broker = MemoryBroker()
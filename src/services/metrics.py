@@ -0,0 +1,285 @@
+"""In-process metrics in the Prometheus text exposition format."""
+
+import asyncio
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar
+from src.services.logger import dropped_records, get_logger
+
+logger = get_logger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; fine-grained at the low end where DB statements and publishes live
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+M = TypeVar("M", bound="_Metric")
+
+
+class _Metric(ABC):
+    """Metric family with optional labels; children are created on first use."""
+    
+    kind = ""
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Children are of the family's own class
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+    
+    def labels(self: M, *values: str) -> M:
+        """Child for the given label values, in ``labelnames`` order."""
+        child: Optional[M] = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._child())
+        return child
+    
+    def _child(self: M) -> M:
+        return type(self)(self.name, self.documentation)
+    
+    @abstractmethod
+    def _samples(self) -> List[Tuple[str, str, float]]:
+        """``(suffix, extra labels, value)`` of an unlabelled metric."""
+    
+    def render(self) -> List[str]:
+        """Exposition lines of the family."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        children = (
+            sorted(self._children.items()) if self.labelnames else [((), self)]
+        )
+        for values, child in children:
+            base = ",".join(
+                f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, values)
+            )
+            for suffix, extra, value in child._samples():
+                labels = ",".join(part for part in (base, extra) if part)
+                labels = f"{{{labels}}}" if labels else ""
+                lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+    
+    kind = "counter"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+    
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+    
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Read the value from ``function`` at scrape time, for counts kept elsewhere."""
+        self._function = function
+    
+    def _samples(self) -> List[Tuple[str, str, float]]:
+        value = self._function() if self._function is not None else self._value
+        return [("_total", "", value)]
+
+
+class Gauge(_Metric):
+    """Value that goes up and down (in-flight work)."""
+    
+    kind = "gauge"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._value = 0.0
+    
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+    
+    def dec(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value -= amount
+    
+    def set(self, value: float) -> None:
+        self._value = value
+    
+    @contextmanager
+    def track_inprogress(self) -> Iterator[None]:
+        """Count the block as in flight while it runs."""
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+    
+    def _samples(self) -> List[Tuple[str, str, float]]:
+        return [("", "", self._value)]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed cumulative buckets."""
+    
+    kind = "histogram"
+    
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per-bucket (not cumulative) counts; the last slot is +Inf
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+    
+    def _child(self) -> "Histogram":
+        return Histogram(self.name, self.documentation, buckets=self.buckets)
+    
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+    
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Observe the duration of the block in seconds."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+    
+    def _samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        samples: List[Tuple[str, str, float]] = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            samples.append(("_bucket", f'le="{_format_value(bound)}"', cumulative))
+        samples.append(("_count", "", cumulative))
+        samples.append(("_sum", "", total))
+        return samples
+
+
+class Registry:
+    """Collection of metric families rendered together."""
+    
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+    
+    def register(self, metric: M) -> M:
+        self._metrics[metric.name] = metric
+        return metric
+    
+    def render(self) -> str:
+        """All families in the text exposition format."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Process
+LOG_RECORDS_DROPPED = registry.register(Counter(
+    "log_records_dropped", "Log records dropped because the async log queue was full"
+))
+LOG_RECORDS_DROPPED.set_function(dropped_records)
+
+# API
+HTTP_REQUEST_DURATION = registry.register(Histogram(
+    "http_request_duration_seconds",
+    "Duration of HTTP requests by route template",
+    ("method", "route", "status")
+))
+HTTP_REQUESTS_IN_PROGRESS = registry.register(Gauge(
+    "http_requests_in_progress", "HTTP requests being handled"
+))
+UPLOAD_DURATION = registry.register(Histogram(
+    "image_upload_duration_seconds",
+    "Time to spool, hash, store and queue uploads",
+    ("endpoint",)
+))
+
+# Queue and database
+PUBLISH_DURATION = registry.register(Histogram(
+    "rabbitmq_publish_duration_seconds", "Publish of one task until the broker confirmed it"
+))
+DB_STATEMENT_DURATION = registry.register(Histogram(
+    "db_statement_duration_seconds", "Database statement execution time", ("operation",)
+))
+
+# Worker
+QUEUE_LAG = registry.register(Histogram(
+    "worker_queue_lag_seconds",
+    "Time from publishing a task to a worker starting it",
+    ("queue",),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+))
+JOB_DURATION = registry.register(Histogram(
+    "worker_job_duration_seconds", "Duration of processing jobs", ("queue", "outcome")
+))
+JOBS_IN_PROGRESS = registry.register(Gauge(
+    "worker_jobs_in_progress", "Processing jobs being handled", ("queue",)
+))
+THUMBNAIL_STAGE_DURATION = registry.register(Histogram(
+    "thumbnail_stage_duration_seconds",
+    "Thumbnail generation stages (decode, resize, encode) by size",
+    ("stage", "size")
+))
+
+
+def observe_thumbnail_timings(timings: Dict[str, float]) -> None:
+    """Record the ``timings`` collected by ``ImageProcessor`` per stage and size."""
+    for key, seconds in timings.items():
+        stage, _, size = key.partition("_")
+        THUMBNAIL_STAGE_DURATION.labels(stage, size).observe(seconds)
+
+
+async def _handle_scrape(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Answer one HTTP request with the metrics, whatever its path."""
+    try:
+        await reader.readuntil(b"\r\n\r\n")
+        body = registry.render().encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            + f"Content-Type: {CONTENT_TYPE}\r\nContent-Length: {len(body)}\r\n".encode()
+            + b"Connection: close\r\n\r\n"
+            + body
+        )
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str, port: int) -> Optional[asyncio.AbstractServer]:
+    """Serve the metrics over plain HTTP for processes without an API (the worker)."""
+    if not port:
+        return None
+    server = await asyncio.start_server(_handle_scrape, host, port)
+    logger.info(f"Serving metrics on {host}:{port}")
+    return server
@@ -0,0 +1,160 @@
+"""Relay of outbox rows to RabbitMQ."""
+
+import asyncio
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional
+from sqlalchemy import delete, select, update
+from src.config import settings
+from src.database.connection import AsyncSessionLocal
+from src.models.outbox import OutboxMessage
+from src.services.logger import get_logger
+from src.services.rabbitmq_service import rabbitmq_service, task_headers
+
+logger = get_logger(__name__)
+
+
+class OutboxRelay:
+    """Drain the outbox to RabbitMQ in batches.
+    
+    Each pass claims up to ``batch_size`` unsent rows (``FOR UPDATE SKIP
+    LOCKED`` on PostgreSQL, so several API replicas can relay at once),
+    publishes them with pipelined confirms and marks the confirmed rows
+    sent in the same transaction. Delivery is at least once.
+    
+    Waiting for confirms is bounded by ``publish_timeout``, since the claimed
+    rows stay locked until then. Rows not confirmed in time, or in a pass
+    whose publish failed, count an attempt and record the error.
+    """
+    
+    def __init__(
+        self,
+        session_factory: Callable[[], Any] = AsyncSessionLocal,
+        publisher: Any = None,
+        batch_size: Optional[int] = None,
+        poll_interval: Optional[float] = None,
+        publish_timeout: Optional[float] = None
+    ):
+        self.session_factory = session_factory
+        self._publisher = publisher
+        self.batch_size = settings.OUTBOX_BATCH_SIZE if batch_size is None else batch_size
+        self.poll_interval = (
+            settings.OUTBOX_POLL_INTERVAL if poll_interval is None else poll_interval
+        )
+        self.publish_timeout = (
+            settings.OUTBOX_PUBLISH_TIMEOUT if publish_timeout is None else publish_timeout
+        )
+        self._wakeup = asyncio.Event()
+        self._task: Optional["asyncio.Task[None]"] = None
+    
+    @property
+    def publisher(self) -> Any:
+        """Service used to publish tasks (``rabbitmq_service`` by default)."""
+        return self._publisher or rabbitmq_service
+    
+    def start(self) -> None:
+        """Start the background relay loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self) -> None:
+        """Stop the relay loop; unsent rows are picked up on the next start."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    def notify(self) -> None:
+        """Wake the relay after new rows were committed."""
+        self._wakeup.set()
+    
+    async def relay_once(self) -> int:
+        """Publish one batch of unsent rows and return how many were sent."""
+        async with self.session_factory() as db:
+            result = await db.execute(
+                select(
+                    OutboxMessage.id,
+                    OutboxMessage.image_id,
+                    OutboxMessage.image_path,
+                    OutboxMessage.queue,
+                    OutboxMessage.variant,
+                    OutboxMessage.traceparent,
+                    OutboxMessage.created_at
+                )
+                .where(OutboxMessage.sent_at.is_(None))
+                .order_by(OutboxMessage.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            rows = result.all()
+            if not rows:
+                await db.commit()
+                return 0
+            
+            error = "Not confirmed by the broker"
+            try:
+                published = set(await asyncio.wait_for(
+                    self.publisher.send_image_processing_tasks(
+                        [(str(row.image_id), row.image_path, row.queue, row.variant) for row in rows],
+                        # Queue lag counts from the upload, not from the relay picking the row up
+                        headers=[task_headers(row.traceparent, row.created_at) for row in rows]
+                    ),
+                    timeout=self.publish_timeout
+                ))
+            except asyncio.TimeoutError:
+                published = set()
+                error = f"Not confirmed within {self.publish_timeout}s"
+            except Exception as e:
+                published = set()
+                error = f"Publish failed: {e!r}"
+            # By task, not by image: with VARIANT_FANOUT an image has a row per size
+            sent_ids = [row.id for index, row in enumerate(rows) if index in published]
+            failed_ids = [row.id for index, row in enumerate(rows) if index not in published]
+            
+            now = datetime.utcnow()
+            if sent_ids:
+                await db.execute(
+                    update(OutboxMessage)
+                    .where(OutboxMessage.id.in_(sent_ids))
+                    .values(sent_at=now)
+                )
+                # Sent rows are kept for a while for troubleshooting
+                cutoff = now - timedelta(hours=settings.OUTBOX_RETENTION_HOURS)
+                await db.execute(
+                    delete(OutboxMessage).where(OutboxMessage.sent_at < cutoff)
+                )
+            if failed_ids:
+                await db.execute(
+                    update(OutboxMessage)
+                    .where(OutboxMessage.id.in_(failed_ids))
+                    .values(attempts=OutboxMessage.attempts + 1, last_error=error[:500])
+                )
+            await db.commit()
+        
+        if failed_ids:
+            logger.warning(f"Outbox relay left {len(failed_ids)} tasks unsent: {error}")
+        return len(sent_ids)
+    
+    async def _run(self) -> None:
+        """Relay on every notification, and every ``poll_interval`` as a fallback."""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            
+            try:
+                # Keep draining while batches come back full
+                while await self.relay_once() >= self.batch_size:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Outbox relay failed: {e}")
+
+
+# Global outbox relay instance
+outbox_relay = OutboxRelay()
@@ -0,0 +1,390 @@
+"""Append-only pack files for small thumbnails."""
+
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from src.config import settings
+from src.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Location prefix of packed objects ("pack/<name>")
+PACK_PREFIX = "pack/"
+
+# Precedes every object in a .pack file, so an index can be rebuilt from the data
+RECORD_HEADER = struct.Struct("<16sI")      # name digest, length
+# Appended to the .log journal of the active segment
+JOURNAL_RECORD = struct.Struct("<16sQI")    # name digest, offset, length
+# Sorted .idx of a sealed segment, binary-searched through mmap
+INDEX_RECORD = struct.Struct("<16sQI")      # name digest, offset, length
+DIGEST_SIZE = 16
+
+
+def is_packed(location: str) -> bool:
+    """Whether a location points into the pack store."""
+    return location.startswith(PACK_PREFIX)
+
+
+def packed_name(location: str) -> str:
+    """Object name of a packed location."""
+    return location[len(PACK_PREFIX):]
+
+
+def _digest(name: str) -> bytes:
+    return hashlib.md5(name.encode(), usedforsecurity=False).digest()
+
+
+class _SealedIndex:
+    """Index of a sealed segment, searched in place without loading it."""
+    
+    def __init__(self, path: str):
+        self.inode = os.stat(path).st_ino
+        self.count = 0
+        self._map: Optional[mmap.mmap] = None
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.count = size // INDEX_RECORD.size
+    
+    def find(self, digest: bytes) -> Optional[Tuple[int, int]]:
+        """Offset and length of an entry, by binary search over the sorted records."""
+        if self._map is None:
+            return None
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            start = middle * INDEX_RECORD.size
+            key = self._map[start:start + DIGEST_SIZE]
+            if key < digest:
+                low = middle + 1
+            elif key > digest:
+                high = middle
+            else:
+                _, offset, length = INDEX_RECORD.unpack_from(self._map, start)
+                return offset, length
+        return None
+    
+    def records(self) -> Iterator[Tuple[bytes, int, int]]:
+        """All entries in digest order."""
+        if self._map is None:
+            return
+        for i in range(self.count):
+            yield INDEX_RECORD.unpack_from(self._map, i * INDEX_RECORD.size)
+    
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+
+
+class PackStore:
+    """Small objects appended to segment files instead of one file each.
+    
+    Objects are appended to the active ``NNNNNN.pack`` segment and recorded
+    in its ``.log`` journal. Once a segment reaches ``segment_bytes`` it is
+    sealed: the journal is replaced by a sorted ``.idx`` of fixed-size
+    records, which readers binary-search through ``mmap`` without loading
+    it. Reads are ``mmap`` slices of the segment. Deletes append to
+    ``tombstones.log``; ``compact()`` rewrites sealed segments without the
+    deleted objects.
+    
+    Writers in any process are serialized with ``flock``; readers pick up
+    new segments, journal records and tombstones on a miss or every
+    ``PACK_REFRESH_INTERVAL`` seconds.
+    """
+    
+    def __init__(self, directory: Optional[str] = None, segment_bytes: Optional[int] = None):
+        self._directory = directory
+        self.segment_bytes = (
+            settings.PACK_SEGMENT_BYTES if segment_bytes is None else segment_bytes
+        )
+        self._lock = threading.RLock()
+        self._sealed: Dict[int, _SealedIndex] = {}
+        self._active: Dict[bytes, Tuple[int, int, int]] = {}
+        self._journal_positions: Dict[int, int] = {}
+        self._tombstones: Set[bytes] = set()
+        self._tombstones_position = 0
+        self._tombstones_inode: Optional[int] = None
+        self._maps: Dict[int, Tuple[int, mmap.mmap]] = {}
+        self._refreshed_at = 0.0
+    
+    @property
+    def directory(self) -> str:
+        """Directory holding the segments."""
+        return self._directory or os.path.join(settings.STORAGE_PATH, "packs")
+    
+    def put(self, name: str, data: bytes) -> str:
+        """Append an object and return its location."""
+        digest = _digest(name)
+        with self._lock, self._writer_lock():
+            segment = self._writable_segment(RECORD_HEADER.size + len(data))
+            with open(self._path(segment, "pack"), "ab") as f:
+                f.seek(0, os.SEEK_END)
+                offset = f.tell() + RECORD_HEADER.size
+                f.write(RECORD_HEADER.pack(digest, len(data)) + data)
+            # The journal record goes last so readers never see unwritten data
+            with open(self._path(segment, "log"), "ab") as f:
+                f.write(JOURNAL_RECORD.pack(digest, offset, len(data)))
+            self._active[digest] = (segment, offset, len(data))
+        return PACK_PREFIX + name
+    
+    def get(self, name: str) -> Optional[bytes]:
+        """Content of an object, or ``None`` if it is not stored or deleted."""
+        digest = _digest(name)
+        with self._lock:
+            if time.monotonic() - self._refreshed_at > settings.PACK_REFRESH_INTERVAL:
+                self._refresh()
+            entry = self._lookup(digest)
+            if entry is None:
+                self._refresh()
+                entry = self._lookup(digest)
+            if entry is None:
+                return None
+            
+            segment, offset, length = entry
+            try:
+                segment_map = self._map(segment, offset + length)
+            except FileNotFoundError:
+                # Compacted away since the index was read: the copy is in a newer segment
+                self._refresh()
+                entry = self._lookup(digest)
+                if entry is None or entry[0] == segment:
+                    return None
+                segment, offset, length = entry
+                segment_map = self._map(segment, offset + length)
+            return segment_map[offset:offset + length]
+    
+    def delete(self, names: List[str]) -> None:
+        """Mark objects deleted; their space is reclaimed by ``compact()``."""
+        if not names:
+            return
+        digests = [_digest(name) for name in names]
+        with self._lock, self._writer_lock():
+            with open(os.path.join(self.directory, "tombstones.log"), "ab") as f:
+                f.write(b"".join(digests))
+            self._tombstones.update(digests)
+    
+    def compact(self) -> Dict[str, int]:
+        """Rewrite sealed segments holding deleted objects.
+        
+        Live objects are copied to a new sealed segment before the old one is
+        removed, so readers always find every live object. New segments are
+        numbered after the active one, which is therefore sealed first.
+        Tombstones of objects no longer stored anywhere are dropped.
+        """
+        stats = {"segments": 0, "removed": 0, "reclaimed_bytes": 0}
+        with self._lock, self._writer_lock():
+            self._refresh()
+            for segment in sorted(self._sealed):
+                index = self._sealed[segment]
+                records = list(index.records())
+                live = [record for record in records if record[0] not in self._tombstones]
+                if len(live) == len(records):
+                    continue
+                
+                old_size = os.path.getsize(self._path(segment, "pack"))
+                if live:
+                    self._seal_active()
+                    self._write_sealed(self._next_segment(), segment, live)
+                os.unlink(self._path(segment, "idx"))
+                os.unlink(self._path(segment, "pack"))
+                stats["segments"] += 1
+                stats["removed"] += len(records) - len(live)
+                stats["reclaimed_bytes"] += old_size - sum(
+                    RECORD_HEADER.size + length for _, _, length in live
+                )
+                self._refresh()
+            
+            # Keep tombstones of objects still stored, e.g. in a segment sealed above
+            remaining = [
+                digest for digest in self._tombstones
+                if digest in self._active
+                or any(index.find(digest) is not None for index in self._sealed.values())
+            ]
+            tombstones_path = os.path.join(self.directory, "tombstones.log")
+            with open(tombstones_path + ".tmp", "wb") as f:
+                f.write(b"".join(remaining))
+            os.replace(tombstones_path + ".tmp", tombstones_path)
+            self._refresh()
+        
+        logger.info(f"Compacted pack store: {stats}")
+        return stats
+    
+    @contextmanager
+    def _writer_lock(self) -> Iterator[None]:
+        """Exclusive lock shared by writers in every process."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, "lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+    
+    def _path(self, segment: int, extension: str) -> str:
+        return os.path.join(self.directory, f"{segment:06d}.{extension}")
+    
+    def _segments(self) -> List[int]:
+        """Numbers of all segments on disk."""
+        return sorted(
+            int(filename[:-len(".pack")])
+            for filename in os.listdir(self.directory)
+            if filename.endswith(".pack") and filename[:-len(".pack")].isdigit()
+        )
+    
+    def _next_segment(self) -> int:
+        segments = self._segments()
+        return segments[-1] + 1 if segments else 1
+    
+    def _writable_segment(self, record_size: int) -> int:
+        """Active segment with room for a record, sealing and rotating if needed."""
+        segments = self._segments()
+        if segments and not os.path.exists(self._path(segments[-1], "idx")):
+            segment = segments[-1]
+            size = os.path.getsize(self._path(segment, "pack"))
+            if not size or size + record_size <= self.segment_bytes:
+                return segment
+            self._seal(segment)
+        return self._next_segment()
+    
+    def _seal_active(self) -> None:
+        """Seal the active segment, if any, whatever its size."""
+        segments = self._segments()
+        if segments and os.path.exists(self._path(segments[-1], "log")):
+            self._seal(segments[-1])
+    
+    def _seal(self, segment: int) -> None:
+        """Replace the journal of a full segment with a sorted index."""
+        entries: Dict[bytes, Tuple[int, int]] = {}
+        with open(self._path(segment, "log"), "rb") as f:
+            journal = f.read()
+        for position in range(0, len(journal) - JOURNAL_RECORD.size + 1, JOURNAL_RECORD.size):
+            digest, offset, length = JOURNAL_RECORD.unpack_from(journal, position)
+            entries[digest] = (offset, length)
+        self._write_index(
+            segment, [(digest, offset, length) for digest, (offset, length) in entries.items()]
+        )
+        os.unlink(self._path(segment, "log"))
+        logger.info(f"Sealed pack segment {segment} with {len(entries)} objects")
+    
+    def _write_sealed(
+        self,
+        segment: int,
+        source: int,
+        records: List[Tuple[bytes, int, int]]
+    ) -> None:
+        """Copy records of segment ``source`` into a new sealed segment."""
+        rewritten = []
+        source_map = self._map(source, 0)
+        with open(self._path(segment, "pack") + ".tmp", "wb") as f:
+            for digest, offset, length in sorted(records, key=lambda record: record[1]):
+                rewritten.append((digest, f.tell() + RECORD_HEADER.size, length))
+                f.write(RECORD_HEADER.pack(digest, length))
+                f.write(source_map[offset:offset + length])
+        # The index appears last: until then readers use the old segment
+        os.replace(self._path(segment, "pack") + ".tmp", self._path(segment, "pack"))
+        self._write_index(segment, rewritten)
+    
+    def _write_index(self, segment: int, records: List[Tuple[bytes, int, int]]) -> None:
+        path = self._path(segment, "idx")
+        with open(path + ".tmp", "wb") as f:
+            for record in sorted(records):
+                f.write(INDEX_RECORD.pack(*record))
+        os.replace(path + ".tmp", path)
+    
+    def _lookup(self, digest: bytes) -> Optional[Tuple[int, int, int]]:
+        """Segment, offset and length of a live object, as far as this reader knows."""
+        if digest in self._tombstones:
+            return None
+        entry = self._active.get(digest)
+        if entry is not None:
+            return entry
+        for segment in sorted(self._sealed, reverse=True):
+            found = self._sealed[segment].find(digest)
+            if found is not None:
+                return (segment, *found)
+        return None
+    
+    def _map(self, segment: int, end: int) -> mmap.mmap:
+        """Read-only map of a segment covering at least ``end`` bytes."""
+        cached = self._maps.get(segment)
+        inode = os.stat(self._path(segment, "pack")).st_ino
+        if cached is None or cached[0] != inode or len(cached[1]) < end:
+            with open(self._path(segment, "pack"), "rb") as f:
+                replaced, cached = cached, (inode, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            self._maps[segment] = cached
+            # Reads copy out of the map under the lock, so nothing still uses it
+            if replaced is not None:
+                replaced[1].close()
+        return cached[1]
+    
+    def _refresh(self) -> None:
+        """Pick up segments, journal records and tombstones written by other processes."""
+        self._refreshed_at = time.monotonic()
+        if not os.path.isdir(self.directory):
+            return
+        
+        segments = set(self._segments())
+        for segment in list(self._sealed):
+            if segment not in segments or not os.path.exists(self._path(segment, "idx")):
+                self._sealed.pop(segment).close()
+                segment_map = self._maps.pop(segment, None)
+                if segment_map is not None:
+                    segment_map[1].close()
+        
+        for segment in segments:
+            try:
+                if os.path.exists(self._path(segment, "idx")):
+                    sealed = self._sealed.get(segment)
+                    if sealed is None or sealed.inode != os.stat(self._path(segment, "idx")).st_ino:
+                        self._sealed[segment] = _SealedIndex(self._path(segment, "idx"))
+                        self._journal_positions.pop(segment, None)
+                    continue
+                with open(self._path(segment, "log"), "rb") as f:
+                    f.seek(self._journal_positions.get(segment, 0))
+                    journal = f.read()
+            except FileNotFoundError:
+                # Sealed or compacted concurrently; the next refresh sees the result
+                continue
+            usable = len(journal) - len(journal) % JOURNAL_RECORD.size
+            for position in range(0, usable, JOURNAL_RECORD.size):
+                digest, offset, length = JOURNAL_RECORD.unpack_from(journal, position)
+                self._active[digest] = (segment, offset, length)
+            self._journal_positions[segment] = self._journal_positions.get(segment, 0) + usable
+        
+        # Journal entries of segments sealed since are now served by their index
+        self._active = {
+            digest: entry for digest, entry in self._active.items()
+            if entry[0] in segments and entry[0] not in self._sealed
+        }
+        self._refresh_tombstones()
+    
+    def _refresh_tombstones(self) -> None:
+        path = os.path.join(self.directory, "tombstones.log")
+        try:
+            inode = os.stat(path).st_ino
+        except FileNotFoundError:
+            return
+        if inode != self._tombstones_inode:
+            # Rewritten by compaction
+            self._tombstones = set()
+            self._tombstones_position = 0
+            self._tombstones_inode = inode
+        with open(path, "rb") as f:
+            f.seek(self._tombstones_position)
+            data = f.read()
+        usable = len(data) - len(data) % DIGEST_SIZE
+        self._tombstones.update(
+            data[position:position + DIGEST_SIZE] for position in range(0, usable, DIGEST_SIZE)
+        )
+        self._tombstones_position += usable
+
+
+# Global pack store instance
+pack_store = PackStore()
@@ -1,80 +1,484 @@
 """RabbitMQ service for queue operations."""
 
+import asyncio
 import json
-from typing import Optional
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Set, Tuple
 import aio_pika
-from aio_pika.abc import AbstractRobustConnection
+from aio_pika.abc import AbstractChannel, AbstractRobustConnection
 from src.config import settings
+from src.services.memory_broker import memory_broker
+from src.services.metrics import PUBLISH_DURATION
+from src.services.tracing import TRACEPARENT_HEADER, current_traceparent
 from src.services.logger import get_logger
 
 logger = get_logger(__name__)
 
+StatusCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+
+# (image_id, image_path, queue, variant); a missing queue means QUEUE_NAME
+# and a missing variant means all thumbnail sizes
+Task = Tuple[str, str, Optional[str], Optional[str]]
+
+# Message header with the Unix time a task was queued
+ENQUEUED_AT_HEADER = "x-enqueued-at"
+
+
+def task_headers(
+    traceparent: Optional[str] = None,
+    enqueued_at: Optional[datetime] = None
+) -> Dict[str, Any]:
+    """Headers of a task message: when it was queued (naive UTC, default now) and its trace."""
+    headers: Dict[str, Any] = {
+        ENQUEUED_AT_HEADER: (
+            enqueued_at.replace(tzinfo=timezone.utc).timestamp() if enqueued_at else time.time()
+        )
+    }
+    if traceparent:
+        headers[TRACEPARENT_HEADER] = traceparent
+    return headers
+
 
 class RabbitMQService:
-    """Service for RabbitMQ operations."""
+    """Service for RabbitMQ operations.
+    
+    Tasks are published round-robin over a small set of confirm-mode
+    channels. Publishes on a channel are not serialized: many can be in
+    flight at once, each awaiting its own broker confirmation.
+    """
     
     def __init__(self):
         self.connection: Optional[AbstractRobustConnection] = None
         self.channel = None
         self.queue = None
+        self.status_exchange = None
+        self.publish_channels: List[AbstractChannel] = []
+        self._next_channel = 0
+        self._connect_lock = asyncio.Lock()
+        self._pending: List[Tuple[Task, Dict[str, Any], "asyncio.Future[None]"]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_tasks: Set["asyncio.Task[None]"] = set()
+        # Callbacks of each subscribe_status_events() call, consumed on every new connection
+        self._status_subscriptions: List[Tuple[StatusCallback, ...]] = []
     
     async def connect(self) -> None:
-        """Connect to RabbitMQ."""
-        try:
-            self.connection = await aio_pika.connect_robust(
-                settings.RABBITMQ_URL
-            )
-            self.channel = await self.connection.channel()
-            
-            # Declare queue
-            self.queue = await self.channel.declare_queue(
-                settings.QUEUE_NAME,
-                durable=True
-            )
+        """Connect to RabbitMQ.
+        
+        Concurrent callers share one attempt; an open connection is reused.
+        """
+        async with self._connect_lock:
+            if self.connection and not self.connection.is_closed:
+                return
             
-            logger.info("Connected to RabbitMQ")
-        except Exception as e:
-            logger.error(f"Failed to connect to RabbitMQ: {e}")
-            raise
+            connection = None
+            try:
+                connection = await connect_broker()
+                self.channel = await connection.channel()
+                
+                # Declare queue
+                self.queue = await self.channel.declare_queue(
+                    settings.QUEUE_NAME,
+                    durable=True
+                )
+                for lane in QUEUE_LANES:
+                    if lane_queue(lane) != settings.QUEUE_NAME:
+                        await self.channel.declare_queue(lane_queue(lane), durable=True)
+                
+                self.status_exchange = await declare_status_exchange(self.channel)
+                # A robust connection restores these consumers after a reconnect
+                for callbacks in self._status_subscriptions:
+                    await self._consume_status_events(callbacks)
+                
+                # Robust channels are reopened by the connection after a reconnect
+                self.publish_channels = [
+                    await connection.channel(publisher_confirms=True)
+                    for _ in range(max(settings.RABBITMQ_PUBLISH_CHANNELS, 1))
+                ]
+                self.connection = connection
+                
+                logger.info(
+                    f"Connected to RabbitMQ with {len(self.publish_channels)} publish channels"
+                )
+            except BaseException as e:
+                logger.error(f"Failed to connect to RabbitMQ: {e!r}")
+                # Also when cancelled, e.g. by a timeout: a robust connection would
+                # otherwise keep reconnecting in the background
+                if connection is not None:
+                    try:
+                        await connection.close()
+                    except Exception as close_error:
+                        logger.warning(f"Failed to close RabbitMQ connection: {close_error}")
+                raise
     
     async def disconnect(self) -> None:
-        """Disconnect from RabbitMQ."""
+        """Disconnect from RabbitMQ, publishing any batched tasks first.
+        
+        Status-event subscriptions end with the connection.
+        """
+        await self._flush_pending()
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+        
+        self._status_subscriptions = []
         if self.connection:
             await self.connection.close()
+            self.connection = None
+            self.channel = None
+            self.publish_channels = []
             logger.info("Disconnected from RabbitMQ")
     
-    async def send_image_processing_task(self, image_id: str, image_path: str) -> None:
-        """Send image processing task to queue."""
-        if not self.channel:
+    async def send_image_processing_task(
+        self,
+        image_id: str,
+        image_path: str,
+        queue: Optional[str] = None
+    ) -> None:
+        """Send image processing task to ``queue`` (the lane, see ``select_lane``).
+        
+        With ``RABBITMQ_PUBLISH_BATCHING`` the task joins a micro-batch that is
+        published after ``RABBITMQ_PUBLISH_LINGER`` seconds or once full; the
+        call still returns only after the broker confirmed this message.
+        """
+        if not self.publish_channels:
+            await self.connect()
+        
+        try:
+            if settings.RABBITMQ_PUBLISH_BATCHING:
+                await self._enqueue_task(image_id, image_path, queue)
+            else:
+                await self._publish_task(image_id, image_path, queue)
+            logger.info("Sent processing task for image %s", image_id)
+        except Exception as e:
+            logger.error(f"Failed to send task for image {image_id}: {e}")
+            raise
+    
+    async def send_image_processing_tasks(
+        self,
+        tasks: Sequence[Task],
+        headers: Optional[Sequence[Dict[str, Any]]] = None
+    ) -> List[int]:
+        """Send many ``(image_id, image_path, queue, variant)`` tasks, pipelining confirms.
+        
+        All messages are published before any confirmation is awaited.
+        ``headers`` (see ``task_headers``) are per task and default to the
+        current time and trace. Returns the indexes in ``tasks`` of the tasks
+        the broker confirmed, since an image can have a task per variant;
+        failures are logged.
+        """
+        if not tasks:
+            return []
+        
+        if not self.publish_channels:
             await self.connect()
         
+        results = await asyncio.gather(
+            *(
+                self._publish_task(*task, headers=headers[index] if headers else None)
+                for index, task in enumerate(tasks)
+            ),
+            return_exceptions=True
+        )
+        
+        published = []
+        for index, ((image_id, *_), result) in enumerate(zip(tasks, results)):
+            if isinstance(result, BaseException):
+                logger.error(f"Failed to send task for image {image_id}: {result}")
+            else:
+                published.append(index)
+        
+        logger.info("Sent %d of %d processing tasks", len(published), len(tasks))
+        return published
+    
+    async def _enqueue_task(
+        self,
+        image_id: str,
+        image_path: str,
+        queue: Optional[str] = None
+    ) -> None:
+        """Add a task to the current micro-batch and wait for its confirmation."""
+        future: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        # Headers are taken now: the batch is published from another task's context
+        self._pending.append((
+            (image_id, image_path, queue, None), task_headers(current_traceparent()), future
+        ))
+        
+        if len(self._pending) >= settings.RABBITMQ_PUBLISH_MAX_BATCH:
+            self._schedule_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                settings.RABBITMQ_PUBLISH_LINGER, self._schedule_flush
+            )
+        await future
+    
+    def _schedule_flush(self) -> None:
+        """Publish the current micro-batch in the background."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        task = asyncio.create_task(self._flush_pending())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+    
+    async def _flush_pending(self) -> None:
+        """Publish every batched task at once and settle the waiting callers."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        
+        results = await asyncio.gather(
+            *(self._publish_task(*task, headers=headers) for task, headers, _ in batch),
+            return_exceptions=True
+        )
+        for (_, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(None)
+        logger.debug("Published batch of %d processing tasks", len(batch))
+    
+    def _publish_channel(self) -> AbstractChannel:
+        """Next publish channel in round-robin order."""
+        channel = self.publish_channels[self._next_channel % len(self.publish_channels)]
+        self._next_channel += 1
+        return channel
+    
+    async def _publish_task(
+        self,
+        image_id: str,
+        image_path: str,
+        queue: Optional[str] = None,
+        variant: Optional[str] = None,
+        headers: Optional[Dict[str, Any]] = None
+    ) -> None:
+        """Publish one persistent task message and wait for its confirmation."""
         message = {
             "image_id": image_id,
             "image_path": image_path
         }
+        if variant:
+            message["variant"] = variant
         
-        try:
-            await self.channel.default_exchange.publish(
+        with PUBLISH_DURATION.time():
+            await self._publish_channel().default_exchange.publish(
                 aio_pika.Message(
                     json.dumps(message).encode(),
-                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT
+                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                    # The worker reports queue lag from it and continues the trace
+                    headers=headers or task_headers(current_traceparent())
                 ),
-                routing_key=settings.QUEUE_NAME
+                routing_key=queue or settings.QUEUE_NAME
             )
-            logger.info(f"Sent processing task for image {image_id}")
-        except Exception as e:
-            logger.error(f"Failed to send task for image {image_id}: {e}")
-            raise
     
-    async def is_healthy(self) -> bool:
-        """Check if RabbitMQ connection is healthy."""
+    async def publish_status_event(self, image_id: str, status: str) -> None:
+        """Announce a status change to all API replicas (best effort).
+        
+        Only published on an established connection: a missed event merely
+        delays cache invalidation until the entry's TTL runs out.
+        """
+        if not self.status_exchange:
+            return
+        
         try:
-            if not self.connection or self.connection.is_closed:
-                await self.connect()
-            return not self.connection.is_closed
+            await publish_status_event(self.status_exchange, image_id, status)
         except Exception as e:
-            logger.error(f"RabbitMQ health check failed: {e}")
-            return False
+            logger.warning(f"Failed to publish status event for image {image_id}: {e}")
+    
+    async def subscribe_status_events(self, *callbacks: StatusCallback) -> None:
+        """Feed every status event to ``callbacks`` through a private queue.
+        
+        The subscription outlives a failed connect: the next successful
+        ``connect()`` sets it up, so start ``keep_connecting()`` if this raises.
+        """
+        self._status_subscriptions.append(callbacks)
+        if self.connection is not None and not self.connection.is_closed:
+            await self._consume_status_events(callbacks)
+        else:
+            await self.connect()
+    
+    async def keep_connecting(self, interval: float) -> None:
+        """Retry ``connect()`` every ``interval`` seconds until it succeeds."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.connect()
+                return
+            except Exception:
+                # connect() logged the failure
+                pass
+    
+    async def _consume_status_events(self, callbacks: Tuple[StatusCallback, ...]) -> None:
+        if self.channel is None:
+            raise ConnectionError("Not connected to RabbitMQ")
+        
+        # Exclusive, auto-deleted queue: each replica receives its own copy
+        queue = await self.channel.declare_queue(exclusive=True, auto_delete=True)
+        await queue.bind(self.status_exchange)
+        
+        async def on_message(message: aio_pika.abc.AbstractIncomingMessage) -> None:
+            try:
+                event = json.loads(message.body.decode())
+            except ValueError as e:
+                logger.error(f"Malformed status event: {e}")
+                return
+            for callback in callbacks:
+                try:
+                    await callback(event)
+                except Exception as e:
+                    logger.error(f"Failed to handle status event: {e}")
+        
+        await queue.consume(on_message, no_ack=True)
+        logger.info("Subscribed to image status events")
+    
+    async def queue_stats(self) -> Dict[str, Dict[str, int]]:
+        """Ready messages and consumers of every lane queue, by passive declaration."""
+        if self.connection is None or self.connection.is_closed:
+            raise ConnectionError("Not connected to RabbitMQ")
+        
+        # Declaring a missing queue closes the channel, so not the shared one
+        # carrying the status-event consumer
+        channel = await self.connection.channel()
+        try:
+            stats = {}
+            for lane in QUEUE_LANES:
+                queue = await channel.declare_queue(lane_queue(lane), passive=True)
+                stats[lane_queue(lane)] = {
+                    "messages": queue.declaration_result.message_count or 0,
+                    "consumers": queue.declaration_result.consumer_count or 0
+                }
+            return stats
+        finally:
+            await channel.close()
+    
+    async def is_healthy(self) -> bool:
+        """Check if the RabbitMQ connection and channel are open, without connecting.
+        
+        The robust connection reconnects by itself.
+        """
+        return (
+            self.connection is not None and not self.connection.is_closed
+            and self.channel is not None and not self.channel.is_closed
+        )
+
+
+# Lanes by estimated decode cost, smallest first
+QUEUE_LANES = ("small", "large")
+
+
+def lane_queue(lane: str) -> str:
+    """Queue of a lane; the large lane keeps the historical queue name."""
+    if lane == "large":
+        return settings.QUEUE_NAME
+    return f"{settings.QUEUE_NAME}.{lane}"
+
+
+def select_lane(pixels: Optional[int], file_size: Optional[int] = None) -> str:
+    """Pick the lane of an image from its pixel count, or its file size if unknown.
+    
+    A lane whose ``WORKER_LANE_WEIGHTS`` weight is zero has no consumers, so
+    its images go to a weighted lane instead.
+    """
+    if pixels is not None:
+        small = pixels <= settings.QUEUE_LANE_SMALL_MAX_PIXELS
+    elif file_size is not None:
+        small = file_size <= settings.QUEUE_LANE_SMALL_MAX_BYTES
+    else:
+        small = False
+    lane = "small" if small else "large"
+    
+    weights = settings.WORKER_LANE_WEIGHTS
+    if weights.get(lane, 0) <= 0:
+        lane = next((other for other in QUEUE_LANES if weights.get(other, 0) > 0), lane)
+    return lane
+
+
+def lane_prefetch(concurrency: int, weights: Dict[str, int]) -> Dict[str, int]:
+    """Split ``concurrency`` executor slots between lanes by weight.
+    
+    Every weighted lane gets at least one slot, so small images always have
+    capacity reserved that large ones cannot occupy.
+    """
+    lanes = [lane for lane in QUEUE_LANES if weights.get(lane, 0) > 0]
+    if not lanes:
+        raise ValueError("At least one queue lane needs a positive weight")
+    
+    remaining = max(concurrency - len(lanes), 0)
+    total = sum(weights[lane] for lane in lanes)
+    shares = {lane: remaining * weights[lane] / total for lane in lanes}
+    slots = {lane: 1 + int(shares[lane]) for lane in lanes}
+    
+    # Hand out slots lost to rounding by largest remainder
+    leftover = remaining - sum(int(share) for share in shares.values())
+    by_remainder = sorted(
+        lanes,
+        key=lambda lane: (shares[lane] - int(shares[lane]), weights[lane]),
+        reverse=True
+    )
+    for lane in by_remainder:
+        if leftover <= 0:
+            break
+        slots[lane] += 1
+        leftover -= 1
+    return slots
+
+
+async def connect_broker(url: Optional[str] = None) -> AbstractRobustConnection:
+    """Open a robust connection to ``url`` (default ``RABBITMQ_URL``).
+    
+    ``memory://`` selects the in-process broker, for running the API and a
+    worker in one process without RabbitMQ (see ``src.tools.load_test``).
+    """
+    url = url or settings.RABBITMQ_URL
+    if url.startswith("memory://"):
+        return await memory_broker.connect()  # type: ignore[return-value]
+    return await aio_pika.connect_robust(url)
+
+
+async def declare_status_exchange(
+    channel: aio_pika.abc.AbstractChannel
+) -> aio_pika.abc.AbstractExchange:
+    """Declare the fanout exchange used for image status events."""
+    return await channel.declare_exchange(
+        settings.STATUS_EXCHANGE_NAME,
+        aio_pika.ExchangeType.FANOUT,
+        durable=True
+    )
+
+
+async def publish_status_event(
+    exchange: aio_pika.abc.AbstractExchange,
+    image_id: str,
+    status: str,
+    original_path: Optional[str] = None,
+    thumbnail_paths: Optional[Dict[str, str]] = None,
+    variants: Optional[Dict[str, Dict[str, Optional[str]]]] = None
+) -> None:
+    """Publish a transient status event.
+    
+    The event carries the stored paths (and, in fan-out mode, the
+    ``{"status", "path"}`` of each variant) so that waiting clients can be
+    answered without reading the row back.
+    """
+    event: Dict[str, Any] = {
+        "image_id": image_id,
+        "status": status,
+        "original_path": original_path,
+        "thumbnail_paths": thumbnail_paths or {}
+    }
+    if variants is not None:
+        event["variants"] = variants
+    await exchange.publish(
+        aio_pika.Message(
+            json.dumps(event).encode(),
+            content_type="application/json"
+        ),
+        routing_key=""
+    )
 
 
 # Global RabbitMQ service instance
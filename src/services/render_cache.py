@@ -0,0 +1,232 @@
+"""Tiered cache for on-demand rendered image variants."""
+
+import asyncio
+import os
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+from src.config import settings
+from src.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class RenderCache:
+    """In-memory LRU in front of a size-bounded disk cache.
+    
+    Concurrent requests for the same key are coalesced so that a burst of
+    identical requests triggers a single disk read or render. Deleting an
+    image purges its variants from both tiers (``invalidate_image``).
+    """
+    
+    def __init__(
+        self,
+        memory_bytes: Optional[int] = None,
+        disk_bytes: Optional[int] = None,
+        directory: Optional[str] = None
+    ):
+        self.memory_bytes = (
+            settings.RENDER_MEMORY_CACHE_BYTES if memory_bytes is None else memory_bytes
+        )
+        self.disk_bytes = settings.RENDER_DISK_CACHE_BYTES if disk_bytes is None else disk_bytes
+        self._directory = directory
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_size = 0
+        self._disk_size: Optional[int] = None
+        # Disk writes run in worker threads
+        self._disk_lock = threading.Lock()
+        self._inflight: Dict[str, "asyncio.Task[bytes]"] = {}
+    
+    @property
+    def directory(self) -> str:
+        """Directory holding the disk tier."""
+        return self._directory or os.path.join(settings.STORAGE_PATH, "cache", "renders")
+    
+    @staticmethod
+    def key(image_id: str, width: int, height: int, fit: str) -> str:
+        """Build the cache key of a rendered variant."""
+        return f"{image_id}_{width}x{height}_{fit}"
+    
+    async def get_or_render(self, key: str, render: Callable[[], Awaitable[bytes]]) -> bytes:
+        """Return cached bytes for ``key``, awaiting ``render()`` only on a miss.
+        
+        Fetching the source belongs in ``render``, so hits cost no download.
+        """
+        data = self._memory_get(key)
+        if data is not None:
+            return data
+        
+        task = self._inflight.get(key)
+        if task is None:
+            # The task belongs to no request, so a cancelled request leaves
+            # the render running for the others waiting on it
+            task = asyncio.create_task(self._load(key, render))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+    
+    async def _load(self, key: str, render: Callable[[], Awaitable[bytes]]) -> bytes:
+        """Read the disk tier or render, then fill both tiers."""
+        data = await asyncio.to_thread(self._disk_get, key)
+        if data is None:
+            data = await render()
+            if not self._current(key):
+                return data
+            await asyncio.to_thread(self._disk_put, key, data)
+        if self._current(key):
+            self._memory_put(key, data)
+        return data
+    
+    def _current(self, key: str) -> bool:
+        """Whether the running load was not purged meanwhile.
+        
+        A purged load still answers its waiters but must not refill the tiers.
+        """
+        return self._inflight.get(key) is asyncio.current_task()
+    
+    async def invalidate_image(self, image_id: str) -> None:
+        """Drop every cached variant of an image (canonical id) from both tiers."""
+        prefix = f"{image_id}_"
+        for key in [key for key in self._memory if key.startswith(prefix)]:
+            self._memory_size -= len(self._memory.pop(key))
+        for key in [key for key in self._inflight if key.startswith(prefix)]:
+            del self._inflight[key]
+        await asyncio.to_thread(self._disk_purge, prefix)
+    
+    async def handle_status_event(self, event: Dict[str, Any]) -> None:
+        """Purge an image deleted through any replica (``DELETE /images/{id}`` event)."""
+        if event.get("status") != "DELETED":
+            return
+        try:
+            image_id = str(uuid.UUID(str(event.get("image_id"))))
+        except ValueError:
+            return
+        await self.invalidate_image(image_id)
+    
+    def _finish(self, key: str, task: "asyncio.Task[bytes]") -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark retrieved so an error whose waiters all left is not reported
+        if not task.cancelled():
+            task.exception()
+    
+    def _memory_get(self, key: str) -> Optional[bytes]:
+        """Look up the memory tier, refreshing recency on a hit."""
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+        return data
+    
+    def _memory_put(self, key: str, data: bytes) -> None:
+        """Insert into the memory tier, evicting least recently used entries."""
+        if len(data) > self.memory_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_size -= len(previous)
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+    
+    def _disk_path(self, key: str) -> str:
+        """Path of a cached variant, sharded by the key prefix."""
+        return os.path.join(self.directory, key[:2], f"{key}.jpg")
+    
+    def _disk_get(self, key: str) -> Optional[bytes]:
+        """Read the disk tier, bumping the file's mtime for LRU eviction."""
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+    
+    def _disk_put(self, key: str, data: bytes) -> None:
+        """Atomically write to the disk tier and evict if over budget."""
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        
+        with self._disk_lock:
+            if self._disk_size is None:
+                self._disk_size = self._scan_disk_size()
+            else:
+                self._disk_size += len(data)
+            if self._disk_size > self.disk_bytes:
+                self._evict_disk()
+    
+    def _disk_purge(self, prefix: str) -> None:
+        """Delete the disk-tier files whose key starts with ``prefix``."""
+        directory = os.path.dirname(self._disk_path(prefix))
+        try:
+            names = [name for name in os.listdir(directory) if name.startswith(prefix)]
+        except FileNotFoundError:
+            return
+        removed = 0
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                removed += os.path.getsize(path)
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        with self._disk_lock:
+            if self._disk_size is not None:
+                self._disk_size = max(self._disk_size - removed, 0)
+    
+    def _scan_disk_size(self) -> int:
+        """Total bytes currently held by the disk tier."""
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except FileNotFoundError:
+                    pass
+        return total
+    
+    def _evict_disk(self) -> None:
+        """Delete least recently used files until usage is below 90% of the budget.
+        
+        Called with ``_disk_lock`` held.
+        """
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        
+        total = sum(size for _, size, _ in entries)
+        target = int(self.disk_bytes * 0.9)
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._disk_size = total
+        logger.info(f"Evicted render cache down to {total} bytes")
+
+
+# Global render cache instance
+render_cache = RenderCache()
@@ -0,0 +1,115 @@
+"""Write-behind batching of image status updates."""
+
+import asyncio
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from src.config import settings
+from src.database.connection import AsyncSessionLocal
+from src.models.image import ImageStatus
+from src.services.image_service import ImageService
+from src.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class StatusBatcher:
+    """Coalesce status updates from concurrent jobs into one write per flush.
+    
+    ``submit`` resolves only once the update is committed, so callers can
+    still acknowledge their message after the status is durable. A database
+    connection is only held while a batch is being written.
+    """
+    
+    def __init__(
+        self,
+        session_factory: Callable[[], Any] = AsyncSessionLocal,
+        flush_interval: Optional[float] = None,
+        max_batch: Optional[int] = None
+    ):
+        self.session_factory = session_factory
+        self.flush_interval = (
+            settings.WORKER_STATUS_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        )
+        self.max_batch = settings.WORKER_STATUS_MAX_BATCH if max_batch is None else max_batch
+        self._pending: List[Tuple[Dict[str, Any], "asyncio.Future[None]"]] = []
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task: Optional["asyncio.Task[None]"] = None
+    
+    def start(self) -> None:
+        """Start the background flush loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self) -> None:
+        """Stop the flush loop and write any pending updates."""
+        if self._task is not None:
+            # Let a flush in progress finish: cancelling it would leave the
+            # callers of its batch waiting forever
+            self._stopping = True
+            self._wakeup.set()
+            try:
+                await self._task
+            finally:
+                self._task = None
+                self._stopping = False
+        await self.flush()
+    
+    async def submit(
+        self,
+        image_id: str,
+        status: ImageStatus,
+        thumbnail_paths: Optional[dict] = None,
+        error_message: Optional[str] = None,
+        timings: Optional[Dict[str, Any]] = None
+    ) -> None:
+        """Queue a status update and wait until it has been committed."""
+        future: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self._pending.append(({
+            "image_id": image_id,
+            "status": status,
+            "thumbnail_paths": thumbnail_paths,
+            "error_message": error_message,
+            "timings": timings
+        }, future))
+        
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+        await future
+    
+    async def flush(self) -> None:
+        """Write all pending updates in a single transaction."""
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        
+        try:
+            async with self.session_factory() as db:
+                await ImageService.set_image_statuses(db, [update for update, _ in batch])
+        except asyncio.CancelledError:
+            self._fail(batch, RuntimeError("Status flush was cancelled"))
+            raise
+        except Exception as e:
+            logger.error(f"Failed to flush {len(batch)} status updates: {e}")
+            self._fail(batch, e)
+            return
+        
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+        logger.debug("Flushed %d status updates", len(batch))
+    
+    @staticmethod
+    def _fail(batch: List[Tuple[Dict[str, Any], "asyncio.Future[None]"]], error: Exception) -> None:
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+    
+    async def _run(self) -> None:
+        """Flush every ``flush_interval`` or as soon as a batch is full, until stopped."""
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
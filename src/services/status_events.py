@@ -0,0 +1,98 @@
+"""In-process fan-out of image status events to waiting clients."""
+
+import asyncio
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Optional, Set
+from src.config import settings
+from src.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class Subscription:
+    """Events for a changing set of image ids, delivered through a bounded queue."""
+    
+    def __init__(self, bus: "StatusEventBus", maxsize: int):
+        self._bus = bus
+        self._queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize)
+        self.image_ids: Set[str] = set()
+    
+    def add(self, image_ids: Iterable[str]) -> None:
+        """Start receiving events for ``image_ids``."""
+        for image_id in image_ids:
+            if image_id not in self.image_ids:
+                self.image_ids.add(image_id)
+                self._bus._subscribers[image_id].add(self)
+    
+    def remove(self, image_ids: Iterable[str]) -> None:
+        """Stop receiving events for ``image_ids``."""
+        for image_id in image_ids:
+            if image_id in self.image_ids:
+                self.image_ids.discard(image_id)
+                self._bus._unregister(image_id, self)
+    
+    def close(self) -> None:
+        """Unsubscribe from everything."""
+        self.remove(list(self.image_ids))
+    
+    def put(self, event: Dict[str, Any]) -> None:
+        """Enqueue an event, dropping the oldest one if the client is not keeping up."""
+        if self._queue.full():
+            self._queue.get_nowait()
+            logger.warning("Status event subscriber is lagging, dropped an event")
+        self._queue.put_nowait(event)
+    
+    async def get(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Next event, or ``None`` once ``timeout`` seconds pass without one."""
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+    
+    def __enter__(self) -> "Subscription":
+        return self
+    
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+class StatusEventBus:
+    """Route status events from the fanout exchange to local subscribers.
+    
+    One broker consumer per replica feeds every SSE, WebSocket and long-poll
+    client, so waiting clients cost neither a broker queue nor a database query.
+    """
+    
+    def __init__(self, queue_size: Optional[int] = None):
+        self.queue_size = settings.EVENTS_QUEUE_SIZE if queue_size is None else queue_size
+        self._subscribers: Dict[str, Set[Subscription]] = defaultdict(set)
+    
+    def subscribe(self, image_ids: Iterable[str] = ()) -> Subscription:
+        """Create a subscription, optionally for an initial set of ids."""
+        subscription = Subscription(self, self.queue_size)
+        subscription.add(image_ids)
+        return subscription
+    
+    def subscriber_count(self, image_id: str) -> int:
+        """Number of subscriptions waiting on ``image_id``."""
+        return len(self._subscribers.get(image_id, ()))
+    
+    async def handle_status_event(self, event: Dict[str, Any]) -> None:
+        """Deliver an event to every subscription interested in its image."""
+        image_id = event.get("image_id")
+        if not image_id:
+            return
+        for subscription in list(self._subscribers.get(str(image_id), ())):
+            subscription.put(event)
+    
+    def _unregister(self, image_id: str, subscription: Subscription) -> None:
+        """Remove a subscription, dropping the id entry once nobody waits on it."""
+        subscribers = self._subscribers.get(image_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[image_id]
+
+
+# Global status event bus instance
+status_event_bus = StatusEventBus()
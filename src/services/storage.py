@@ -0,0 +1,436 @@
+"""Storage backends for originals and thumbnails."""
+
+import asyncio
+import hashlib
+import hmac
+import mimetypes
+import os
+import stat
+import tempfile
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import AsyncIterable, AsyncIterator, Dict, List, Optional
+from urllib.parse import quote, urlsplit
+import httpx
+from src.config import settings
+from src.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Two levels of 256 directories keep every directory small at millions of files
+SHARD_LEVELS = 2
+
+# Kinds of objects served under /static; the root also holds packs, scratch
+# files and caches, which must not be
+SERVED_KINDS = ("originals", "thumbnails")
+
+
+def _served(key: str) -> bool:
+    """Whether a normalized key names an object of a served kind."""
+    kind, separator, name = key.partition("/")
+    return kind in SERVED_KINDS and bool(separator) and bool(name)
+
+
+def shard_key(kind: str, name: str) -> str:
+    """Relative key of an object: ``<kind>/ab/cd/<name>``.
+    
+    The shards come from a hash of the name, so they are evenly filled even
+    for names sharing a prefix.
+    """
+    digest = hashlib.md5(name.encode()).hexdigest()
+    shards = [digest[2 * level:2 * level + 2] for level in range(SHARD_LEVELS)]
+    return "/".join([kind, *shards, name])
+
+
+async def _file_chunks(
+    path: str,
+    chunk_size: int,
+    offset: int = 0,
+    length: Optional[int] = None
+) -> AsyncIterator[bytes]:
+    """Read a local file (or ``length`` bytes from ``offset``) in chunks off the event loop."""
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
+        if offset:
+            f.seek(offset)
+        remaining = length
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            chunk = await asyncio.to_thread(f.read, size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+class Storage(ABC):
+    """Where originals and thumbnails are kept.
+    
+    Objects are addressed by a kind (``originals``, ``thumbnails``) and a
+    file name. The backend picks the layout and returns a *location*, which
+    is what the database stores and what is passed back to read, serve or
+    delete the object. Producers that need a local file (Pillow) write to
+    ``stage()`` and hand the file over with ``save()``.
+    """
+    
+    def __init__(self, root: Optional[str] = None):
+        self._root = root
+    
+    @property
+    def root(self) -> str:
+        """Local directory for files (local backend) or scratch files (remote)."""
+        return self._root or settings.STORAGE_PATH
+    
+    @property
+    def scratch_directory(self) -> str:
+        """Unserved directory for partial files, on the same filesystem as ``root``."""
+        return os.path.join(self.root, "tmp")
+    
+    @abstractmethod
+    def stage(self, kind: str, name: str) -> str:
+        """Local path where a new object should be written before ``save()``."""
+    
+    @abstractmethod
+    async def save(self, local_path: str, kind: str, name: str) -> str:
+        """Move a local file into storage and return its location."""
+    
+    async def write(self, kind: str, name: str, chunks: AsyncIterable[bytes]) -> str:
+        """Store an object streamed as chunks and return its location."""
+        path = self._scratch_path()
+        try:
+            f = await asyncio.to_thread(open, path, "wb")
+            try:
+                async for chunk in chunks:
+                    await asyncio.to_thread(f.write, chunk)
+            finally:
+                f.close()
+            return await self.save(path, kind, name)
+        except BaseException:
+            await asyncio.to_thread(_unlink_quietly, path)
+            raise
+    
+    @abstractmethod
+    def read(
+        self,
+        location: str,
+        chunk_size: int = 65536,
+        offset: int = 0,
+        length: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        """Stream the content of an object, or ``length`` bytes from ``offset``."""
+    
+    @abstractmethod
+    async def size(self, location: str) -> Optional[int]:
+        """Size of an object in bytes, or ``None`` if it does not exist."""
+    
+    async def exists(self, location: str) -> bool:
+        """Whether an object exists."""
+        return await self.size(location) is not None
+    
+    @abstractmethod
+    async def delete(self, locations: List[str]) -> None:
+        """Delete objects, ignoring ones that are already gone."""
+    
+    @asynccontextmanager
+    async def local_file(self, location: str) -> AsyncIterator[str]:
+        """Path of a local copy of an object, valid inside the context."""
+        path = self.local_path(location)
+        if path is not None:
+            yield path
+            return
+        
+        path = self._scratch_path()
+        try:
+            with open(path, "wb") as f:
+                async for chunk in self.read(location):
+                    await asyncio.to_thread(f.write, chunk)
+            yield path
+        finally:
+            await asyncio.to_thread(_unlink_quietly, path)
+    
+    def local_path(self, location: str) -> Optional[str]:
+        """Local path of an object, or ``None`` if it is stored remotely."""
+        return None
+    
+    @abstractmethod
+    def location_of(self, kind: str, name: str) -> str:
+        """Location an object of ``kind`` named ``name`` is saved to."""
+    
+    @abstractmethod
+    def key_of(self, location: str) -> str:
+        """Relative key of a location, as served under ``/static``."""
+    
+    @abstractmethod
+    def resolve(self, key: str) -> Optional[str]:
+        """Location of a ``/static`` key, or ``None`` if it is not a valid key.
+        
+        Only keys of ``SERVED_KINDS`` are valid.
+        """
+    
+    def url(self, location: str) -> str:
+        """Public URL of an object."""
+        key = self.key_of(location)
+        if settings.STORAGE_PUBLIC_URL:
+            return f"{settings.STORAGE_PUBLIC_URL.rstrip('/')}/{key}"
+        return f"/static/{key}"
+    
+    async def close(self) -> None:
+        """Release connections held by the backend."""
+    
+    def _scratch_path(self) -> str:
+        """Fresh temporary file path on the local disk."""
+        os.makedirs(self.scratch_directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=self.scratch_directory, suffix=".part")
+        os.close(fd)
+        return path
+
+
+class LocalStorage(Storage):
+    """Hash-sharded directory tree on the local disk (``<root>/<kind>/ab/cd/<name>``).
+    
+    Locations are absolute paths. Paths of the flat layout used before
+    sharding stay readable until ``src.tools.reshard_storage`` moves them.
+    """
+    
+    def stage(self, kind: str, name: str) -> str:
+        path = self.location_of(kind, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+    
+    async def save(self, local_path: str, kind: str, name: str) -> str:
+        path = self.location_of(kind, name)
+        if local_path != path:
+            await asyncio.to_thread(os.makedirs, os.path.dirname(path), exist_ok=True)
+            await asyncio.to_thread(os.replace, local_path, path)
+        return path
+    
+    async def read(
+        self,
+        location: str,
+        chunk_size: int = 65536,
+        offset: int = 0,
+        length: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        async for chunk in _file_chunks(location, chunk_size, offset, length):
+            yield chunk
+    
+    async def size(self, location: str) -> Optional[int]:
+        try:
+            result = await asyncio.to_thread(os.stat, location)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        return result.st_size if stat.S_ISREG(result.st_mode) else None
+    
+    async def delete(self, locations: List[str]) -> None:
+        for location in locations:
+            await asyncio.to_thread(_unlink_quietly, location)
+    
+    def local_path(self, location: str) -> Optional[str]:
+        return location
+    
+    def location_of(self, kind: str, name: str) -> str:
+        return os.path.join(self.root, *shard_key(kind, name).split("/"))
+    
+    def key_of(self, location: str) -> str:
+        relative = os.path.relpath(location, self.root)
+        if relative.startswith(os.pardir):
+            # Written under another root: keep the last directory, as the flat layout did
+            directory, filename = os.path.split(location)
+            return f"{os.path.basename(directory)}/{filename}"
+        return relative.replace(os.sep, "/")
+    
+    def resolve(self, key: str) -> Optional[str]:
+        path = os.path.normpath(os.path.join(self.root, key))
+        root = os.path.join(os.path.normpath(self.root), "")
+        if not path.startswith(root) or not _served(path[len(root):].replace(os.sep, "/")):
+            return None
+        return path
+
+
+class S3Storage(Storage):
+    """Objects in a bucket of an S3-compatible service, keyed like the local shards.
+    
+    Requests are signed with AWS Signature V4 and use path-style addressing,
+    which S3, MinIO and other stand-ins all accept. Bodies are streamed and
+    not hashed (``UNSIGNED-PAYLOAD``). Locations are object keys.
+    """
+    
+    def __init__(
+        self,
+        endpoint_url: Optional[str] = None,
+        bucket: Optional[str] = None,
+        access_key: Optional[str] = None,
+        secret_key: Optional[str] = None,
+        region: Optional[str] = None,
+        root: Optional[str] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        super().__init__(root)
+        self.endpoint_url = (endpoint_url or settings.S3_ENDPOINT_URL).rstrip("/")
+        self.bucket = bucket or settings.S3_BUCKET
+        self.access_key = access_key or settings.S3_ACCESS_KEY
+        self.secret_key = secret_key or settings.S3_SECRET_KEY
+        self.region = region or settings.S3_REGION
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared HTTP client, created on first use."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                transport=self._transport,
+                timeout=settings.S3_TIMEOUT
+            )
+        return self._client
+    
+    def stage(self, kind: str, name: str) -> str:
+        path = os.path.join(self.root, "staging", *shard_key(kind, name).split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+    
+    async def save(self, local_path: str, kind: str, name: str) -> str:
+        key = shard_key(kind, name)
+        size = await asyncio.to_thread(os.path.getsize, local_path)
+        headers = {
+            "Content-Length": str(size),
+            "Content-Type": mimetypes.guess_type(name)[0] or "application/octet-stream"
+        }
+        response = await self.client.put(
+            self._url(key),
+            content=_file_chunks(local_path, settings.UPLOAD_CHUNK_SIZE),
+            headers=self._sign("PUT", key, headers)
+        )
+        response.raise_for_status()
+        await asyncio.to_thread(_unlink_quietly, local_path)
+        return key
+    
+    async def read(
+        self,
+        location: str,
+        chunk_size: int = 65536,
+        offset: int = 0,
+        length: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        headers = {}
+        if offset or length is not None:
+            end = "" if length is None else str(offset + length - 1)
+            headers["Range"] = f"bytes={offset}-{end}"
+        async with self.client.stream(
+            "GET", self._url(location), headers=self._sign("GET", location, headers)
+        ) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(chunk_size):
+                yield chunk
+    
+    async def size(self, location: str) -> Optional[int]:
+        response = await self.client.head(
+            self._url(location), headers=self._sign("HEAD", location)
+        )
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return int(response.headers.get("Content-Length", 0))
+    
+    async def delete(self, locations: List[str]) -> None:
+        for location in locations:
+            response = await self.client.delete(
+                self._url(location), headers=self._sign("DELETE", location)
+            )
+            if response.status_code != 404:
+                response.raise_for_status()
+    
+    def location_of(self, kind: str, name: str) -> str:
+        return shard_key(kind, name)
+    
+    def key_of(self, location: str) -> str:
+        return location
+    
+    def resolve(self, key: str) -> Optional[str]:
+        if not key or any(part in ("", ".", "..") for part in key.split("/")):
+            return None
+        return key if _served(key) else None
+    
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    def _path(self, key: str) -> str:
+        """URI-encoded request path of an object."""
+        return "/" + quote(f"{self.bucket}/{key}", safe="/-_.~")
+    
+    def _url(self, key: str) -> str:
+        return self.endpoint_url + self._path(key)
+    
+    def _sign(
+        self,
+        method: str,
+        key: str,
+        headers: Optional[Dict[str, str]] = None
+    ) -> Dict[str, str]:
+        """Headers of a request signed with AWS Signature V4."""
+        now = datetime.utcnow()
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        scope = f"{now:%Y%m%d}/{self.region}/s3/aws4_request"
+        
+        signed = {
+            "host": urlsplit(self.endpoint_url).netloc,
+            "x-amz-content-sha256": "UNSIGNED-PAYLOAD",
+            "x-amz-date": amz_date
+        }
+        names = sorted(signed)
+        canonical_request = "\n".join([
+            method,
+            self._path(key),
+            "",
+            "".join(f"{name}:{signed[name]}\n" for name in names),
+            ";".join(names),
+            "UNSIGNED-PAYLOAD"
+        ])
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256",
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode()).hexdigest()
+        ])
+        
+        signing_key = f"AWS4{self.secret_key}".encode()
+        for part in scope.split("/"):
+            signing_key = hmac.new(signing_key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(signing_key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+        
+        return {
+            **(headers or {}),
+            "x-amz-content-sha256": signed["x-amz-content-sha256"],
+            "x-amz-date": amz_date,
+            "Authorization": (
+                f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+                f"SignedHeaders={';'.join(names)}, Signature={signature}"
+            )
+        }
+
+
+def _unlink_quietly(path: str) -> None:
+    """Remove a file if it exists."""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def create_storage() -> Storage:
+    """Build the backend selected by ``STORAGE_BACKEND``."""
+    if settings.STORAGE_BACKEND == "local":
+        return LocalStorage()
+    if settings.STORAGE_BACKEND == "s3":
+        return S3Storage()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {settings.STORAGE_BACKEND}")
+
+
+# Global storage instance
+storage = create_storage()
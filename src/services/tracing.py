@@ -0,0 +1,114 @@
+"""W3C trace context propagation, with finished spans written as log records."""
+
+import os
+import random
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Iterator, Optional
+from src.config import settings
+from src.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+TRACEPARENT_HEADER = "traceparent"
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+@dataclass(frozen=True)
+class SpanContext:
+    """Identity of a span, as carried in a ``traceparent`` header."""
+    trace_id: str
+    span_id: str
+    sampled: bool = True
+    
+    @classmethod
+    def parse(cls, header: Optional[str]) -> Optional["SpanContext"]:
+        """Context of a ``traceparent`` header, or ``None`` if absent or invalid."""
+        match = _TRACEPARENT.match((header or "").strip().lower())
+        if not match or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+            return None
+        return cls(match.group(1), match.group(2), bool(int(match.group(3), 16) & 1))
+    
+    def to_header(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+    
+    def child(self) -> "SpanContext":
+        """Context of a new span in the same trace."""
+        return SpanContext(self.trace_id, os.urandom(8).hex(), self.sampled)
+
+
+_current: ContextVar[Optional[SpanContext]] = ContextVar("span_context", default=None)
+
+
+def current_span() -> Optional[SpanContext]:
+    """Context of the span the caller runs in."""
+    return _current.get()
+
+
+def current_traceparent() -> Optional[str]:
+    """``traceparent`` header continuing the caller's trace, if any."""
+    context = _current.get()
+    return context.to_header() if context else None
+
+
+def _root() -> SpanContext:
+    """Context of a new trace, sampled with ``TRACE_SAMPLE_RATE``."""
+    return SpanContext(
+        os.urandom(16).hex(),
+        os.urandom(8).hex(),
+        random.random() < settings.TRACE_SAMPLE_RATE
+    )
+
+
+@contextmanager
+def span(
+    name: str,
+    parent: Optional[SpanContext] = None,
+    **attributes: Any
+) -> Iterator[SpanContext]:
+    """Run the block as a span, child of ``parent`` or of the current span.
+    
+    Without either a new trace is started.
+    """
+    parent = parent or _current.get()
+    context = parent.child() if parent else _root()
+    token = _current.set(context)
+    started = time.time()
+    try:
+        yield context
+    finally:
+        _current.reset(token)
+        record_span(name, context, parent, started, time.time(), **attributes)
+
+
+def record_span(
+    name: str,
+    context: SpanContext,
+    parent: Optional[SpanContext],
+    started: float,
+    ended: float,
+    **attributes: Any
+) -> None:
+    """Write a finished span (Unix times) if its trace is sampled.
+    
+    Also used for stages timed elsewhere, e.g. in an executor process.
+    """
+    if not context.sampled:
+        return
+    logger.info(
+        "Span %s",
+        name,
+        extra={
+            "span": name,
+            "trace_id": context.trace_id,
+            "span_id": context.span_id,
+            "parent_span_id": parent.span_id if parent else None,
+            "start": round(started, 6),
+            "duration_ms": round((ended - started) * 1000, 3),
+            **attributes
+        }
+    )
@@ -0,0 +1,394 @@
+"""Benchmark the thumbnail engine on a synthetic corpus and gate regressions.
+
+Usage: python -m src.tools.benchmark_thumbnails run [--output FILE] [--resolutions NAME ...]
+       python -m src.tools.benchmark_thumbnails compare BASELINE CURRENT [--threshold 0.1]
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import get_context
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import PIL
+from PIL import Image
+from src.config import settings
+from src.services import image_processor
+from src.services.image_processor import ImageProcessor
+from src.services.pack_storage import PackStore
+from src.services.logger import setup_logging, get_logger
+
+logger = get_logger(__name__)
+
+# Bump when the generator changes, so results on different corpora are not compared
+CORPUS_VERSION = 1
+
+RESOLUTIONS: Dict[str, Tuple[int, int]] = {
+    "vga": (640, 480),
+    "2mp": (1920, 1080),
+    "12mp": (4000, 3000),
+    "24mp": (6000, 4000),
+    "50mp": (8688, 5792),
+}
+
+# Modes each input format is generated in (JPEG has no alpha or palette)
+FORMAT_MODES: Dict[str, Tuple[str, ...]] = {
+    "JPEG": ("RGB", "L"),
+    "PNG": ("RGB", "RGBA", "P", "L"),
+    "WEBP": ("RGB", "RGBA"),
+}
+
+EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp"}
+
+# Size of the on-demand render paths (the largest configured thumbnail)
+RENDER_SIZE = (1200, 1200)
+
+# Metrics gated by ``compare``; all of them are "lower is better"
+GATED_METRICS = ("p50_ms", "p95_ms", "peak_rss_mb")
+
+
+def _thumbnails(strict: bool) -> Callable[[str, str, Dict[str, float]], Any]:
+    def run(image_id: str, path: str, timings: Dict[str, float]) -> Any:
+        return ImageProcessor.create_thumbnails(image_id, path, timings, strict=strict)
+    return run
+
+
+def _variants(image_id: str, path: str, timings: Dict[str, float]) -> Any:
+    """Every size as its own fan-out subtask, each decoding the original."""
+    for size in settings.THUMBNAIL_SIZES:
+        variant_timings: Dict[str, float] = {}
+        ImageProcessor.create_variant(image_id, path, size, variant_timings)
+        for key, seconds in variant_timings.items():
+            timings[key] = timings.get(key, 0.0) + seconds
+
+
+def _render(fit: str) -> Callable[[str, str, Dict[str, float]], Any]:
+    def run(image_id: str, path: str, timings: Dict[str, float]) -> Any:
+        return ImageProcessor.render_variant(path, RENDER_SIZE[0], RENDER_SIZE[1], fit)
+    return run
+
+
+# Benchmarked path -> (callable, settings overridden while it runs)
+PATHS: Dict[str, Tuple[Callable[[str, str, Dict[str, float]], Any], Dict[str, Any]]] = {
+    "cascaded": (_thumbnails(strict=False), {}),
+    "strict": (_thumbnails(strict=True), {}),
+    "packed": (_thumbnails(strict=False), {"PACK_ENABLED": True}),
+    "variant": (_variants, {}),
+    "render_cover": (_render("cover"), {}),
+    "render_contain": (_render("contain"), {}),
+    "render_fill": (_render("fill"), {}),
+}
+
+
+def synthesize(width: int, height: int, mode: str, seed: int) -> Image.Image:
+    """Deterministic photo-like image: smooth gradients, a fractal and seeded grain.
+    
+    Only Pillow's own generators and a seeded ``random.Random`` are used, so
+    the same arguments give the same pixels on every machine.
+    """
+    base = Image.merge("RGB", (
+        Image.linear_gradient("L").rotate(seed % 360),
+        Image.radial_gradient("L"),
+        Image.effect_mandelbrot((256, 256), (-2.0, -1.25, 0.75, 1.25), 100),
+    )).resize((width, height), Image.Resampling.BILINEAR)
+    
+    # Grain at quarter resolution keeps generation of 50 MP inputs fast
+    grain_size = (max(1, width // 4), max(1, height // 4))
+    grain = Image.frombytes(
+        "L", grain_size, random.Random(seed).randbytes(grain_size[0] * grain_size[1])
+    ).resize((width, height), Image.Resampling.BILINEAR)
+    img = Image.blend(base, Image.merge("RGB", (grain, grain, grain)), 0.3)
+    
+    if mode == "RGBA":
+        alpha = Image.radial_gradient("L").resize((width, height), Image.Resampling.BILINEAR)
+        img.putalpha(Image.eval(alpha, lambda value: 255 - value))
+    elif mode == "P":
+        img = img.convert("P", palette=Image.Palette.ADAPTIVE, colors=256)
+    elif mode == "L":
+        img = img.convert("L")
+    return img
+
+
+def build_corpus(directory: str, resolutions: Sequence[str]) -> List[Dict[str, Any]]:
+    """Generate the missing inputs of the corpus and describe all of them.
+    
+    Inputs are cached in ``directory`` by version, resolution, mode and
+    format; each description carries a digest so runs on different corpora
+    can be told apart.
+    """
+    os.makedirs(directory, exist_ok=True)
+    inputs = []
+    for seed, name in enumerate(resolutions):
+        width, height = RESOLUTIONS[name]
+        for image_format, modes in FORMAT_MODES.items():
+            for mode in modes:
+                input_name = f"{name}_{mode.lower()}.{EXTENSIONS[image_format]}"
+                path = os.path.join(directory, f"v{CORPUS_VERSION}", input_name)
+                if not os.path.exists(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    img = synthesize(width, height, mode, seed)
+                    # Written under a temporary name so an interrupted run leaves no partial input
+                    partial = f"{path}.partial"
+                    img.save(partial, image_format, **_encoder_options(image_format))
+                    os.replace(partial, path)
+                    logger.info(f"Generated {input_name}")
+                
+                with open(path, "rb") as f:
+                    digest = hashlib.sha256(f.read()).hexdigest()
+                inputs.append({
+                    "name": input_name,
+                    "path": path,
+                    "format": image_format,
+                    "mode": mode,
+                    "width": width,
+                    "height": height,
+                    "bytes": os.path.getsize(path),
+                    "sha256": digest,
+                })
+    return inputs
+
+
+def _encoder_options(image_format: str) -> Dict[str, Any]:
+    """Fixed encoder settings of corpus inputs."""
+    if image_format == "JPEG":
+        return {"quality": 90}
+    if image_format == "PNG":
+        return {"compress_level": 6}
+    return {"quality": 90, "method": 4}
+
+
+def percentile(values: Sequence[float], fraction: float) -> float:
+    """Nearest-rank percentile of ``values``."""
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(len(ordered) * fraction)) - 1]
+
+
+def peak_rss_mb() -> float:
+    """High-water mark of the resident set size of this process.
+    
+    Linux reports the current program's own peak in ``/proc``; ``ru_maxrss``
+    also covers the parent's memory before a spawned child exec'ed.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+@contextmanager
+def _overridden(overrides: Dict[str, Any]) -> Iterator[None]:
+    """Temporarily set attributes of ``settings``."""
+    previous = {name: getattr(settings, name) for name in overrides}
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(settings, name, value)
+
+
+def run_case(path_name: str, input_path: str, iterations: int, warmup: int = 1) -> Dict[str, Any]:
+    """Time ``iterations`` runs of one path on one input.
+    
+    Outputs are written to a scratch storage root removed afterwards. Peak
+    RSS is the high-water mark of the calling process, so it only describes
+    the case when run in a fresh process (see ``run_isolated``).
+    """
+    function, overrides = PATHS[path_name]
+    scratch = tempfile.mkdtemp(prefix="thumbnail-bench-")
+    latencies = []
+    stages: Dict[str, float] = {}
+    # A fresh pack store, so packed runs never append to segments of an earlier case
+    pack_store = image_processor.pack_store
+    image_processor.pack_store = PackStore(os.path.join(scratch, "packs"))
+    try:
+        with _overridden({"STORAGE_PATH": scratch, **overrides}):
+            for iteration in range(warmup + iterations):
+                timings: Dict[str, float] = {}
+                started = time.perf_counter()
+                function("benchmark", input_path, timings)
+                elapsed = time.perf_counter() - started
+                if iteration < warmup:
+                    continue
+                latencies.append(elapsed)
+                for key, seconds in timings.items():
+                    stages[key] = stages.get(key, 0.0) + seconds
+    finally:
+        image_processor.pack_store = pack_store
+        shutil.rmtree(scratch, ignore_errors=True)
+    
+    total = sum(latencies)
+    return {
+        "iterations": len(latencies),
+        "throughput_per_s": round(len(latencies) / total, 3) if total else 0.0,
+        "mean_ms": round(total / len(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "stages_ms": {
+            key: round(seconds / len(latencies) * 1000, 3) for key, seconds in sorted(stages.items())
+        },
+    }
+
+
+def run_isolated(path_name: str, input_path: str, iterations: int, warmup: int = 1) -> Dict[str, Any]:
+    """``run_case`` in a freshly spawned process, so its peak RSS is the case's own."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+        return executor.submit(run_case, path_name, input_path, iterations, warmup).result()
+
+
+def run(
+    corpus: List[Dict[str, Any]],
+    paths: Sequence[str],
+    iterations: int,
+    isolated: bool = True
+) -> Dict[str, Any]:
+    """Benchmark every path on every input and return the report."""
+    execute = run_isolated if isolated else run_case
+    results = []
+    for path_name in paths:
+        for item in corpus:
+            measured = execute(path_name, item["path"], iterations)
+            megapixels = item["width"] * item["height"] / 1_000_000
+            measured["megapixels_per_s"] = round(measured["throughput_per_s"] * megapixels, 3)
+            results.append({"path": path_name, "input": item["name"], **measured})
+            logger.info(
+                f"{path_name} {item['name']}: p50 {measured['p50_ms']} ms, "
+                f"p95 {measured['p95_ms']} ms, peak RSS {measured['peak_rss_mb']} MB"
+            )
+    
+    return {
+        "corpus_version": CORPUS_VERSION,
+        "environment": {
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "thumbnail_sizes": [list(size) for size in settings.THUMBNAIL_SIZES],
+            "decode_scale": settings.THUMBNAIL_DECODE_SCALE,
+        },
+        "inputs": [{k: v for k, v in item.items() if k != "path"} for item in corpus],
+        "results": results,
+    }
+
+
+def compare(
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    threshold: float,
+    metrics: Sequence[str] = GATED_METRICS
+) -> Tuple[List[str], List[str]]:
+    """Report lines of every case and metric, and those regressing beyond ``threshold``.
+    
+    A metric regresses when it grew by more than ``threshold`` (a fraction)
+    of its baseline value. Cases present in only one report are listed but
+    never fail the comparison.
+    """
+    report: List[str] = []
+    regressions: List[str] = []
+    if baseline.get("corpus_version") != current.get("corpus_version"):
+        report.append("warning: reports were produced on different corpus versions")
+    baseline_digests = {item["name"]: item["sha256"] for item in baseline.get("inputs", [])}
+    for item in current.get("inputs", []):
+        if baseline_digests.get(item["name"], item["sha256"]) != item["sha256"]:
+            report.append(f"warning: input {item['name']} differs from the baseline")
+    
+    baseline_results = {(r["path"], r["input"]): r for r in baseline["results"]}
+    current_results = {(r["path"], r["input"]): r for r in current["results"]}
+    for key in sorted(baseline_results.keys() | current_results.keys()):
+        case = f"{key[0]} {key[1]}"
+        if key not in current_results:
+            report.append(f"{case}: missing from the current report")
+            continue
+        if key not in baseline_results:
+            report.append(f"{case}: not in the baseline")
+            continue
+        for metric in metrics:
+            before, after = baseline_results[key][metric], current_results[key][metric]
+            change = (after - before) / before if before else 0.0
+            line = f"{case} {metric}: {before} -> {after} ({change:+.1%})"
+            if change > threshold:
+                line += " REGRESSION"
+                regressions.append(line)
+            report.append(line)
+    return report, regressions
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """Parse arguments and run a benchmark or compare two reports."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    run_parser = commands.add_parser("run", help="benchmark and write a JSON report")
+    run_parser.add_argument("--output", default="thumbnail-benchmark.json", help="report file")
+    run_parser.add_argument(
+        "--corpus-dir",
+        default=os.path.join(tempfile.gettempdir(), "thumbnail-bench-corpus"),
+        help="where generated inputs are cached"
+    )
+    run_parser.add_argument(
+        "--resolutions", nargs="+", choices=list(RESOLUTIONS), default=list(RESOLUTIONS)
+    )
+    run_parser.add_argument("--paths", nargs="+", choices=list(PATHS), default=list(PATHS))
+    run_parser.add_argument("--iterations", type=int, default=5)
+    run_parser.add_argument(
+        "--in-process",
+        action="store_true",
+        help="run every case in this process (faster, but peak RSS is cumulative)"
+    )
+    
+    compare_parser = commands.add_parser("compare", help="fail if CURRENT regresses on BASELINE")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument(
+        "--threshold", type=float, default=0.1, help="allowed growth, as a fraction (0.1 = 10%%)"
+    )
+    compare_parser.add_argument(
+        "--metrics", nargs="+", choices=GATED_METRICS, default=list(GATED_METRICS)
+    )
+    
+    args = parser.parse_args(argv)
+    
+    if args.command == "run":
+        setup_logging()
+        corpus = build_corpus(args.corpus_dir, args.resolutions)
+        report = run(corpus, args.paths, args.iterations, isolated=not args.in_process)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        logger.info(f"Wrote {len(report['results'])} results to {args.output}")
+        return 0
+    
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    report_lines, regressions = compare(baseline, current, args.threshold, args.metrics)
+    for line in report_lines:
+        print(line)
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
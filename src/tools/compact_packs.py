@@ -0,0 +1,24 @@
+"""Reclaim the space of deleted thumbnails in the pack store.
+
+Usage: python -m src.tools.compact_packs
+"""
+
+import argparse
+from src.services.pack_storage import pack_store
+from src.services.logger import setup_logging, get_logger
+
+logger = get_logger(__name__)
+
+
+def main() -> None:
+    """Parse arguments and compact the configured pack store."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.parse_args()
+    
+    setup_logging()
+    stats = pack_store.compact()
+    logger.info(f"Compaction finished: {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""Load-test the API and a worker running together in this process.
+
+Usage: python -m src.tools.load_test [--rate 5] [--duration 30] [--size 1920x1080] [--output FILE]
+
+Unless DATABASE_URL and RABBITMQ_URL are set, a scratch SQLite database and
+the in-process broker (``memory://``) are used, so nothing else has to run.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.ext.compiler import compiles
+
+# src modules read their settings on import, so they are imported only once
+# main() has filled in the defaults of the self-contained setup
+
+
+def _uuid_on_sqlite(type_: UUID, compiler: Any, **kw: Any) -> str:
+    """Let the scratch SQLite database create the PostgreSQL UUID columns.
+    
+    The type binds non-native UUIDs as 32 hex digits.
+    """
+    return "CHAR(32)"
+
+
+# Registered by a call: compiles() is untyped and would untype a decorated function
+compiles(UUID, "sqlite")(_uuid_on_sqlite)
+
+
+def _distribution(seconds: Sequence[float]) -> Dict[str, Any]:
+    """Count and percentiles in milliseconds."""
+    from src.tools.benchmark_thumbnails import percentile
+    
+    if not seconds:
+        return {"count": 0}
+    return {
+        "count": len(seconds),
+        "p50_ms": round(percentile(seconds, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(seconds, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(seconds, 0.99) * 1000, 1),
+        "max_ms": round(max(seconds) * 1000, 1),
+    }
+
+
+def _unique_jpeg(base: bytes) -> bytes:
+    """``base`` with a random comment segment, so content deduplication never kicks in."""
+    comment = uuid.uuid4().hex.encode()
+    return base[:2] + b"\xff\xfe" + (len(comment) + 2).to_bytes(2, "big") + comment + base[2:]
+
+
+class LoadTest:
+    """Open-loop load: uploads start at a fixed rate whatever the latency.
+    
+    Every uploaded image is then polled with ``GET /images/{id}`` until it
+    is done, failed or ``timeout`` seconds passed.
+    """
+    
+    def __init__(self, client: Any, payload: bytes, poll_interval: float, timeout: float):
+        self.client = client
+        self.payload = payload
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.upload_latencies: List[float] = []
+        self.read_latencies: List[float] = []
+        self.times_to_done: List[float] = []
+        # Monotonic times of the first upload and the last image done
+        self.first_started: Optional[float] = None
+        self.last_done: Optional[float] = None
+        self.counts = {"rejected": 0, "failed": 0, "timed_out": 0}
+    
+    async def run(self, rate: float, duration: float) -> None:
+        """Start ``rate * duration`` uploads at even intervals and wait for all of them."""
+        started = time.perf_counter()
+        tasks = []
+        for index in range(max(int(rate * duration), 1)):
+            delay = started + index / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self._image()))
+        await asyncio.gather(*tasks)
+    
+    async def _image(self) -> None:
+        started = time.perf_counter()
+        if self.first_started is None:
+            self.first_started = started
+        
+        response = await self.client.post(
+            "/images/", files={"file": ("load.jpg", _unique_jpeg(self.payload), "image/jpeg")}
+        )
+        self.upload_latencies.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            self.counts["rejected"] += 1
+            return
+        image_id = response.json()["id"]
+        
+        while time.perf_counter() - started < self.timeout:
+            read_started = time.perf_counter()
+            response = await self.client.get(f"/images/{image_id}")
+            now = time.perf_counter()
+            self.read_latencies.append(now - read_started)
+            status = response.json().get("status") if response.status_code == 200 else None
+            if status == "DONE":
+                self.times_to_done.append(now - started)
+                self.last_done = max(self.last_done or now, now)
+                return
+            if status == "ERROR":
+                self.counts["failed"] += 1
+                return
+            await asyncio.sleep(self.poll_interval)
+        self.counts["timed_out"] += 1
+    
+    def report(self) -> Dict[str, Any]:
+        """Latency distributions and the sustained rate of finished images."""
+        elapsed = (
+            self.last_done - self.first_started
+            if self.last_done is not None and self.first_started is not None else 0.0
+        )
+        return {
+            "uploads": {**_distribution(self.upload_latencies), "rejected": self.counts["rejected"]},
+            "reads": _distribution(self.read_latencies),
+            "time_to_done": {
+                **_distribution(self.times_to_done),
+                "failed": self.counts["failed"],
+                "timed_out": self.counts["timed_out"],
+            },
+            "images_per_s": round(len(self.times_to_done) / elapsed, 2) if elapsed else 0.0,
+        }
+
+
+async def run_load_test(
+    rate: float,
+    duration: float,
+    size: Tuple[int, int],
+    poll_interval: float = 0.1,
+    timeout: float = 120.0
+) -> Dict[str, Any]:
+    """Serve the API and a worker in this event loop, drive them and report."""
+    from io import BytesIO
+    from httpx import AsyncClient
+    from src.api.main import app
+    from src.config import settings
+    from src.database.connection import Base, engine
+    from src.tools.benchmark_thumbnails import synthesize
+    from src.worker.main import ImageWorker
+    
+    if engine.dialect.name == "sqlite":
+        # A scratch database has no migrations applied
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    
+    buffer = BytesIO()
+    synthesize(size[0], size[1], "RGB", seed=0).save(buffer, "JPEG", quality=90)
+    
+    worker = ImageWorker()
+    async with app.router.lifespan_context(app):
+        consuming = asyncio.create_task(worker.start_consuming())
+        try:
+            async with AsyncClient(app=app, base_url="http://load-test") as client:
+                load = LoadTest(client, buffer.getvalue(), poll_interval, timeout)
+                await load.run(rate, duration)
+        finally:
+            consuming.cancel()
+            try:
+                await consuming
+            except asyncio.CancelledError:
+                pass
+    await engine.dispose()
+    
+    return {
+        "config": {
+            "rate": rate,
+            "duration": duration,
+            "size": list(size),
+            "upload_bytes": len(buffer.getvalue()),
+            "database": engine.dialect.name,
+            "broker": settings.RABBITMQ_URL.split(":", 1)[0],
+            "worker_executor": settings.WORKER_EXECUTOR,
+            "worker_concurrency": settings.WORKER_CONCURRENCY,
+            "outbox": settings.OUTBOX_ENABLED,
+        },
+        **load.report(),
+    }
+
+
+def _size(value: str) -> Tuple[int, int]:
+    width, _, height = value.lower().partition("x")
+    return int(width), int(height)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """Parse arguments, set up the self-contained environment and run the load test."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rate", type=float, default=5.0, help="uploads per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of uploads")
+    parser.add_argument("--size", type=_size, default=(1920, 1080), help="WIDTHxHEIGHT of uploads")
+    parser.add_argument("--poll-interval", type=float, default=0.1)
+    parser.add_argument("--timeout", type=float, default=120.0, help="per image, in seconds")
+    parser.add_argument("--output", help="also write the report to this JSON file")
+    args = parser.parse_args(argv)
+    
+    scratch = tempfile.mkdtemp(prefix="load-test-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{scratch}/load.db?timeout=30")
+    os.environ.setdefault("RABBITMQ_URL", "memory://")
+    os.environ.setdefault("STORAGE_PATH", os.path.join(scratch, "storage"))
+    os.environ.setdefault("WORKER_METRICS_PORT", "0")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    try:
+        report = asyncio.run(run_load_test(
+            args.rate, args.duration, args.size, args.poll_interval, args.timeout
+        ))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
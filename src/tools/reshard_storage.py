@@ -0,0 +1,113 @@
+"""Move stored files into the sharded layout of the configured storage backend.
+
+Usage: python -m src.tools.reshard_storage [--dry-run] [--batch-size N]
+"""
+
+import argparse
+import asyncio
+import os
+from typing import Any, Callable, Dict
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.database.connection import AsyncSessionLocal
+from src.models.image import Image, ImageVariant
+from src.services.pack_storage import is_packed
+from src.services.storage import Storage, storage
+from src.services.logger import setup_logging, get_logger
+
+logger = get_logger(__name__)
+
+
+async def reshard(
+    session_factory: Callable[[], AsyncSession],
+    target: Storage,
+    batch_size: int = 500,
+    dry_run: bool = False
+) -> Dict[str, int]:
+    """Move every referenced file that is not at its sharded location.
+    
+    Files are moved (or uploaded, for a remote backend) first and the rows
+    pointing at them are repointed per batch, so an interrupted run can
+    simply be started again. Returns counts of moved, already sharded and
+    missing files.
+    """
+    stats = {"moved": 0, "sharded": 0, "missing": 0}
+    for kind, column in (("originals", Image.original_path), ("thumbnails", ImageVariant.path)):
+        last = ""
+        while True:
+            async with session_factory() as db:
+                result = await db.execute(
+                    select(column)
+                    .where(column > last)
+                    .group_by(column)
+                    .order_by(column)
+                    .limit(batch_size)
+                )
+                paths = list(result.scalars())
+                if not paths:
+                    break
+                last = paths[-1]
+                
+                for path in paths:
+                    await _reshard_file(db, target, kind, column, path, stats, dry_run)
+                await db.commit()
+        
+        logger.info(f"Resharded {kind}: {stats}")
+    return stats
+
+
+async def _reshard_file(
+    db: AsyncSession,
+    target: Storage,
+    kind: str,
+    column: Any,
+    path: str,
+    stats: Dict[str, int],
+    dry_run: bool
+) -> None:
+    """Move one file and repoint the rows referencing it."""
+    name = os.path.basename(path)
+    location = target.location_of(kind, name)
+    # Packed thumbnails live in segment files, not the sharded tree
+    if location == path or is_packed(path):
+        stats["sharded"] += 1
+        return
+    
+    if os.path.isfile(path):
+        if not dry_run:
+            await target.save(path, kind, name)
+    elif not await target.exists(location):
+        # Neither moved by an earlier run nor present: leave the row alone
+        logger.warning(f"Stored file {path} is missing")
+        stats["missing"] += 1
+        return
+    
+    stats["moved"] += 1
+    if not dry_run:
+        await db.execute(
+            update(column.class_)
+            .where(column == path)
+            .values({column.key: location})
+            .execution_options(synchronize_session=False)
+        )
+
+
+async def main() -> None:
+    """Parse arguments and reshard the configured storage."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Only count the files that would be moved"
+    )
+    args = parser.parse_args()
+    
+    setup_logging()
+    try:
+        stats = await reshard(AsyncSessionLocal, storage, args.batch_size, args.dry_run)
+    finally:
+        await storage.close()
+    logger.info(f"Resharding finished: {stats}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
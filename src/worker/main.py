@@ -2,7 +2,10 @@
 
 import asyncio
 import json
-from typing import Dict
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
 import aio_pika
 from sqlalchemy.ext.asyncio import AsyncSession
 from src.config import settings
@@ -10,11 +13,102 @@ from src.database.connection import AsyncSessionLocal
 from src.models.image import ImageStatus
 from src.services.image_service import ImageService
 from src.services.image_processor import ImageProcessor
-from src.services.logger import setup_logging, get_logger
+from src.services.metrics import (
+    JOB_DURATION,
+    JOBS_IN_PROGRESS,
+    QUEUE_LAG,
+    observe_thumbnail_timings,
+    start_metrics_server,
+)
+from src.services.rabbitmq_service import (
+    ENQUEUED_AT_HEADER,
+    connect_broker,
+    declare_status_exchange,
+    lane_prefetch,
+    lane_queue,
+    publish_status_event,
+)
+from src.services.status_batcher import StatusBatcher
+from src.services.pack_storage import is_packed
+from src.services.storage import storage
+from src.services.tracing import (
+    TRACEPARENT_HEADER,
+    SpanContext,
+    current_span,
+    record_span,
+    span,
+)
+from src.services.logger import setup_logging, get_logger, get_sampled_logger
 
 # Configure logging
 setup_logging()
 logger = get_logger(__name__)
+# Per-variant messages, sampled with LOG_VARIANT_SAMPLE_RATE
+variant_logger = get_sampled_logger(f"{__name__}.variants", settings.LOG_VARIANT_SAMPLE_RATE)
+
+
+def _create_thumbnails_timed(
+    image_id: str,
+    original_path: str
+) -> Tuple[Dict[str, str], Dict[str, float]]:
+    """``create_thumbnails`` returning its stage timings (runs in the executor)."""
+    timings: Dict[str, float] = {}
+    return ImageProcessor.create_thumbnails(image_id, original_path, timings), timings
+
+
+def _create_variant_timed(
+    image_id: str,
+    original_path: str,
+    size: Tuple[int, int]
+) -> Tuple[str, Dict[str, float]]:
+    """``create_variant`` returning its stage timings (runs in the executor)."""
+    timings: Dict[str, float] = {}
+    return ImageProcessor.create_variant(image_id, original_path, size, timings), timings
+
+
+def _start_marks(
+    enqueued_at: Optional[float],
+    started: float,
+    suffix: str = ""
+) -> Dict[str, Any]:
+    """Milestones known when a task starts, with the id of its trace."""
+    context = current_span()
+    marks: Dict[str, Any] = {"trace_id": context.trace_id} if context else {}
+    if enqueued_at is not None:
+        marks[f"queued{suffix}"] = round(enqueued_at, 3)
+    marks[f"started{suffix}"] = round(started, 3)
+    return marks
+
+
+def _stage_marks(
+    executor_started: float,
+    timings: Dict[str, float],
+    suffix: str = ""
+) -> Dict[str, float]:
+    """Milestones of the processor stages, recorded as spans as well.
+    
+    The processor only reports durations (it may run in another process),
+    so stages are laid end to end from when the executor was called.
+    """
+    marks = {}
+    parent = current_span()
+    ended = executor_started
+    for stage, seconds in timings.items():
+        if stage == "total":
+            continue
+        started, ended = ended, ended + seconds
+        if parent:
+            record_span(stage, parent.child(), parent, started, ended)
+        if stage == "decode":
+            marks[f"decoded{suffix}"] = round(ended, 3)
+        elif stage.startswith("encode_"):
+            marks[f"encoded_{stage[len('encode_'):]}"] = round(ended, 3)
+    return marks
+
+
+def _final_marks(marks: Dict[str, Any]) -> Dict[str, Any]:
+    """Milestones with the time the outcome is written."""
+    return {**marks, "committed": round(time.time(), 3)}
 
 
 class ImageWorker:
@@ -23,24 +117,46 @@ class ImageWorker:
     def __init__(self):
         self.connection = None
         self.channel = None
-        self.queue = None
+        self.queues: Dict[str, aio_pika.abc.AbstractQueue] = {}
+        self.status_exchange = None
+        # Executor slots reserved per lane; each lane's prefetch matches its share
+        self.lane_slots = lane_prefetch(settings.WORKER_CONCURRENCY, settings.WORKER_LANE_WEIGHTS)
+        self.executor = self._create_executor(sum(self.lane_slots.values()))
+        self.status_batcher = StatusBatcher() if settings.WORKER_STATUS_BATCHING else None
+        self.metrics_server: Optional[asyncio.AbstractServer] = None
+    
+    @staticmethod
+    def _create_executor(max_workers: int) -> Executor:
+        """Create the pool that runs CPU-bound thumbnail generation."""
+        if settings.WORKER_EXECUTOR == "process":
+            return ProcessPoolExecutor(
+                max_workers=max_workers,
+                max_tasks_per_child=settings.WORKER_MAX_TASKS_PER_CHILD or None
+            )
+        if settings.WORKER_EXECUTOR == "thread":
+            return ThreadPoolExecutor(
+                max_workers=max_workers,
+                thread_name_prefix="thumbnailer"
+            )
+        raise ValueError(f"Unknown WORKER_EXECUTOR: {settings.WORKER_EXECUTOR}")
     
     async def connect(self) -> None:
         """Connect to RabbitMQ."""
         try:
-            self.connection = await aio_pika.connect_robust(
-                settings.RABBITMQ_URL
-            )
+            self.connection = await connect_broker()
             self.channel = await self.connection.channel()
+            self.status_exchange = await declare_status_exchange(self.channel)
             
-            # Set QoS to process one message at a time
-            await self.channel.set_qos(prefetch_count=1)
-            
-            # Declare queue
-            self.queue = await self.channel.declare_queue(
-                settings.QUEUE_NAME,
-                durable=True
-            )
+            # One channel per lane: its prefetch keeps one message in flight
+            # per reserved executor slot, so a backlog of large images cannot
+            # occupy the slots of small ones
+            for lane, slots in self.lane_slots.items():
+                channel = await self.connection.channel()
+                await channel.set_qos(prefetch_count=slots)
+                self.queues[lane] = await channel.declare_queue(
+                    lane_queue(lane),
+                    durable=True
+                )
             
             logger.info("Worker connected to RabbitMQ")
         except Exception as e:
@@ -49,12 +165,55 @@ class ImageWorker:
     
     async def disconnect(self) -> None:
         """Disconnect from RabbitMQ."""
+        if self.status_batcher:
+            await self.status_batcher.stop()
+        if self.metrics_server:
+            self.metrics_server.close()
+            self.metrics_server = None
         if self.connection:
             await self.connection.close()
             logger.info("Worker disconnected from RabbitMQ")
+        await storage.close()
+        # Unacked in-flight messages are redelivered once the connection is gone
+        self.executor.shutdown(wait=False, cancel_futures=True)
     
     async def process_message(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        """Process a message, recording its queue lag and duration.
+        
+        The message runs as a span continuing the trace in its headers.
+        """
+        queue = message.routing_key or ""
+        headers = message.headers or {}
+        enqueued_at = None
+        enqueued_header = headers.get(ENQUEUED_AT_HEADER)
+        if isinstance(enqueued_header, (int, float, str)):
+            enqueued_at = float(enqueued_header)
+            QUEUE_LAG.labels(queue).observe(max(time.time() - enqueued_at, 0.0))
+        traceparent = headers.get(TRACEPARENT_HEADER)
+        if isinstance(traceparent, bytes):
+            traceparent = traceparent.decode()
+        parent = SpanContext.parse(traceparent if isinstance(traceparent, str) else None)
+        
+        outcome = "error"
+        started = time.perf_counter()
+        with JOBS_IN_PROGRESS.labels(queue).track_inprogress(), span(
+            "process_task", parent, queue=queue
+        ) as context:
+            if enqueued_at is not None:
+                record_span("queued", context.child(), context, enqueued_at, time.time())
+            try:
+                await self._handle_message(message, enqueued_at)
+                outcome = "done"
+            finally:
+                JOB_DURATION.labels(queue, outcome).observe(time.perf_counter() - started)
+    
+    async def _handle_message(
+        self,
+        message: aio_pika.abc.AbstractIncomingMessage,
+        enqueued_at: Optional[float] = None
+    ) -> None:
         """Process a single image processing message."""
+        started = time.time()
         async with message.process():
             try:
                 # Parse message
@@ -62,58 +221,220 @@ class ImageWorker:
                 image_id = body["image_id"]
                 image_path = body["image_path"]
                 
-                logger.info(f"Processing image {image_id}")
+                if body.get("variant"):
+                    await self._process_variant(
+                        image_id, image_path, body["variant"], enqueued_at, started
+                    )
+                    return
+                
+                marks = _start_marks(enqueued_at, started)
                 
-                # Get database session
+                logger.info("Processing image %s", image_id)
+                
+                # Mark as PROCESSING in its own short transaction
                 async with AsyncSessionLocal() as db:
-                    # Update status to PROCESSING
-                    await ImageService.update_image_status(
+                    await ImageService.set_image_status(
                         db, image_id, ImageStatus.PROCESSING
                     )
-                    
-                    try:
-                        # Process image - create thumbnails
-                        thumbnail_paths = ImageProcessor.create_thumbnails(
-                            image_id, image_path
-                        )
-                        
-                        # Update database with success
-                        await ImageService.update_image_status(
-                            db, 
-                            image_id, 
-                            ImageStatus.DONE,
-                            thumbnail_paths=thumbnail_paths
-                        )
-                        
-                        logger.info(f"Successfully processed image {image_id}")
-                        
-                    except Exception as e:
-                        # Update database with error
-                        error_message = f"Processing failed: {str(e)}"
-                        await ImageService.update_image_status(
-                            db,
+                await self._announce_status(image_id, ImageStatus.PROCESSING, image_path)
+                
+                # No database connection is held while thumbnails are built
+                try:
+                    # Process image off the event loop so heartbeats and
+                    # other in-flight messages keep being served
+                    loop = asyncio.get_running_loop()
+                    async with storage.local_file(image_path) as original_path:
+                        executor_started = time.time()
+                        staged, timings = await loop.run_in_executor(
+                            self.executor,
+                            _create_thumbnails_timed,
                             image_id,
-                            ImageStatus.ERROR,
-                            error_message=error_message
+                            original_path
                         )
-                        
-                        logger.error(f"Failed to process image {image_id}: {e}")
-                        raise
+                    observe_thumbnail_timings(timings)
+                    marks.update(_stage_marks(executor_started, timings))
+                    thumbnail_paths = {
+                        size_name: await self._store_thumbnail(path)
+                        for size_name, path in staged.items()
+                    }
+                except Exception as e:
+                    # Update database with error
+                    error_message = f"Processing failed: {str(e)}"
+                    await self._record_status(
+                        image_id,
+                        ImageStatus.ERROR,
+                        image_path,
+                        error_message=error_message,
+                        timings=_final_marks(marks)
+                    )
+                    
+                    logger.error(f"Failed to process image {image_id}: {e}")
+                    raise
+                
+                # Update database with success
+                await self._record_status(
+                    image_id,
+                    ImageStatus.DONE,
+                    image_path,
+                    thumbnail_paths=thumbnail_paths,
+                    timings=_final_marks(marks)
+                )
+                
+                logger.info("Successfully processed image %s", image_id)
             
             except Exception as e:
                 logger.error(f"Error processing message: {e}")
                 # Message will be rejected and not requeued due to message.process()
                 raise
     
+    async def _process_variant(
+        self,
+        image_id: str,
+        image_path: str,
+        size_name: str,
+        enqueued_at: Optional[float] = None,
+        started: Optional[float] = None
+    ) -> None:
+        """Build one thumbnail size of an image processed in fan-out mode."""
+        width, height = (int(value) for value in size_name.split("x"))
+        variant_logger.info("Processing variant %s of image %s", size_name, image_id)
+        marks = _start_marks(enqueued_at, started or time.time(), f"_{size_name}")
+        
+        try:
+            loop = asyncio.get_running_loop()
+            async with storage.local_file(image_path) as original_path:
+                executor_started = time.time()
+                staged, timings = await loop.run_in_executor(
+                    self.executor,
+                    _create_variant_timed,
+                    image_id,
+                    original_path,
+                    (width, height)
+                )
+            observe_thumbnail_timings(timings)
+            marks.update(_stage_marks(executor_started, timings, f"_{size_name}"))
+            path = await self._store_thumbnail(staged)
+        except Exception as e:
+            await self._record_variant(
+                image_id,
+                image_path,
+                size_name,
+                error_message=f"Processing failed: {str(e)}",
+                timings=_final_marks(marks)
+            )
+            logger.error(f"Failed to process variant {size_name} of image {image_id}: {e}")
+            raise
+        
+        await self._record_variant(
+            image_id, image_path, size_name, path=path, timings=_final_marks(marks)
+        )
+        variant_logger.info("Successfully processed variant %s of image %s", size_name, image_id)
+    
+    @staticmethod
+    async def _store_thumbnail(staged_path: str) -> str:
+        """Hand a thumbnail written by the processor to storage."""
+        if is_packed(staged_path):
+            # Already appended to the pack store
+            return staged_path
+        return await storage.save(staged_path, "thumbnails", os.path.basename(staged_path))
+    
+    async def _record_variant(
+        self,
+        image_id: str,
+        image_path: str,
+        size_name: str,
+        path: Optional[str] = None,
+        error_message: Optional[str] = None,
+        timings: Optional[Dict[str, Any]] = None
+    ) -> None:
+        """Persist a variant outcome and announce the derived image status."""
+        async with AsyncSessionLocal() as db:
+            outcome = await ImageService.complete_variant(
+                db, image_id, size_name, path=path, error_message=error_message, timings=timings
+            )
+        if outcome is None:
+            logger.warning(f"Image {image_id} no longer exists, dropped variant {size_name}")
+            return
+        
+        status, variants = outcome
+        thumbnail_paths = {
+            name: variant["path"]
+            for name, variant in variants.items() if variant["status"] == ImageStatus.DONE
+        }
+        await self._announce_status(image_id, status, image_path, thumbnail_paths, variants)
+    
+    async def _record_status(
+        self,
+        image_id: str,
+        status: ImageStatus,
+        image_path: str,
+        thumbnail_paths: Optional[dict] = None,
+        error_message: Optional[str] = None,
+        timings: Optional[Dict[str, Any]] = None
+    ) -> None:
+        """Persist a terminal status, through the write-behind batcher if enabled."""
+        if self.status_batcher:
+            await self.status_batcher.submit(
+                image_id,
+                status,
+                thumbnail_paths=thumbnail_paths,
+                error_message=error_message,
+                timings=timings
+            )
+        else:
+            async with AsyncSessionLocal() as db:
+                await ImageService.set_image_status(
+                    db,
+                    image_id,
+                    status,
+                    thumbnail_paths=thumbnail_paths,
+                    error_message=error_message,
+                    timings=timings
+                )
+        await self._announce_status(image_id, status, image_path, thumbnail_paths)
+    
+    async def _announce_status(
+        self,
+        image_id: str,
+        status: ImageStatus,
+        image_path: str,
+        thumbnail_paths: Optional[dict] = None,
+        variants: Optional[dict] = None
+    ) -> None:
+        """Tell API replicas a status was committed.
+        
+        They drop cached copies and answer clients waiting on the image.
+        """
+        if not self.status_exchange:
+            return
+        
+        try:
+            await publish_status_event(
+                self.status_exchange, image_id, status, image_path, thumbnail_paths, variants
+            )
+        except Exception as e:
+            logger.warning(f"Failed to publish status event for image {image_id}: {e}")
+    
     async def start_consuming(self) -> None:
         """Start consuming messages from the queue."""
-        if not self.queue:
+        if not self.queues:
             await self.connect()
         
-        logger.info("Starting to consume messages...")
+        logger.info(
+            f"Starting to consume messages with {settings.WORKER_EXECUTOR} executor slots "
+            + ", ".join(f"{lane}={slots}" for lane, slots in self.lane_slots.items())
+            + "..."
+        )
+        
+        if self.status_batcher:
+            self.status_batcher.start()
+        self.metrics_server = await start_metrics_server(
+            settings.WORKER_METRICS_HOST, settings.WORKER_METRICS_PORT
+        )
         
         # Start consuming messages
-        await self.queue.consume(self.process_message)
+        for queue in self.queues.values():
+            await queue.consume(self.process_message)
         
         try:
             # Keep the worker running
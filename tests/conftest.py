@@ -111,9 +111,12 @@ def mock_rabbitmq():
         async def disconnect(self):
             pass
         
-        async def send_image_processing_task(self, image_id: str, image_path: str):
+        async def send_image_processing_task(self, image_id: str, image_path: str, queue=None):
             pass
         
+        async def send_image_processing_tasks(self, tasks, headers=None):
+            return list(range(len(tasks)))
+        
         async def is_healthy(self) -> bool:
             return True
     
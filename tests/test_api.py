@@ -33,6 +33,76 @@ class TestImagesAPI:
         assert data["status"] == ImageStatus.PROCESSING
         assert data["message"] == "Image uploaded successfully and queued for processing"
     
+    @pytest.mark.asyncio
+    async def test_upload_batch_partial_failure(
+        self,
+        client: AsyncClient,
+        temp_storage: str,
+        sample_image_file: str,
+        mock_rabbitmq
+    ):
+        """Test batch upload with one invalid file."""
+        with open(sample_image_file, 'rb') as f:
+            content = f.read()
+        
+        with patch('src.services.image_service.rabbitmq_service', mock_rabbitmq):
+            response = await client.post(
+                "/images/batch",
+                files=[
+                    ("files", ("a.jpg", content, "image/jpeg")),
+                    ("files", ("notes.txt", b"not an image", "text/plain")),
+                    # Trailing bytes: a different file with the same pixels
+                    ("files", ("b.jpg", content + b"\0", "image/jpeg")),
+                ]
+            )
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data["succeeded"] == 2
+        assert data["failed"] == 1
+        assert [r["filename"] for r in data["results"]] == ["a.jpg", "notes.txt", "b.jpg"]
+        assert data["results"][0]["status"] == ImageStatus.PROCESSING
+        assert "File type .txt not allowed" in data["results"][1]["error"]
+        assert data["results"][2]["id"] != data["results"][0]["id"]
+        
+        status_response = await client.get(f"/images/{data['results'][2]['id']}")
+        assert status_response.json()["status"] == ImageStatus.PROCESSING
+    
+    @pytest.mark.asyncio
+    async def test_upload_batch_deduplicates_identical_files(
+        self,
+        client: AsyncClient,
+        test_db: AsyncSession,
+        temp_storage: str,
+        sample_image_file: str,
+        mock_rabbitmq
+    ):
+        """Test that identical files in one batch are stored and queued once."""
+        import os
+        from sqlalchemy import func, select
+        from src.models.outbox import OutboxMessage
+        
+        with open(sample_image_file, 'rb') as f:
+            content = f.read()
+        
+        with patch('src.services.image_service.rabbitmq_service', mock_rabbitmq):
+            response = await client.post(
+                "/images/batch",
+                files=[
+                    ("files", ("a.jpg", content, "image/jpeg")),
+                    ("files", ("copy.jpg", content, "image/jpeg")),
+                ]
+            )
+        
+        data = response.json()
+        assert data["succeeded"] == 2
+        assert data["results"][0]["id"] == data["results"][1]["id"]
+        assert data["results"][1]["status"] == ImageStatus.PROCESSING
+        assert await test_db.scalar(select(func.count()).select_from(Image)) == 1
+        assert await test_db.scalar(select(func.count()).select_from(OutboxMessage)) == 1
+        # The spooled copy was discarded
+        assert os.listdir(os.path.join(temp_storage, "tmp")) == []
+    
     @pytest.mark.asyncio
     async def test_upload_invalid_file_type(self, client: AsyncClient):
         """Test upload with invalid file type."""
@@ -57,15 +127,22 @@ class TestImagesAPI:
         test_db: AsyncSession
     ):
         """Test successful image retrieval."""
+        from src.models.image import ImageVariant
+        
         # Create test image record
         image = Image(
             status=ImageStatus.DONE,
             original_filename="test.jpg",
             original_path="/path/to/test.jpg",
             original_size=1000,
-            thumbnail_100_path="/path/to/thumb_100.jpg",
-            thumbnail_300_path="/path/to/thumb_300.jpg",
-            thumbnail_1200_path="/path/to/thumb_1200.jpg"
+            variants=[
+                ImageVariant(size_name=size_name, status=ImageStatus.DONE, path=path)
+                for size_name, path in (
+                    ("100x100", "/path/to/thumb_100.jpg"),
+                    ("300x300", "/path/to/thumb_300.jpg"),
+                    ("1200x1200", "/path/to/thumb_1200.jpg")
+                )
+            ]
         )
         test_db.add(image)
         await test_db.commit()
@@ -82,6 +159,247 @@ class TestImagesAPI:
         assert "300x300" in data["thumbnails"]
         assert "1200x1200" in data["thumbnails"]
     
+    @pytest.mark.asyncio
+    async def test_get_image_debug_timings(self, client: AsyncClient, test_db: AsyncSession):
+        """Test that ?debug=timings shows milestones relative to the upload."""
+        from datetime import datetime, timezone
+        
+        created_at = datetime(2026, 10, 17, 12, 0, 0)
+        origin = created_at.replace(tzinfo=timezone.utc).timestamp()
+        image = Image(
+            status=ImageStatus.DONE,
+            original_filename="test.jpg",
+            original_path="/path/to/test.jpg",
+            created_at=created_at,
+            timings={
+                "trace_id": "0af7651916cd43dd8448eb211c80319c",
+                "committed": origin + 1.5,
+                "queued": origin,
+                "started": origin + 0.25,
+                "decoded": origin + 1.0
+            }
+        )
+        test_db.add(image)
+        await test_db.commit()
+        
+        response = await client.get(f"/images/{image.id}")
+        assert "timings" not in response.json()
+        
+        response = await client.get(f"/images/{image.id}?debug=timings")
+        assert response.status_code == 200
+        timings = response.json()["timings"]
+        assert timings["trace_id"] == "0af7651916cd43dd8448eb211c80319c"
+        assert list(timings["marks_ms"]) == ["queued", "started", "decoded", "committed"]
+        assert timings["marks_ms"]["committed"] == 1500.0
+        assert timings["stages_ms"] == {
+            "queued": 0.0, "started": 250.0, "decoded": 750.0, "committed": 500.0
+        }
+    
+    @pytest.mark.asyncio
+    async def test_upload_continues_client_trace(
+        self,
+        client: AsyncClient,
+        test_db: AsyncSession,
+        temp_storage: str,
+        sample_image_file: str
+    ):
+        """Test that the queued task carries the trace of the upload request."""
+        from sqlalchemy import select
+        from src.models.outbox import OutboxMessage
+        from src.services.tracing import SpanContext
+        
+        trace_id = "0af7651916cd43dd8448eb211c80319c"
+        with open(sample_image_file, 'rb') as f:
+            response = await client.post(
+                "/images/",
+                files={"file": ("test.jpg", f, "image/jpeg")},
+                headers={"traceparent": f"00-{trace_id}-b7ad6b7169203331-01"}
+            )
+        
+        assert response.status_code == 200
+        assert SpanContext.parse(response.headers["traceparent"]).trace_id == trace_id
+        message = (await test_db.execute(select(OutboxMessage))).scalars().one()
+        assert SpanContext.parse(message.traceparent).trace_id == trace_id
+    
+    @pytest.mark.asyncio
+    async def test_get_image_served_from_cache(
+        self,
+        client: AsyncClient,
+        test_db: AsyncSession
+    ):
+        """Test that repeated gets hit the cache until the image is deleted."""
+        from src.services.image_cache import image_cache
+        
+        image = Image(
+            status=ImageStatus.DONE,
+            original_filename="test.jpg",
+            original_path="/path/to/test.jpg"
+        )
+        test_db.add(image)
+        await test_db.commit()
+        
+        hits = image_cache.hits
+        first = await client.get(f"/images/{image.id}")
+        second = await client.get(f"/images/{image.id}")
+        assert first.json() == second.json()
+        assert image_cache.hits == hits + 1
+        
+        stats = await client.get("/images/cache/stats")
+        assert stats.status_code == 200
+        assert stats.json()["hits"] == image_cache.hits
+        
+        response = await client.delete(f"/images/{image.id}")
+        assert response.status_code == 204
+        response = await client.get(f"/images/{image.id}")
+        assert response.status_code == 404
+    
+    @pytest.mark.asyncio
+    async def test_render_image(
+        self,
+        client: AsyncClient,
+        test_db: AsyncSession,
+        temp_storage: str,
+        sample_image_file: str
+    ):
+        """Test on-demand rendering of an arbitrary size."""
+        image = Image(
+            status=ImageStatus.DONE,
+            original_filename="test.jpg",
+            original_path=sample_image_file,
+            original_size=1000
+        )
+        test_db.add(image)
+        await test_db.commit()
+        await test_db.refresh(image)
+        
+        response = await client.get(f"/images/{image.id}/render?w=64&h=32&fit=cover")
+        
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "image/jpeg"
+        
+        # A cached variant is served without fetching the original
+        from unittest.mock import patch
+        from src.services.storage import storage
+        with patch.object(storage, "local_file", side_effect=AssertionError("fetched")):
+            cached = await client.get(f"/images/{image.id}/render?w=64&h=32&fit=cover")
+        assert cached.status_code == 200
+        assert cached.content == response.content
+        
+        response = await client.get(f"/images/{image.id}/render?w=64&h=32&fit=bogus")
+        assert response.status_code == 422
+        
+        # Deleting the image purges its rendered variants
+        from src.services.render_cache import RenderCache, render_cache
+        key = RenderCache.key(str(image.id), 64, 32, "cover")
+        response = await client.delete(f"/images/{image.id}")
+        assert response.status_code == 204
+        assert render_cache._memory_get(key) is None
+        assert render_cache._disk_get(key) is None
+    
+    @pytest.mark.asyncio
+    async def test_get_image_reports_variants(self, client: AsyncClient, test_db: AsyncSession):
+        """Test that finished variants are exposed before the whole image is done."""
+        from src.models.image import ImageVariant
+        
+        image = Image(
+            status=ImageStatus.PROCESSING,
+            original_filename="test.jpg",
+            original_path="/storage/originals/test.jpg",
+            variants=[
+                ImageVariant(
+                    size_name="100x100",
+                    status=ImageStatus.DONE,
+                    path="/storage/thumbnails/test_100x100.jpg"
+                ),
+                ImageVariant(size_name="300x300", status=ImageStatus.PROCESSING)
+            ]
+        )
+        test_db.add(image)
+        await test_db.commit()
+        
+        response = await client.get(f"/images/{image.id}")
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data["status"] == ImageStatus.PROCESSING
+        assert data["thumbnails"] == {"100x100": "/static/thumbnails/test_100x100.jpg"}
+        assert data["variants"] == {
+            "100x100": {"status": "DONE", "url": "/static/thumbnails/test_100x100.jpg"},
+            "300x300": {"status": "PROCESSING", "url": None}
+        }
+    
+    @pytest.mark.asyncio
+    async def test_get_image_long_poll(self, client: AsyncClient, test_db: AsyncSession):
+        """Test that ?wait= is answered by the completion event."""
+        import asyncio
+        from src.services.status_events import status_event_bus
+        
+        image = Image(
+            status=ImageStatus.PROCESSING,
+            original_filename="test.jpg",
+            original_path="/storage/originals/test.jpg"
+        )
+        test_db.add(image)
+        await test_db.commit()
+        image_id = str(image.id)
+        
+        async def complete():
+            while not status_event_bus.subscriber_count(image_id):
+                await asyncio.sleep(0.01)
+            await status_event_bus.handle_status_event({
+                "image_id": image_id,
+                "status": ImageStatus.DONE,
+                "original_path": image.original_path,
+                "thumbnail_paths": {"100x100": f"/storage/thumbnails/{image_id}_100x100.jpg"}
+            })
+        
+        response, _ = await asyncio.gather(
+            client.get(f"/images/{image_id}?wait=5"),
+            complete()
+        )
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data["status"] == ImageStatus.DONE
+        assert data["original_url"] == "/static/originals/test.jpg"
+        assert data["thumbnails"]["100x100"] == f"/static/thumbnails/{image_id}_100x100.jpg"
+        assert status_event_bus.subscriber_count(image_id) == 0
+    
+    @pytest.mark.asyncio
+    async def test_image_events_stream(self, client: AsyncClient, test_db: AsyncSession):
+        """Test that the SSE stream sends the current state and ends on completion."""
+        import asyncio
+        from src.services.status_events import status_event_bus
+        
+        image = Image(
+            status=ImageStatus.PROCESSING,
+            original_filename="test.jpg",
+            original_path="/storage/originals/test.jpg"
+        )
+        test_db.add(image)
+        await test_db.commit()
+        image_id = str(image.id)
+        
+        async def fail():
+            while not status_event_bus.subscriber_count(image_id):
+                await asyncio.sleep(0.01)
+            await status_event_bus.handle_status_event(
+                {"image_id": image_id, "status": ImageStatus.ERROR}
+            )
+        
+        response, _ = await asyncio.gather(
+            client.get(f"/images/{image_id}/events"),
+            fail()
+        )
+        
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = [
+            json.loads(line[len("data: "):])
+            for line in response.text.splitlines() if line.startswith("data: ")
+        ]
+        assert [event["status"] for event in events] == ["PROCESSING", "ERROR"]
+    
     @pytest.mark.asyncio
     async def test_get_image_not_found(self, client: AsyncClient):
         """Test get non-existent image."""
@@ -89,6 +407,265 @@ class TestImagesAPI:
         assert response.status_code == 404
         assert response.json()["detail"] == "Image not found"
     
+    @pytest.mark.asyncio
+    async def test_get_images_bulk(self, client: AsyncClient, test_db: AsyncSession):
+        """Test bulk status lookup via query string and request body."""
+        from src.models.image import ImageVariant
+        
+        images = [
+            Image(
+                status=status,
+                original_filename="test.jpg",
+                original_path="/storage/originals/test.jpg",
+                original_size=1000,
+                variants=[
+                    ImageVariant(
+                        size_name="100x100",
+                        status=status,
+                        path="/storage/thumbnails/t_100x100.jpg" if status == ImageStatus.DONE else None
+                    )
+                ]
+            )
+            for status in (ImageStatus.DONE, ImageStatus.PROCESSING)
+        ]
+        test_db.add_all(images)
+        await test_db.commit()
+        
+        missing_id = "00000000-0000-0000-0000-000000000000"
+        ids = [str(image.id) for image in images]
+        
+        response = await client.get(f"/images?ids={ids[0]},{ids[1]}&ids={missing_id}")
+        assert response.status_code == 200
+        data = response.json()
+        by_id = {image["id"]: image for image in data["images"]}
+        assert by_id[ids[0]]["status"] == ImageStatus.DONE
+        assert by_id[ids[0]]["thumbnails"]["100x100"] == "/static/thumbnails/t_100x100.jpg"
+        assert by_id[ids[1]]["status"] == ImageStatus.PROCESSING
+        assert data["missing"] == [missing_id]
+        
+        response = await client.post("/images/lookup", json={"ids": ids + ["invalid-uuid"]})
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data["images"]) == 2
+        assert data["missing"] == ["invalid-uuid"]
+        
+        # Found ids are not reported missing whatever form they were sent in
+        response = await client.post(
+            "/images/lookup", json={"ids": [ids[0].upper(), ids[1].replace("-", "")]}
+        )
+        data = response.json()
+        assert {image["id"] for image in data["images"]} == set(ids)
+        assert data["missing"] == []
+    
+    @pytest.mark.asyncio
+    async def test_list_images_keyset_pages(self, client: AsyncClient, test_db: AsyncSession):
+        """Test paging through images newest first with a status filter."""
+        from datetime import datetime, timedelta
+        
+        start = datetime(2026, 1, 1)
+        images = [
+            Image(
+                status=ImageStatus.DONE if i % 2 else ImageStatus.ERROR,
+                original_filename=f"{i}.jpg",
+                original_path=f"/storage/originals/{i}.jpg",
+                # Pairs share a timestamp so the id breaks ties
+                created_at=start + timedelta(seconds=i // 2)
+            )
+            for i in range(10)
+        ]
+        test_db.add_all(images)
+        await test_db.commit()
+        
+        expected = [
+            str(image.id) for image in sorted(
+                images, key=lambda image: (image.created_at, image.id), reverse=True
+            )
+        ]
+        seen, cursor = [], None
+        while True:
+            params = {"limit": 3, **({"after": cursor} if cursor else {})}
+            response = await client.get("/images", params=params)
+            assert response.status_code == 200
+            data = response.json()
+            seen.extend(image["id"] for image in data["images"])
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+        assert seen == expected
+        
+        response = await client.get("/images", params={"status": "DONE", "limit": 10})
+        data = response.json()
+        assert len(data["images"]) == 5
+        assert all(image["status"] == ImageStatus.DONE for image in data["images"])
+        assert data["next_cursor"] is None
+        
+        response = await client.get("/images", params={"after": "not-a-cursor"})
+        assert response.status_code == 400
+    
+    @pytest.mark.asyncio
+    async def test_static_serves_sharded_file(self, client: AsyncClient, temp_storage: str):
+        """Test that stored files are served from their sharded location."""
+        import os
+        from src.services.storage import storage
+        
+        staged = storage.stage("thumbnails", "served_100x100.jpg")
+        with open(staged, "wb") as f:
+            f.write(b"jpeg bytes")
+        location = await storage.save(staged, "thumbnails", "served_100x100.jpg")
+        
+        url = storage.url(location)
+        assert url.count("/") == 5
+        response = await client.get(url)
+        assert response.status_code == 200
+        assert response.content == b"jpeg bytes"
+        assert response.headers["content-type"] == "image/jpeg"
+        
+        os.unlink(location)
+        assert (await client.get(url)).status_code == 404
+        assert (await client.get("/static/..%2F..%2Fetc%2Fpasswd")).status_code == 404
+    
+    @pytest.mark.asyncio
+    async def test_static_serves_only_originals_and_thumbnails(
+        self,
+        client: AsyncClient,
+        temp_storage: str
+    ):
+        """Test that packs, scratch files and caches under the storage root are not served."""
+        import os
+        
+        for key in (
+            "packs/00000001.pack",
+            "packs/tombstones.log",
+            "tmp/upload.part",
+            "cache/renders/ab/key.jpg",
+        ):
+            path = os.path.join(temp_storage, *key.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(b"internal")
+            assert (await client.get(f"/static/{key}")).status_code == 404
+    
+    @pytest.mark.asyncio
+    async def test_static_serves_packed_thumbnail(self, client: AsyncClient, temp_storage: str):
+        """Test that packed thumbnails are served with ranges and go away on delete."""
+        from src.api.routes.images import _static_url
+        from src.services.pack_storage import pack_store
+        
+        location = pack_store.put("packed_100x100.0123abcd.jpg", b"0123456789")
+        url = _static_url(location)
+        assert url == "/static/pack/packed_100x100.0123abcd.jpg"
+        
+        response = await client.get(url)
+        assert response.status_code == 200
+        assert response.content == b"0123456789"
+        assert response.headers["content-type"] == "image/jpeg"
+        assert "immutable" in response.headers["cache-control"]
+        
+        response = await client.get(url, headers={"Range": "bytes=2-4"})
+        assert response.status_code == 206
+        assert response.content == b"234"
+        assert response.headers["content-range"] == "bytes 2-4/10"
+        
+        response = await client.head(url)
+        assert response.headers["content-length"] == "10"
+        assert response.content == b""
+        
+        pack_store.delete(["packed_100x100.0123abcd.jpg"])
+        assert (await client.get(url)).status_code == 404
+    
+    @pytest.mark.asyncio
+    async def test_static_caching_and_ranges(
+        self, client: AsyncClient, temp_storage: str, monkeypatch
+    ):
+        """Test immutable caching, conditional GET, byte ranges and X-Accel-Redirect."""
+        from src.config import settings
+        from src.services.storage import storage
+        
+        staged = storage.stage("thumbnails", "ranged_100x100.0123abcd.jpg")
+        with open(staged, "wb") as f:
+            f.write(b"0123456789")
+        url = storage.url(await storage.save(staged, "thumbnails", "ranged_100x100.0123abcd.jpg"))
+        
+        response = await client.get(url)
+        assert response.status_code == 200
+        assert "immutable" in response.headers["cache-control"]
+        assert response.headers["accept-ranges"] == "bytes"
+        etag = response.headers["etag"]
+        
+        response = await client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        
+        response = await client.get(url, headers={"Range": "bytes=2-5"})
+        assert response.status_code == 206
+        assert response.content == b"2345"
+        assert response.headers["content-range"] == "bytes 2-5/10"
+        
+        response = await client.get(url, headers={"Range": "bytes=-3"})
+        assert response.content == b"789"
+        
+        response = await client.get(url, headers={"Range": "bytes=4-", "If-Range": '"stale"'})
+        assert response.status_code == 200
+        assert response.content == b"0123456789"
+        
+        response = await client.get(url, headers={"Range": "bytes=20-"})
+        assert response.status_code == 416
+        assert response.headers["content-range"] == "bytes */10"
+        
+        # Latin-1 "²" is a digit to str.isdigit() but not to int()
+        response = await client.get(url, headers={"Range": b"bytes=\xb2-"})
+        assert response.status_code == 200
+        assert response.content == b"0123456789"
+        
+        response = await client.head(url)
+        assert response.status_code == 200
+        assert response.headers["content-length"] == "10"
+        assert response.content == b""
+        
+        monkeypatch.setattr(settings, "STATIC_ACCEL_REDIRECT_PREFIX", "/protected/")
+        response = await client.get(url)
+        assert response.status_code == 200
+        assert response.headers["x-accel-redirect"] == "/protected/" + url[len("/static/"):]
+        assert response.content == b""
+    
+    @pytest.mark.asyncio
+    async def test_file_range_response_sends_range_in_chunks(self, sample_image_file: str):
+        """Test that a byte range of a local file is sent in chunks ending the body."""
+        from src.api.routes.static import FileRangeResponse
+        
+        messages = []
+        
+        async def send(message):
+            messages.append(dict(message))
+        
+        response = FileRangeResponse(sample_image_file, 5, 10, 206, media_type="image/jpeg")
+        response.chunk_size = 4
+        await response({"type": "http"}, None, send)
+        
+        with open(sample_image_file, "rb") as f:
+            expected = f.read()[5:15]
+        assert messages[0]["status"] == 206
+        assert b"".join(message["body"] for message in messages[1:]) == expected
+        assert [message["more_body"] for message in messages[1:]] == [True, True, False]
+    
+    @pytest.mark.asyncio
+    async def test_delete_image(self, client: AsyncClient, test_db: AsyncSession):
+        """Test deleting an image record."""
+        image = Image(
+            status=ImageStatus.DONE,
+            original_filename="test.jpg",
+            original_path="/path/to/test.jpg",
+            original_size=1000
+        )
+        test_db.add(image)
+        await test_db.commit()
+        
+        response = await client.delete(f"/images/{image.id}")
+        assert response.status_code == 204
+        
+        response = await client.delete(f"/images/{image.id}")
+        assert response.status_code == 404
+    
     @pytest.mark.asyncio
     async def test_get_image_invalid_uuid(self, client: AsyncClient):
         """Test get image with invalid UUID."""
@@ -101,9 +678,16 @@ class TestHealthAPI:
     """Test health check endpoint."""
     
     @pytest.mark.asyncio
-    async def test_health_check_success(self, client: AsyncClient, mock_rabbitmq):
+    async def test_health_check_success(self, client: AsyncClient):
         """Test successful health check."""
-        with patch('src.api.routes.health.rabbitmq_service', mock_rabbitmq):
+        from src.services.health import HealthProber
+        
+        async def passing():
+            pass
+        
+        prober = HealthProber({"database": passing, "rabbitmq": passing}, interval=60, reports={})
+        await prober.probe_once()
+        with patch('src.api.routes.health.health_prober', prober):
             response = await client.get("/health")
         
         assert response.status_code == 200
@@ -113,6 +697,148 @@ class TestHealthAPI:
         assert data["services"]["database"] is True
         assert data["services"]["rabbitmq"] is True
         assert "timestamp" in data
+        assert "details" not in data
+    
+    @pytest.mark.asyncio
+    async def test_deep_health_reports_queues_and_pool(self, client: AsyncClient, monkeypatch):
+        """Test that ?deep=1 adds lane queue depths, consumers and database pool usage."""
+        import aio_pika
+        from src.config import settings
+        from src.services import rabbitmq_service as rabbitmq_module
+        from src.services.health import HealthProber
+        from src.services.memory_broker import MemoryBroker
+        from src.services.rabbitmq_service import RabbitMQService
+        
+        monkeypatch.setattr(settings, "RABBITMQ_URL", "memory://")
+        monkeypatch.setattr(rabbitmq_module, "memory_broker", MemoryBroker())
+        service = RabbitMQService()
+        await service.connect()
+        await service.channel.default_exchange.publish(
+            aio_pika.Message(b"{}"), routing_key=settings.QUEUE_NAME
+        )
+        
+        async def passing():
+            pass
+        
+        prober = HealthProber(
+            {"database": passing, "rabbitmq": passing}, interval=60,
+            reports={"queues": service.queue_stats}
+        )
+        await prober.probe_once()
+        await service.disconnect()
+        with patch('src.api.routes.health.health_prober', prober):
+            response = await client.get("/health", params={"deep": 1})
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data["status"] == "healthy"
+        assert data["details"]["queues"] == {
+            settings.QUEUE_NAME: {"messages": 1, "consumers": 0},
+            f"{settings.QUEUE_NAME}.small": {"messages": 0, "consumers": 0}
+        }
+        assert "database_pool" in data["details"]
+        assert set(data["details"]["checks"]) == {"database", "rabbitmq"}
+    
+    @pytest.mark.asyncio
+    async def test_health_check_serves_cached_checks(self, client: AsyncClient):
+        """Test that /health reports the last background checks without running them."""
+        from src.services.health import HealthProber
+        
+        calls = []
+        
+        async def database():
+            calls.append("database")
+        
+        async def rabbitmq():
+            calls.append("rabbitmq")
+            raise ConnectionError("connection refused")
+        
+        prober = HealthProber({"database": database, "rabbitmq": rabbitmq}, interval=60, reports={})
+        await prober.probe_once()
+        with patch('src.api.routes.health.health_prober', prober):
+            response = await client.get("/health", params={"deep": 1})
+        
+        assert calls == ["database", "rabbitmq"]
+        assert response.json()["status"] == "unhealthy"
+        assert response.json()["services"] == {"database": True, "rabbitmq": False}
+        assert response.json()["details"]["queues"] == {"error": "Not collected yet"}
+    
+    @pytest.mark.asyncio
+    async def test_livez_checks_nothing(self, client: AsyncClient):
+        """Test that liveness answers without touching dependencies."""
+        with patch('src.services.health.rabbitmq_service', None):
+            response = await client.get("/livez")
+        
+        assert response.status_code == 200
+        assert response.json() == {"status": "alive", "checks": {}}
+    
+    @pytest.mark.asyncio
+    async def test_readyz_serves_cached_checks(self, client: AsyncClient):
+        """Test that readiness reflects the last background checks and never runs them itself."""
+        from src.services.health import HealthProber
+        
+        calls = []
+        
+        async def database():
+            calls.append("database")
+        
+        async def rabbitmq():
+            calls.append("rabbitmq")
+            raise ConnectionError("connection refused")
+        
+        prober = HealthProber({"database": database, "rabbitmq": rabbitmq}, interval=60)
+        with patch('src.api.routes.health.health_prober', prober):
+            response = await client.get("/readyz")
+            assert response.status_code == 503
+            assert response.json()["checks"]["database"]["error"] == "Not checked yet"
+            
+            await prober.probe_once()
+            response = await client.get("/readyz")
+            assert response.status_code == 503
+            checks = response.json()["checks"]
+            assert checks["database"]["ok"] is True
+            assert checks["rabbitmq"] == {
+                "ok": False,
+                "latency_ms": checks["rabbitmq"]["latency_ms"],
+                "age_s": checks["rabbitmq"]["age_s"],
+                "error": "connection refused"
+            }
+            
+            prober.checks["rabbitmq"] = database
+            await prober.probe_once()
+            for _ in range(3):
+                response = await client.get("/readyz")
+                assert response.status_code == 200
+                assert response.json()["status"] == "ready"
+        
+        assert calls == ["database", "rabbitmq", "database", "database"]
+
+
+class TestMetricsAPI:
+    """Test metrics endpoint."""
+    
+    @pytest.mark.asyncio
+    async def test_metrics_exposes_request_and_upload_timings(
+        self,
+        client: AsyncClient,
+        temp_storage: str,
+        sample_image_file: str,
+        mock_rabbitmq
+    ):
+        """Test that requests are timed by route template and uploads separately."""
+        with patch('src.services.image_service.rabbitmq_service', mock_rabbitmq):
+            with open(sample_image_file, 'rb') as f:
+                await client.post("/images/", files={"file": ("test.jpg", f, "image/jpeg")})
+        await client.get("/images/00000000-0000-0000-0000-000000000000")
+        
+        response = await client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        text = response.text
+        assert 'http_request_duration_seconds_count{method="POST",route="/images/",status="200"}' in text
+        assert 'route="/images/{image_id}",status="404"' in text
+        assert 'image_upload_duration_seconds_bucket{endpoint="single",le="+Inf"}' in text
+        assert "http_requests_in_progress 1" in text
 
 
 class TestRootAPI:
@@ -39,6 +39,8 @@ class TestWorkerIntegration:
         class MockMessage:
             def __init__(self, body: bytes):
                 self.body = body
+                self.headers = {}
+                self.routing_key = "images.small"
                 self.processed = False
             
             async def __aenter__(self):
@@ -70,9 +72,10 @@ class TestWorkerIntegration:
         # Check that image status was updated
         await test_db.refresh(image)
         assert image.status == ImageStatus.DONE
-        assert image.thumbnail_100_path is not None
-        assert image.thumbnail_300_path is not None
-        assert image.thumbnail_1200_path is not None
+        await test_db.refresh(image, ["variants"])
+        assert {variant.size_name for variant in image.variants if variant.path} == {
+            "100x100", "300x300", "1200x1200"
+        }
     
     @pytest.mark.asyncio
     async def test_worker_handles_processing_error(
@@ -99,6 +102,8 @@ class TestWorkerIntegration:
         class MockMessage:
             def __init__(self, body: bytes):
                 self.body = body
+                self.headers = {}
+                self.routing_key = "images.small"
                 self.processed = False
                 self.rejected = False
             
@@ -190,8 +195,14 @@ class TestEndToEndFlow:
     @pytest.mark.asyncio
     async def test_health_check_integration(self, client, mock_rabbitmq):
         """Test health check with all services."""
+        from src.services.health import HealthProber
+        from tests.conftest import TestAsyncSessionLocal
         
-        with patch('src.api.routes.health.rabbitmq_service', mock_rabbitmq):
+        with patch('src.services.health.AsyncSessionLocal', TestAsyncSessionLocal):
+            with patch('src.services.health.rabbitmq_service', mock_rabbitmq):
+                prober = HealthProber(reports={})
+                await prober.probe_once()
+        with patch('src.api.routes.health.health_prober', prober):
             response = await client.get("/health")
         
         assert response.status_code == 200
@@ -201,3 +212,45 @@ class TestEndToEndFlow:
         assert data["services"]["database"] is True
         assert data["services"]["rabbitmq"] is True
         assert "timestamp" in data
+
+
+class TestWorkerExecutor:
+    """Test worker executor configuration."""
+    
+    def test_thread_executor_sized_by_concurrency(self, monkeypatch):
+        """Test that the default executor is a thread pool of configured size."""
+        from concurrent.futures import ThreadPoolExecutor
+        from src.config import settings
+        
+        monkeypatch.setattr(settings, "WORKER_EXECUTOR", "thread")
+        monkeypatch.setattr(settings, "WORKER_CONCURRENCY", 3)
+        
+        worker = ImageWorker()
+        try:
+            assert isinstance(worker.executor, ThreadPoolExecutor)
+            assert worker.executor._max_workers == 3
+        finally:
+            worker.executor.shutdown()
+    
+    def test_process_executor(self, monkeypatch):
+        """Test that process mode creates a process pool."""
+        from concurrent.futures import ProcessPoolExecutor
+        from src.config import settings
+        
+        monkeypatch.setattr(settings, "WORKER_EXECUTOR", "process")
+        monkeypatch.setattr(settings, "WORKER_CONCURRENCY", 2)
+        
+        worker = ImageWorker()
+        try:
+            assert isinstance(worker.executor, ProcessPoolExecutor)
+        finally:
+            worker.executor.shutdown()
+    
+    def test_unknown_executor_rejected(self, monkeypatch):
+        """Test that an unknown executor mode fails fast."""
+        from src.config import settings
+        
+        monkeypatch.setattr(settings, "WORKER_EXECUTOR", "fibers")
+        
+        with pytest.raises(ValueError):
+            ImageWorker()
@@ -1,5 +1,7 @@
 """Tests for services."""
 
+import asyncio
+import json
 import os
 import pytest
 import tempfile
@@ -46,6 +48,77 @@ class TestImageProcessor:
                     if os.path.exists(path):
                         os.unlink(path)
     
+    def test_create_thumbnails_cascaded_records_timings(self, temp_storage: str):
+        """Test cascaded thumbnails of a wide JPEG and per-stage timings."""
+        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
+            img = PILImage.new('RGB', (4000, 2000), color=(0, 0, 255))
+            img.save(temp_file, 'JPEG')
+            temp_file.flush()
+            
+            try:
+                timings = {}
+                thumbnails = ImageProcessor.create_thumbnails(
+                    "cascade-id", temp_file.name, timings=timings, strict=False
+                )
+                
+                for size, path in thumbnails.items():
+                    with PILImage.open(path) as thumb:
+                        assert thumb.size == tuple(map(int, size.split('x')))
+                        assert thumb.mode == "RGB"
+                    assert f"resize_{size}" in timings
+                    assert f"encode_{size}" in timings
+                
+                assert "decode" in timings
+                assert timings["total"] >= timings["decode"]
+            finally:
+                os.unlink(temp_file.name)
+    
+    def test_create_thumbnails_flattens_transparency(self, temp_storage: str):
+        """Test that transparent PNGs are flattened onto white."""
+        with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_file:
+            img = PILImage.new('RGBA', (3000, 3000), color=(0, 0, 0, 0))
+            img.save(temp_file, 'PNG')
+            temp_file.flush()
+            
+            try:
+                thumbnails = ImageProcessor.create_thumbnails("png-id", temp_file.name)
+                
+                with PILImage.open(thumbnails["100x100"]) as thumb:
+                    red, green, blue = thumb.getpixel((50, 50))
+                    assert min(red, green, blue) > 250
+            finally:
+                os.unlink(temp_file.name)
+    
+    def test_create_thumbnails_strict_matches_legacy_output(self, temp_storage: str):
+        """Test that strict mode reproduces the per-size fit pipeline."""
+        from io import BytesIO
+        from PIL import ImageOps
+        
+        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
+            img = PILImage.linear_gradient('L').resize((1600, 900)).convert('RGB')
+            img.save(temp_file, 'JPEG')
+            temp_file.flush()
+            
+            try:
+                thumbnails = ImageProcessor.create_thumbnails(
+                    "strict-id", temp_file.name, strict=True
+                )
+                
+                with PILImage.open(temp_file.name) as original:
+                    original = original.convert('RGB')
+                    for size, path in thumbnails.items():
+                        expected = BytesIO()
+                        ImageOps.fit(
+                            original.copy(),
+                            tuple(map(int, size.split('x'))),
+                            PILImage.Resampling.LANCZOS
+                        ).save(expected, 'JPEG', quality=85, optimize=True)
+                        
+                        with open(path, 'rb') as f:
+                            assert f.read() == expected.getvalue()
+            finally:
+                os.unlink(temp_file.name)
+    
     def test_create_thumbnails_invalid_file(self, temp_storage: str):
         """Test thumbnail creation with invalid file."""
         with pytest.raises(Exception):
@@ -74,6 +147,243 @@ class TestImageProcessor:
         """Test getting info for invalid file."""
         info = ImageProcessor.get_image_info("/nonexistent/file.jpg")
         assert info is None
+    
+    @pytest.mark.parametrize("fmt,mode", [
+        ("JPEG", "RGB"),
+        ("PNG", "RGBA"),
+        ("PNG", "P"),
+        ("WEBP", "RGB"),
+    ])
+    def test_probe_image_reads_header(self, fmt, mode):
+        """Test header-only probing of supported formats."""
+        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+            PILImage.new(mode, (640, 480)).save(temp_file, fmt)
+            temp_file.flush()
+            
+            try:
+                info = ImageProcessor.probe_image(temp_file.name)
+                
+                assert info["format"] == fmt
+                assert (info["width"], info["height"]) == (640, 480)
+                assert info["frames"] == 1
+            finally:
+                os.unlink(temp_file.name)
+    
+    def test_probe_image_rejects_unknown_content(self):
+        """Test that non-image content fails the magic-byte sniff."""
+        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
+            temp_file.write(b"GIF89a not supported")
+            temp_file.flush()
+            
+            try:
+                with pytest.raises(ValueError):
+                    ImageProcessor.probe_image(temp_file.name)
+            finally:
+                os.unlink(temp_file.name)
+    
+    @pytest.mark.parametrize("fit,expected", [
+        ("cover", (200, 200)),
+        ("contain", (200, 100)),
+        ("fill", (200, 200)),
+    ])
+    def test_render_variant(self, fit, expected):
+        """Test rendering an arbitrary-size variant for each fit mode."""
+        from io import BytesIO
+        
+        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
+            img = PILImage.new('RGB', (800, 400), color=(0, 255, 0))
+            img.save(temp_file, 'JPEG')
+            temp_file.flush()
+            
+            try:
+                data = ImageProcessor.render_variant(temp_file.name, 200, 200, fit)
+                
+                with PILImage.open(BytesIO(data)) as variant:
+                    assert variant.format == "JPEG"
+                    assert variant.size == expected
+            finally:
+                os.unlink(temp_file.name)
+    
+    def test_create_variant_builds_one_size(self, temp_storage: str):
+        """Test that a fan-out subtask writes only its own size, named by its content."""
+        import hashlib
+        from src.services.storage import shard_key
+        
+        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
+            PILImage.new('RGB', (1600, 900), color=(0, 0, 255)).save(temp_file, 'JPEG')
+            temp_file.flush()
+            
+            try:
+                path = ImageProcessor.create_variant("variant-id", temp_file.name, (300, 300))
+                
+                with open(path, "rb") as f:
+                    version = hashlib.sha256(f.read()).hexdigest()[:16]
+                name = f"variant-id_300x300.{version}.jpg"
+                assert path == os.path.join(temp_storage, *shard_key("thumbnails", name).split("/"))
+                with PILImage.open(path) as thumbnail:
+                    assert thumbnail.size == (300, 300)
+            finally:
+                os.unlink(temp_file.name)
+
+
+class TestRenderCache:
+    """Test tiered render cache."""
+    
+    @pytest.mark.asyncio
+    async def test_memory_hit_skips_render(self, temp_storage):
+        """Test that a cached variant is not rendered twice."""
+        from src.services.render_cache import RenderCache
+        
+        cache = RenderCache(memory_bytes=1024, disk_bytes=1024)
+        calls = []
+        
+        async def render():
+            calls.append(1)
+            return b"variant"
+        
+        assert await cache.get_or_render("key", render) == b"variant"
+        assert await cache.get_or_render("key", render) == b"variant"
+        assert len(calls) == 1
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_coalesced(self, temp_storage):
+        """Test that a thundering herd triggers a single render."""
+        import asyncio
+        import threading
+        from src.services.render_cache import RenderCache
+        
+        cache = RenderCache(memory_bytes=1024, disk_bytes=1024)
+        calls = []
+        release = threading.Event()
+        
+        async def render():
+            calls.append(1)
+            await asyncio.to_thread(release.wait, 5)
+            return b"variant"
+        
+        tasks = [
+            asyncio.create_task(cache.get_or_render("key", render))
+            for _ in range(10)
+        ]
+        await asyncio.sleep(0.05)
+        release.set()
+        
+        assert await asyncio.gather(*tasks) == [b"variant"] * 10
+        assert len(calls) == 1
+    
+    @pytest.mark.asyncio
+    async def test_cancelled_leader_does_not_abort_waiters(self, temp_storage):
+        """Test that coalesced requests get the render when the first request is cancelled."""
+        import asyncio
+        import threading
+        from src.services.render_cache import RenderCache
+        
+        cache = RenderCache(memory_bytes=1024, disk_bytes=1024)
+        release = threading.Event()
+        
+        async def render():
+            await asyncio.to_thread(release.wait, 5)
+            return b"variant"
+        
+        leader = asyncio.create_task(cache.get_or_render("key", render))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(cache.get_or_render("key", render))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        await asyncio.sleep(0.01)
+        release.set()
+        
+        assert await waiter == b"variant"
+        assert leader.cancelled()
+    
+    @pytest.mark.asyncio
+    async def test_disk_tier_survives_memory_eviction(self, temp_storage):
+        """Test that entries evicted from memory are served from disk."""
+        from functools import partial
+        from src.services.render_cache import RenderCache
+        
+        cache = RenderCache(memory_bytes=10, disk_bytes=1024)
+        
+        async def render(data):
+            return data
+        
+        await cache.get_or_render("first", partial(render, b"a" * 8))
+        await cache.get_or_render("second", partial(render, b"b" * 8))
+        
+        assert cache._memory_get("first") is None
+        
+        async def fail():
+            raise AssertionError("should be served from disk")
+        
+        assert await cache.get_or_render("first", fail) == b"a" * 8
+    
+    @pytest.mark.asyncio
+    async def test_disk_tier_bounded(self, temp_storage):
+        """Test that the disk tier evicts oldest entries past its budget."""
+        from src.services.render_cache import RenderCache
+        
+        cache = RenderCache(memory_bytes=0, disk_bytes=100)
+        
+        async def render():
+            return b"x" * 30
+        
+        for i in range(10):
+            await cache.get_or_render(f"key{i}", render)
+        
+        assert cache._scan_disk_size() <= 100
+        assert cache._disk_get("key9") is not None
+    
+    @pytest.mark.asyncio
+    async def test_deleted_image_variants_purged(self, temp_storage):
+        """Test that a deleted image's variants leave both tiers, its neighbours' stay."""
+        from src.services.render_cache import RenderCache
+        
+        cache = RenderCache(memory_bytes=1024, disk_bytes=1024)
+        deleted = "ab000000-0000-0000-0000-000000000001"
+        kept = "ab000000-0000-0000-0000-000000000002"
+        
+        async def render():
+            return b"variant"
+        
+        for image_id in (deleted, kept):
+            for size in (10, 20):
+                await cache.get_or_render(RenderCache.key(image_id, size, size, "cover"), render)
+        
+        await cache.handle_status_event({"image_id": deleted.upper(), "status": "DELETED"})
+        
+        for size in (10, 20):
+            key = RenderCache.key(deleted, size, size, "cover")
+            assert cache._memory_get(key) is None
+            assert cache._disk_get(key) is None
+            assert cache._memory_get(RenderCache.key(kept, size, size, "cover")) == b"variant"
+            assert cache._disk_get(RenderCache.key(kept, size, size, "cover")) == b"variant"
+        assert cache._memory_size == 2 * len(b"variant")
+        assert cache._disk_size == cache._scan_disk_size()
+    
+    @pytest.mark.asyncio
+    async def test_render_finishing_after_purge_not_cached(self, temp_storage):
+        """Test that a render in flight when its image is deleted is not cached."""
+        import asyncio
+        import threading
+        from src.services.render_cache import RenderCache
+        
+        cache = RenderCache(memory_bytes=1024, disk_bytes=1024)
+        image_id = "ab000000-0000-0000-0000-000000000001"
+        key = RenderCache.key(image_id, 10, 10, "cover")
+        release = threading.Event()
+        
+        async def render():
+            await asyncio.to_thread(release.wait, 5)
+            return b"variant"
+        
+        request = asyncio.create_task(cache.get_or_render(key, render))
+        await asyncio.sleep(0.05)
+        await cache.invalidate_image(image_id)
+        release.set()
+        
+        assert await request == b"variant"
+        assert cache._memory_get(key) is None
+        assert cache._disk_get(key) is None
 
 
 class TestImageService:
@@ -106,3 +416,1693 @@ class TestImageService:
         
         result = await ImageService.get_image(test_db, "invalid-uuid")
         assert result is None
+    
+    @pytest.mark.asyncio
+    async def test_spool_upload_streams_and_hashes(self, temp_storage):
+        """Test that uploads are streamed to disk with their SHA-256."""
+        import hashlib
+        from fastapi import UploadFile
+        from io import BytesIO
+        from src.services.image_service import ImageService
+        
+        payload = os.urandom(3 * 1024 + 17)
+        upload = UploadFile(filename="test.jpg", file=BytesIO(payload))
+        directory = os.path.join(temp_storage, "originals")
+        
+        temp_path, size, content_hash = await ImageService._spool_upload(upload, directory)
+        
+        assert size == len(payload)
+        assert content_hash == hashlib.sha256(payload).hexdigest()
+        assert os.path.dirname(temp_path) == directory
+        with open(temp_path, "rb") as f:
+            assert f.read() == payload
+    
+    @pytest.mark.asyncio
+    async def test_uploads_spool_outside_served_directories(self, temp_storage):
+        """Test that partial uploads cannot be fetched under /static."""
+        from fastapi import UploadFile
+        from io import BytesIO
+        from src.services.image_service import ImageService
+        from src.services.storage import storage
+        
+        upload = UploadFile(filename="test.jpg", file=BytesIO(b"partial"))
+        temp_path, _, _ = await ImageService._receive_upload(upload)
+        
+        assert os.path.dirname(temp_path) == os.path.join(temp_storage, "tmp")
+        key = os.path.relpath(temp_path, temp_storage).replace(os.sep, "/")
+        assert storage.resolve(key) is None
+    
+    @pytest.mark.asyncio
+    async def test_create_image_rejects_oversized_stream(self, test_db, temp_storage, monkeypatch):
+        """Test that the size limit is enforced while streaming."""
+        from fastapi import HTTPException, UploadFile
+        from io import BytesIO
+        from src.services.image_service import ImageService
+        
+        monkeypatch.setattr(settings, "MAX_FILE_SIZE", 1024)
+        monkeypatch.setattr(settings, "UPLOAD_CHUNK_SIZE", 256)
+        upload = UploadFile(filename="big.jpg", file=BytesIO(b"x" * 4096))
+        
+        with pytest.raises(HTTPException) as exc_info:
+            await ImageService.create_image(test_db, upload)
+        
+        assert exc_info.value.status_code == 400
+        assert "File too large" in str(exc_info.value.detail)
+        assert os.listdir(os.path.join(temp_storage, "originals")) == []
+    
+    @pytest.mark.asyncio
+    async def test_duplicate_upload_reuses_thumbnails(
+        self, test_db, temp_storage, sample_image_file, mock_rabbitmq
+    ):
+        """Test that re-uploading processed content skips the queue."""
+        from unittest.mock import patch
+        from fastapi import UploadFile
+        from sqlalchemy import func, select
+        from src.models.image import ImageStatus
+        from src.models.outbox import OutboxMessage
+        from src.services.image_service import ImageService
+        
+        with patch('src.services.image_service.rabbitmq_service', mock_rabbitmq):
+            with open(sample_image_file, 'rb') as f:
+                first = await ImageService.create_image(
+                    test_db, UploadFile(filename="a.jpg", file=f)
+                )
+            await ImageService.update_image_status(
+                test_db,
+                str(first.id),
+                ImageStatus.DONE,
+                thumbnail_paths={"100x100": "/thumbs/a_100x100.jpg"}
+            )
+            
+            with open(sample_image_file, 'rb') as f:
+                second = await ImageService.create_image(
+                    test_db, UploadFile(filename="b.jpg", file=f)
+                )
+        
+        queued = await test_db.scalar(select(func.count()).select_from(OutboxMessage))
+        assert queued == 1
+        assert second.status == ImageStatus.DONE
+        assert second.content_hash == first.content_hash
+        assert second.original_path == first.original_path
+        assert [(v.size_name, v.path) for v in second.variants] == [
+            ("100x100", "/thumbs/a_100x100.jpg")
+        ]
+        assert len(os.listdir(os.path.join(temp_storage, "originals"))) == 1
+    
+    @pytest.mark.asyncio
+    async def test_delete_keeps_shared_files(
+        self, test_db, temp_storage, sample_image_file, mock_rabbitmq
+    ):
+        """Test that shared originals are only removed with their last reference."""
+        from unittest.mock import patch
+        from fastapi import UploadFile
+        from src.services.image_service import ImageService
+        
+        with patch('src.services.image_service.rabbitmq_service', mock_rabbitmq):
+            images = []
+            for name in ("a.jpg", "b.jpg"):
+                with open(sample_image_file, 'rb') as f:
+                    images.append(await ImageService.create_image(
+                        test_db, UploadFile(filename=name, file=f)
+                    ))
+        
+        original_path = images[0].original_path
+        
+        assert await ImageService.delete_image(test_db, str(images[0].id))
+        assert os.path.exists(original_path)
+        
+        assert await ImageService.delete_image(test_db, str(images[1].id))
+        assert not os.path.exists(original_path)
+        
+        assert not await ImageService.delete_image(test_db, str(images[1].id))
+    
+    @pytest.mark.asyncio
+    async def test_create_image_rejects_invalid_content(self, test_db, temp_storage):
+        """Test that files with an image extension but no image header are refused."""
+        from fastapi import HTTPException, UploadFile
+        from io import BytesIO
+        from src.services.image_service import ImageService
+        
+        upload = UploadFile(filename="fake.jpg", file=BytesIO(b"\xff\xd8\xff" + b"\x00" * 64))
+        
+        with pytest.raises(HTTPException) as exc_info:
+            await ImageService.create_image(test_db, upload)
+        
+        assert exc_info.value.status_code == 400
+        assert "Invalid image" in str(exc_info.value.detail)
+        assert os.listdir(os.path.join(temp_storage, "originals")) == []
+    
+    @pytest.mark.asyncio
+    async def test_create_image_rejects_pixel_bomb(self, test_db, temp_storage, monkeypatch):
+        """Test that oversized pixel counts are refused from the header."""
+        from fastapi import HTTPException, UploadFile
+        from io import BytesIO
+        from src.services.image_service import ImageService
+        
+        monkeypatch.setattr(settings, "MAX_IMAGE_PIXELS", 100 * 100)
+        buffer = BytesIO()
+        PILImage.new('L', (2000, 2000)).save(buffer, 'PNG')
+        buffer.seek(0)
+        
+        with pytest.raises(HTTPException) as exc_info:
+            await ImageService.create_image(test_db, UploadFile(filename="bomb.png", file=buffer))
+        
+        assert exc_info.value.status_code == 400
+        assert "2000x2000" in str(exc_info.value.detail)
+        assert os.listdir(os.path.join(temp_storage, "originals")) == []
+    
+    @pytest.mark.asyncio
+    async def test_create_image_stores_probed_dimensions(
+        self, test_db, temp_storage, sample_image_file, mock_rabbitmq
+    ):
+        """Test that probed dimensions and format are stored on the row."""
+        from unittest.mock import patch
+        from fastapi import UploadFile
+        from src.services.image_service import ImageService
+        
+        with patch('src.services.image_service.rabbitmq_service', mock_rabbitmq):
+            with open(sample_image_file, 'rb') as f:
+                image = await ImageService.create_image(
+                    test_db, UploadFile(filename="a.jpg", file=f)
+                )
+        
+        assert (image.width, image.height, image.format) == (100, 100, "JPEG")
+    
+    @pytest.mark.asyncio
+    async def test_set_image_status_unknown_id(self, test_db):
+        """Test that a status write for a missing image reports no match."""
+        import uuid
+        from src.models.image import ImageStatus
+        from src.services.image_service import ImageService
+        
+        updated = await ImageService.set_image_status(
+            test_db, str(uuid.uuid4()), ImageStatus.DONE
+        )
+        assert updated is False
+
+
+class TestStatusBatcher:
+    """Test write-behind batching of status updates."""
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_submits_flushed_together(self, test_db):
+        """Test that concurrent updates are committed in a single flush."""
+        import asyncio
+        from unittest.mock import patch
+        from src.models.image import Image, ImageStatus
+        from src.services.image_service import ImageService
+        from src.services.status_batcher import StatusBatcher
+        from tests.conftest import TestAsyncSessionLocal
+        
+        images = [
+            Image(original_filename=f"{i}.jpg", original_path=f"/tmp/{i}.jpg")
+            for i in range(3)
+        ]
+        test_db.add_all(images)
+        await test_db.commit()
+        
+        batcher = StatusBatcher(
+            session_factory=TestAsyncSessionLocal, flush_interval=0.01, max_batch=100
+        )
+        calls = []
+        original = ImageService.set_image_statuses
+        
+        async def counting(db, updates):
+            calls.append(len(updates))
+            await original(db, updates)
+        
+        with patch.object(ImageService, "set_image_statuses", side_effect=counting):
+            batcher.start()
+            try:
+                await asyncio.gather(*[
+                    batcher.submit(
+                        str(image.id),
+                        ImageStatus.DONE,
+                        thumbnail_paths={"100x100": f"/tmp/{image.id}_100x100.jpg"}
+                    )
+                    for image in images
+                ])
+            finally:
+                await batcher.stop()
+        
+        assert calls == [3]
+        for image in images:
+            await test_db.refresh(image)
+            assert image.status == ImageStatus.DONE
+            await test_db.refresh(image, ["variants"])
+            assert [v.path for v in image.variants] == [f"/tmp/{image.id}_100x100.jpg"]
+    
+    @pytest.mark.asyncio
+    async def test_flush_skips_deleted_image(self, test_db):
+        """Test that an image deleted meanwhile does not fail the rest of its batch."""
+        import uuid
+        from src.models.image import Image, ImageStatus
+        from src.services.image_service import ImageService
+        
+        images = [
+            Image(original_filename=f"{i}.jpg", original_path=f"/tmp/{i}.jpg")
+            for i in range(2)
+        ]
+        test_db.add_all(images)
+        await test_db.commit()
+        
+        await ImageService.set_image_statuses(test_db, [
+            {"image_id": str(images[0].id), "status": ImageStatus.DONE,
+             "thumbnail_paths": {"100x100": "/tmp/0_100x100.jpg"}},
+            {"image_id": str(uuid.uuid4()), "status": ImageStatus.DONE,
+             "thumbnail_paths": {"100x100": "/tmp/gone_100x100.jpg"}},
+            {"image_id": str(images[1].id), "status": ImageStatus.ERROR,
+             "error_message": "Cannot decode"},
+            {"image_id": str(uuid.uuid4()), "status": ImageStatus.ERROR,
+             "error_message": "Cannot decode"},
+        ])
+        
+        for image in images:
+            await test_db.refresh(image)
+        assert images[0].status == ImageStatus.DONE
+        assert images[1].status == ImageStatus.ERROR
+        assert images[1].error_message == "Cannot decode"
+    
+    @pytest.mark.asyncio
+    async def test_stop_waits_for_flush_in_progress(self):
+        """Test that stopping during a flush still resolves the flushed updates."""
+        import asyncio
+        from unittest.mock import patch
+        from src.models.image import ImageStatus
+        from src.services.image_service import ImageService
+        from src.services.status_batcher import StatusBatcher
+        from tests.conftest import TestAsyncSessionLocal
+        
+        batcher = StatusBatcher(
+            session_factory=TestAsyncSessionLocal, flush_interval=0.01, max_batch=100
+        )
+        writing = asyncio.Event()
+        release = asyncio.Event()
+        
+        async def slow(db, updates):
+            writing.set()
+            await release.wait()
+        
+        with patch.object(ImageService, "set_image_statuses", side_effect=slow):
+            batcher.start()
+            submitted = asyncio.create_task(batcher.submit("image-id", ImageStatus.DONE))
+            await writing.wait()
+            stopping = asyncio.create_task(batcher.stop())
+            await asyncio.sleep(0.01)
+            release.set()
+            await asyncio.wait_for(stopping, timeout=1)
+            await asyncio.wait_for(submitted, timeout=1)
+
+
+class TestImageCache:
+    """Test the image response cache."""
+    
+    def test_ttl_depends_on_status(self, monkeypatch):
+        """Test that final statuses outlive in-progress ones."""
+        from src.services import image_cache as image_cache_module
+        from src.services.image_cache import ImageCache
+        
+        now = [1000.0]
+        monkeypatch.setattr(image_cache_module.time, "monotonic", lambda: now[0])
+        cache = ImageCache(max_entries=10, final_ttl=60, pending_ttl=1)
+        cache.put("done", {"id": "done", "status": "DONE"})
+        cache.put("pending", {"id": "pending", "status": "PROCESSING"})
+        
+        now[0] += 2
+        assert cache.get("done") is not None
+        assert cache.get("pending") is None
+        assert (cache.hits, cache.misses) == (1, 1)
+    
+    def test_lru_bound(self):
+        """Test that the least recently used entry is evicted first."""
+        from src.services.image_cache import ImageCache
+        
+        cache = ImageCache(max_entries=2, final_ttl=60, pending_ttl=1)
+        cache.put("a", {"status": "DONE"})
+        cache.put("b", {"status": "DONE"})
+        cache.get("a")
+        cache.put("c", {"status": "DONE"})
+        
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.get("c") is not None
+    
+    def test_ids_keyed_canonically(self):
+        """Test that every spelling of an id hits and invalidates the same entry."""
+        import uuid
+        from src.services.image_cache import ImageCache
+        
+        image_id = str(uuid.uuid4())
+        cache = ImageCache(max_entries=10, final_ttl=60, pending_ttl=1)
+        cache.put(image_id.upper(), {"id": image_id, "status": "DONE"})
+        
+        assert cache.get(image_id) is not None
+        cache.invalidate(image_id.replace("-", ""))
+        assert cache.get(image_id) is None
+    
+    def test_put_after_invalidation_is_dropped(self):
+        """Test that a payload read before an invalidation is not cached after it."""
+        from src.services.image_cache import ImageCache
+        
+        cache = ImageCache(max_entries=2, final_ttl=60, pending_ttl=1)
+        generation = cache.generation()
+        # Deleted while the GET was reading the row
+        cache.invalidate("a")
+        cache.put("a", {"id": "a", "status": "DONE"}, generation)
+        assert cache.get("a") is None
+        
+        cache.put("b", {"id": "b", "status": "DONE"}, generation)
+        assert cache.get("b") is not None
+        cache.put("a", {"id": "a", "status": "DONE"}, cache.generation())
+        assert cache.get("a") is not None
+        
+        # Invalidations no longer tracked count against every older read
+        for name in ("c", "d", "e"):
+            cache.invalidate(name)
+        cache.put("f", {"id": "f", "status": "DONE"}, generation)
+        assert cache.get("f") is None
+    
+    @pytest.mark.asyncio
+    async def test_status_event_invalidates(self):
+        """Test that a fanout status event drops the cached entry."""
+        from src.services.image_cache import ImageCache
+        
+        cache = ImageCache(max_entries=10, final_ttl=60, pending_ttl=1)
+        cache.put("a", {"status": "PROCESSING"})
+        await cache.handle_status_event({"image_id": "a", "status": "DONE"})
+        
+        assert cache.get("a") is None
+        assert cache.stats()["invalidations"] == 1
+
+
+class TestStatusEventBus:
+    """Test in-process routing of status events."""
+    
+    @pytest.mark.asyncio
+    async def test_events_routed_by_image(self):
+        """Test that subscribers only receive events for their images."""
+        from src.services.status_events import StatusEventBus
+        
+        bus = StatusEventBus(queue_size=10)
+        with bus.subscribe(["a"]) as first, bus.subscribe(["a", "b"]) as second:
+            await bus.handle_status_event({"image_id": "b", "status": "DONE"})
+            await bus.handle_status_event({"image_id": "a", "status": "DONE"})
+            
+            assert (await first.get(timeout=0.1))["image_id"] == "a"
+            assert await first.get(timeout=0.01) is None
+            assert (await second.get(timeout=0.1))["image_id"] == "b"
+            assert (await second.get(timeout=0.1))["image_id"] == "a"
+        
+        assert bus.subscriber_count("a") == 0
+        assert bus.subscriber_count("b") == 0
+    
+    @pytest.mark.asyncio
+    async def test_lagging_subscriber_keeps_latest(self):
+        """Test that a full queue drops the oldest event."""
+        from src.services.status_events import StatusEventBus
+        
+        bus = StatusEventBus(queue_size=1)
+        with bus.subscribe(["a"]) as subscription:
+            await bus.handle_status_event({"image_id": "a", "status": "PROCESSING"})
+            await bus.handle_status_event({"image_id": "a", "status": "DONE"})
+            
+            assert (await subscription.get(timeout=0.1))["status"] == "DONE"
+
+
+class TestRabbitMQService:
+    """Test RabbitMQ publishing without a broker."""
+    
+    @staticmethod
+    def _fake_channel(published):
+        """Channel whose default exchange records routing keys and message bodies."""
+        from types import SimpleNamespace
+        
+        async def publish(message, routing_key):
+            await asyncio.sleep(0)
+            published.append(json.loads(message.body))
+        
+        return SimpleNamespace(default_exchange=SimpleNamespace(publish=publish))
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_connect_opens_one_connection(self, monkeypatch):
+        """Test that concurrent callers share a single connection attempt."""
+        from types import SimpleNamespace
+        from src.services import rabbitmq_service as rabbitmq_module
+        from src.services.rabbitmq_service import RabbitMQService
+        
+        published = []
+        connections = []
+        
+        async def channel(publisher_confirms=True):
+            channel = self._fake_channel(published)
+            
+            async def declare_queue(*args, **kwargs):
+                return None
+            
+            async def declare_exchange(*args, **kwargs):
+                return None
+            
+            channel.declare_queue = declare_queue
+            channel.declare_exchange = declare_exchange
+            return channel
+        
+        async def connect_robust(url):
+            await asyncio.sleep(0.01)
+            connection = SimpleNamespace(is_closed=False, channel=channel)
+            connections.append(connection)
+            return connection
+        
+        monkeypatch.setattr(rabbitmq_module.aio_pika, "connect_robust", connect_robust)
+        monkeypatch.setattr(settings, "RABBITMQ_PUBLISH_CHANNELS", 2)
+        service = RabbitMQService()
+        
+        await asyncio.gather(*[
+            service.send_image_processing_task(f"id-{i}", f"/tmp/{i}.jpg") for i in range(5)
+        ])
+        
+        assert len(connections) == 1
+        assert len(service.publish_channels) == 2
+        assert sorted(message["image_id"] for message in published) == [
+            f"id-{i}" for i in range(5)
+        ]
+    
+    @pytest.mark.asyncio
+    async def test_failed_connect_closes_connection(self, monkeypatch):
+        """Test that a connection whose setup fails is closed, not left reconnecting."""
+        from types import SimpleNamespace
+        from src.services import rabbitmq_service as rabbitmq_module
+        from src.services.rabbitmq_service import RabbitMQService
+        
+        closed = []
+        
+        async def channel(publisher_confirms=True):
+            raise RuntimeError("channel refused")
+        
+        async def close():
+            closed.append(True)
+        
+        async def connect_robust(url):
+            return SimpleNamespace(is_closed=False, channel=channel, close=close)
+        
+        monkeypatch.setattr(rabbitmq_module.aio_pika, "connect_robust", connect_robust)
+        service = RabbitMQService()
+        
+        with pytest.raises(RuntimeError):
+            await service.connect()
+        
+        assert closed == [True]
+        assert service.connection is None
+    
+    @pytest.mark.asyncio
+    async def test_status_subscription_survives_failed_start(self, monkeypatch):
+        """Test that an API started while RabbitMQ was down subscribes once it connects."""
+        import asyncio
+        from src.config import settings
+        from src.services import rabbitmq_service as rabbitmq_module
+        from src.services.memory_broker import MemoryBroker
+        from src.services.rabbitmq_service import RabbitMQService
+        
+        monkeypatch.setattr(settings, "RABBITMQ_URL", "memory://")
+        monkeypatch.setattr(rabbitmq_module, "memory_broker", MemoryBroker())
+        original = rabbitmq_module.connect_broker
+        attempts = []
+        
+        async def connect_broker(url=None):
+            attempts.append(url)
+            if len(attempts) < 3:
+                raise ConnectionError("connection refused")
+            return await original(url)
+        
+        monkeypatch.setattr(rabbitmq_module, "connect_broker", connect_broker)
+        events = []
+        
+        async def on_event(event):
+            events.append(event)
+        
+        service = RabbitMQService()
+        with pytest.raises(ConnectionError):
+            await service.subscribe_status_events(on_event)
+        await asyncio.wait_for(service.keep_connecting(0.01), timeout=5)
+        assert len(attempts) == 3
+        
+        await service.publish_status_event("image-id", "DONE")
+        await asyncio.sleep(0.01)
+        assert [event["image_id"] for event in events] == ["image-id"]
+        await service.disconnect()
+    
+    @pytest.mark.asyncio
+    async def test_cancelled_connect_closes_connection(self, monkeypatch):
+        """Test that a connect cut off by a timeout closes the connection it opened."""
+        import asyncio
+        from types import SimpleNamespace
+        from src.services import rabbitmq_service as rabbitmq_module
+        from src.services.rabbitmq_service import RabbitMQService
+        
+        closed = []
+        
+        async def channel(publisher_confirms=True):
+            await asyncio.sleep(60)
+        
+        async def close():
+            closed.append(True)
+        
+        async def connect_robust(url):
+            return SimpleNamespace(is_closed=False, channel=channel, close=close)
+        
+        monkeypatch.setattr(rabbitmq_module.aio_pika, "connect_robust", connect_robust)
+        service = RabbitMQService()
+        
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(service.connect(), timeout=0.01)
+        
+        assert closed == [True]
+        assert service.connection is None
+    
+    @pytest.mark.asyncio
+    async def test_queue_stats_keep_shared_channel(self, monkeypatch):
+        """Test that queue stats and health checks neither connect nor touch the shared channel."""
+        from src.config import settings
+        from src.services import rabbitmq_service as rabbitmq_module
+        from src.services.memory_broker import MemoryBroker
+        from src.services.rabbitmq_service import RabbitMQService
+        
+        monkeypatch.setattr(settings, "RABBITMQ_URL", "memory://")
+        monkeypatch.setattr(rabbitmq_module, "memory_broker", MemoryBroker())
+        service = RabbitMQService()
+        assert not await service.is_healthy()
+        assert service.connection is None
+        
+        await service.connect()
+        shared = service.channel
+        opened = []
+        original = service.connection.channel
+        
+        async def channel(**kwargs):
+            opened.append(await original(**kwargs))
+            return opened[-1]
+        
+        monkeypatch.setattr(service.connection, "channel", channel)
+        stats = await service.queue_stats()
+        
+        assert set(stats) == {settings.QUEUE_NAME, f"{settings.QUEUE_NAME}.small"}
+        assert len(opened) == 1 and opened[0] is not shared
+        assert service.channel is shared
+        assert await service.is_healthy()
+        await service.disconnect()
+    
+    @pytest.mark.asyncio
+    async def test_publish_batching(self, monkeypatch):
+        """Test that single-task publishes are flushed together as one micro-batch."""
+        from src.services.rabbitmq_service import RabbitMQService
+        
+        monkeypatch.setattr(settings, "RABBITMQ_PUBLISH_BATCHING", True)
+        monkeypatch.setattr(settings, "RABBITMQ_PUBLISH_LINGER", 0.01)
+        monkeypatch.setattr(settings, "RABBITMQ_PUBLISH_MAX_BATCH", 100)
+        
+        published = []
+        service = RabbitMQService()
+        service.publish_channels = [self._fake_channel(published)]
+        flushes = []
+        flush_pending = service._flush_pending
+        
+        async def counting_flush():
+            flushes.append(len(service._pending))
+            await flush_pending()
+        
+        service._flush_pending = counting_flush
+        
+        await asyncio.gather(*[
+            service.send_image_processing_task(f"id-{i}", f"/tmp/{i}.jpg") for i in range(3)
+        ])
+        
+        assert flushes == [3]
+        assert [message["image_id"] for message in published] == ["id-0", "id-1", "id-2"]
+
+
+class TestOutboxRelay:
+    """Test the transactional outbox."""
+    
+    @pytest.mark.asyncio
+    async def test_upload_commits_task_with_image(
+        self, test_db, temp_storage, sample_image_file, mock_rabbitmq
+    ):
+        """Test that an upload is PROCESSING with its task in the outbox."""
+        from unittest.mock import patch
+        from fastapi import UploadFile
+        from sqlalchemy import select
+        from src.models.image import ImageStatus
+        from src.models.outbox import OutboxMessage
+        from src.services.image_service import ImageService
+        
+        with patch('src.services.image_service.rabbitmq_service', mock_rabbitmq):
+            with open(sample_image_file, 'rb') as f:
+                image = await ImageService.create_image(
+                    test_db, UploadFile(filename="a.jpg", file=f)
+                )
+        
+        assert image.status == ImageStatus.PROCESSING
+        messages = (await test_db.execute(select(OutboxMessage))).scalars().all()
+        assert [(m.image_id, m.image_path, m.sent_at) for m in messages] == [
+            (image.id, image.original_path, None)
+        ]
+        # A 100x100 upload is routed to the small lane
+        assert messages[0].queue == f"{settings.QUEUE_NAME}.small"
+    
+    @pytest.mark.asyncio
+    async def test_relay_marks_confirmed_rows_sent(self, test_db):
+        """Test that confirmed tasks are marked sent and failed ones retried."""
+        import time
+        import uuid
+        from sqlalchemy import select
+        from src.models.outbox import OutboxMessage
+        from src.services.outbox_relay import OutboxRelay
+        from tests.conftest import TestAsyncSessionLocal
+        
+        ids = [uuid.uuid4() for _ in range(3)]
+        traceparent = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+        test_db.add_all([
+            OutboxMessage(
+                image_id=image_id, image_path=f"/tmp/{image_id}.jpg", traceparent=traceparent
+            )
+            for image_id in ids
+        ])
+        await test_db.commit()
+        
+        class Publisher:
+            def __init__(self):
+                self.batches = []
+            
+            async def send_image_processing_tasks(self, tasks, headers=None):
+                self.batches.append(tasks)
+                self.headers = headers
+                # The broker rejects the last task
+                return list(range(len(tasks) - 1))
+        
+        publisher = Publisher()
+        relay = OutboxRelay(
+            session_factory=TestAsyncSessionLocal, publisher=publisher, batch_size=10
+        )
+        
+        assert await relay.relay_once() == 2
+        assert len(publisher.batches) == 1
+        # The trace of the upload is continued and queue lag counts from the insert
+        assert publisher.headers[0]["traceparent"] == traceparent
+        assert publisher.headers[0]["x-enqueued-at"] <= time.time()
+        
+        messages = (await test_db.execute(
+            select(OutboxMessage).order_by(OutboxMessage.id).execution_options(populate_existing=True)
+        )).scalars().all()
+        assert [m.sent_at is not None for m in messages] == [True, True, False]
+        assert messages[2].attempts == 1
+        
+        # Only the unsent task is retried
+        await relay.relay_once()
+        assert publisher.batches[1] == [(str(ids[2]), f"/tmp/{ids[2]}.jpg", None, None)]
+    
+    @pytest.mark.asyncio
+    async def test_relay_marks_variant_rows_individually(self, test_db):
+        """Test that a failed variant task stays unsent while its siblings are sent."""
+        import uuid
+        from sqlalchemy import select
+        from src.models.outbox import OutboxMessage
+        from src.services.outbox_relay import OutboxRelay
+        from tests.conftest import TestAsyncSessionLocal
+        
+        image_id = uuid.uuid4()
+        sizes = ["100x100", "300x300", "1200x1200"]
+        test_db.add_all([
+            OutboxMessage(image_id=image_id, image_path="/tmp/a.jpg", variant=size)
+            for size in sizes
+        ])
+        await test_db.commit()
+        
+        class Publisher:
+            async def send_image_processing_tasks(self, tasks, headers=None):
+                # The broker rejects the 300x300 task only
+                return [index for index, task in enumerate(tasks) if task[3] != "300x300"]
+        
+        relay = OutboxRelay(
+            session_factory=TestAsyncSessionLocal, publisher=Publisher(), batch_size=10
+        )
+        
+        assert await relay.relay_once() == 2
+        messages = (await test_db.execute(
+            select(OutboxMessage).order_by(OutboxMessage.id).execution_options(populate_existing=True)
+        )).scalars().all()
+        assert {m.variant: m.sent_at is not None for m in messages} == {
+            "100x100": True, "300x300": False, "1200x1200": True
+        }
+    
+    
+    @pytest.mark.asyncio
+    async def test_relay_counts_failed_and_stalled_publishes(self, test_db):
+        """Test that a raising or unconfirmed publish counts an attempt and keeps its error."""
+        import asyncio
+        import uuid
+        from sqlalchemy import select
+        from src.models.outbox import OutboxMessage
+        from src.services.outbox_relay import OutboxRelay
+        from tests.conftest import TestAsyncSessionLocal
+        
+        test_db.add(OutboxMessage(image_id=uuid.uuid4(), image_path="/tmp/a.jpg"))
+        await test_db.commit()
+        
+        class Publisher:
+            stall = False
+            
+            async def send_image_processing_tasks(self, tasks, headers=None):
+                if self.stall:
+                    await asyncio.sleep(60)
+                raise ConnectionError("broker down")
+        
+        publisher = Publisher()
+        relay = OutboxRelay(
+            session_factory=TestAsyncSessionLocal, publisher=publisher, batch_size=10,
+            publish_timeout=0.01
+        )
+        
+        async def message():
+            return (await test_db.execute(
+                select(OutboxMessage).execution_options(populate_existing=True)
+            )).scalar_one()
+        
+        assert await relay.relay_once() == 0
+        failed = await message()
+        assert (failed.attempts, failed.sent_at) == (1, None)
+        assert "broker down" in failed.last_error
+        
+        publisher.stall = True
+        assert await asyncio.wait_for(relay.relay_once(), timeout=5) == 0
+        stalled = await message()
+        assert stalled.attempts == 2
+        assert stalled.last_error == "Not confirmed within 0.01s"
+
+class TestQueueLanes:
+    """Test size-class routing of processing tasks."""
+    
+    @pytest.mark.parametrize("pixels,file_size,expected", [
+        (100 * 100, None, "small"),
+        (8000 * 6000, 100, "large"),
+        (None, 1024, "small"),
+        (None, 50 * 1024 * 1024, "large"),
+        (None, None, "large"),
+    ])
+    def test_select_lane(self, pixels, file_size, expected):
+        """Test that the pixel count decides the lane, with file size as fallback."""
+        from src.services.rabbitmq_service import select_lane
+        
+        assert select_lane(pixels, file_size) == expected
+    
+    def test_select_lane_skips_unweighted_lane(self, monkeypatch):
+        """Test that images of a lane without consumers go to a weighted lane."""
+        from src.services.rabbitmq_service import select_lane
+        
+        monkeypatch.setattr(settings, "WORKER_LANE_WEIGHTS", {"small": 0, "large": 1})
+        assert select_lane(100 * 100) == "large"
+        
+        monkeypatch.setattr(settings, "WORKER_LANE_WEIGHTS", {"small": 1, "large": 0})
+        assert select_lane(8000 * 6000) == "small"
+    
+    def test_large_lane_keeps_queue_name(self):
+        """Test that tasks published before lanes existed are still consumed."""
+        from src.services.rabbitmq_service import lane_queue
+        
+        assert lane_queue("large") == settings.QUEUE_NAME
+        assert lane_queue("small") == f"{settings.QUEUE_NAME}.small"
+    
+    @pytest.mark.parametrize("concurrency,weights,expected", [
+        (4, {"small": 1, "large": 3}, {"small": 1, "large": 3}),
+        (8, {"small": 1, "large": 3}, {"small": 2, "large": 6}),
+        (1, {"small": 1, "large": 3}, {"small": 1, "large": 1}),
+        (4, {"small": 0, "large": 1}, {"large": 4}),
+    ])
+    def test_lane_prefetch(self, concurrency, weights, expected):
+        """Test that every weighted lane keeps at least one reserved slot."""
+        from src.services.rabbitmq_service import lane_prefetch
+        
+        assert lane_prefetch(concurrency, weights) == expected
+
+
+class TestVariantFanout:
+    """Test per-variant fan-out processing."""
+    
+    def test_fanout_without_outbox_is_reported(self, monkeypatch):
+        """Test that VARIANT_FANOUT without the outbox is flagged for the startup warning."""
+        monkeypatch.setattr(settings, "VARIANT_FANOUT", True)
+        monkeypatch.setattr(settings, "OUTBOX_ENABLED", False)
+        assert settings.ignored_settings() == [
+            "VARIANT_FANOUT has no effect unless OUTBOX_ENABLED is set"
+        ]
+        
+        monkeypatch.setattr(settings, "OUTBOX_ENABLED", True)
+        assert settings.ignored_settings() == []
+    
+    @pytest.mark.asyncio
+    async def test_variants_complete_progressively(
+        self, test_db, temp_storage, sample_image_file, monkeypatch
+    ):
+        """Test that each size is queued separately and the image status is derived."""
+        from fastapi import UploadFile
+        from sqlalchemy import select
+        from src.models.image import Image, ImageStatus
+        from src.models.outbox import OutboxMessage
+        from src.services.image_service import ImageService
+        
+        monkeypatch.setattr(settings, "VARIANT_FANOUT", True)
+        with open(sample_image_file, 'rb') as f:
+            image = await ImageService.create_image(test_db, UploadFile(filename="a.jpg", file=f))
+        image_id = str(image.id)
+        
+        messages = (await test_db.execute(
+            select(OutboxMessage).order_by(OutboxMessage.id)
+        )).scalars().all()
+        assert [m.variant for m in messages] == ["100x100", "300x300", "1200x1200"]
+        
+        status, variants = await ImageService.complete_variant(
+            test_db, image_id, "100x100", path="/thumbs/a_100x100.jpg"
+        )
+        assert status == ImageStatus.PROCESSING
+        assert variants["100x100"] == {"status": ImageStatus.DONE, "path": "/thumbs/a_100x100.jpg"}
+        assert variants["1200x1200"]["status"] == ImageStatus.PROCESSING
+        
+        await ImageService.complete_variant(
+            test_db, image_id, "300x300", path="/thumbs/a_300x300.jpg",
+            timings={"trace_id": "abc", "started_300x300": 10.0, "committed": 11.0}
+        )
+        status, _ = await ImageService.complete_variant(
+            test_db, image_id, "1200x1200", error_message="decoder crashed",
+            timings={"started_1200x1200": 10.5, "committed": 12.0}
+        )
+        assert status == ImageStatus.ERROR
+        
+        image = (await test_db.execute(
+            select(Image).where(Image.id == image.id).execution_options(populate_existing=True)
+        )).scalar_one()
+        assert image.error_message == "1200x1200: decoder crashed"
+        # Milestones of concurrent variants are merged
+        assert image.timings == {
+            "trace_id": "abc", "started_300x300": 10.0, "started_1200x1200": 10.5, "committed": 12.0
+        }
+        assert {v.size_name: v.status for v in image.variants} == {
+            "100x100": ImageStatus.DONE,
+            "300x300": ImageStatus.DONE,
+            "1200x1200": ImageStatus.ERROR
+        }
+
+
+class TestStorage:
+    """Test storage backends and resharding."""
+    
+    @pytest.mark.asyncio
+    async def test_local_storage_shards_and_streams(self, temp_storage):
+        """Test that local objects land in hash shards and round-trip."""
+        from src.services.storage import LocalStorage, shard_key
+        
+        storage = LocalStorage()
+        
+        async def chunks():
+            yield b"hello "
+            yield b"world"
+        
+        location = await storage.write("originals", "abc.jpg", chunks())
+        
+        key = shard_key("originals", "abc.jpg")
+        assert len(key.split("/")) == 4
+        assert location == os.path.join(temp_storage, *key.split("/"))
+        assert b"".join([chunk async for chunk in storage.read(location, 4)]) == b"hello world"
+        assert storage.url(location) == f"/static/{key}"
+        assert storage.resolve(key) == location
+        assert storage.resolve("../etc/passwd") is None
+        assert storage.resolve("packs/tombstones.log") is None
+        assert storage.resolve("originals/../tmp/upload.part") is None
+        
+        await storage.delete([location, location])
+        assert not await storage.exists(location)
+    
+    def test_incomplete_backend_cannot_be_created(self):
+        """Test that a backend missing part of the interface fails on instantiation."""
+        from src.services.storage import LocalStorage, Storage
+        
+        class NoResolve(Storage):
+            stage = LocalStorage.stage
+            save = LocalStorage.save
+            read = LocalStorage.read
+            size = LocalStorage.size
+            delete = LocalStorage.delete
+            location_of = LocalStorage.location_of
+            key_of = LocalStorage.key_of
+        
+        with pytest.raises(TypeError, match="resolve"):
+            NoResolve()
+    
+    @pytest.mark.asyncio
+    async def test_s3_storage_against_stand_in(self, temp_storage):
+        """Test the S3 backend against an in-memory S3 stand-in."""
+        import httpx
+        from src.services.storage import S3Storage, shard_key
+        
+        objects = {}
+        
+        async def handler(request: httpx.Request) -> httpx.Response:
+            assert request.headers["Authorization"].startswith(
+                "AWS4-HMAC-SHA256 Credential=key/"
+            )
+            path = request.url.path
+            if request.method == "PUT":
+                objects[path] = await request.aread()
+                return httpx.Response(200)
+            if path not in objects:
+                return httpx.Response(404)
+            if request.method == "DELETE":
+                del objects[path]
+                return httpx.Response(204)
+            return httpx.Response(200, content=objects[path] if request.method == "GET" else b"")
+        
+        storage = S3Storage(
+            endpoint_url="http://s3.test",
+            bucket="images",
+            access_key="key",
+            secret_key="secret",
+            transport=httpx.MockTransport(handler)
+        )
+        try:
+            staged = storage.stage("thumbnails", "a_100x100.jpg")
+            with open(staged, "wb") as f:
+                f.write(b"jpeg bytes")
+            
+            location = await storage.save(staged, "thumbnails", "a_100x100.jpg")
+            
+            assert location == shard_key("thumbnails", "a_100x100.jpg")
+            assert objects == {f"/images/{location}": b"jpeg bytes"}
+            assert not os.path.exists(staged)
+            assert await storage.exists(location)
+            async with storage.local_file(location) as path:
+                with open(path, "rb") as f:
+                    assert f.read() == b"jpeg bytes"
+            assert not os.path.exists(path)
+            
+            await storage.delete([location])
+            assert not await storage.exists(location)
+        finally:
+            await storage.close()
+    
+    @pytest.mark.asyncio
+    async def test_reshard_moves_flat_files(self, test_db, temp_storage):
+        """Test that files of the flat layout are moved and their rows repointed."""
+        from src.models.image import Image, ImageStatus, ImageVariant
+        from src.services.storage import LocalStorage
+        from src.tools.reshard_storage import reshard
+        from tests.conftest import TestAsyncSessionLocal
+        
+        flat_paths = [
+            os.path.join(temp_storage, "originals", "hash.jpg"),
+            os.path.join(temp_storage, "thumbnails", "a_100x100.jpg")
+        ]
+        for path in flat_paths:
+            with open(path, "wb") as f:
+                f.write(b"data")
+        # Two images share the content-addressed original
+        images = [
+            Image(
+                status=ImageStatus.DONE,
+                original_filename=f"{i}.jpg",
+                original_path=flat_paths[0],
+                variants=[
+                    ImageVariant(size_name="100x100", status=ImageStatus.DONE, path=flat_paths[1])
+                ] if i == 0 else []
+            )
+            for i in range(2)
+        ]
+        test_db.add_all(images)
+        await test_db.commit()
+        
+        storage = LocalStorage()
+        dry_run = await reshard(TestAsyncSessionLocal, storage, dry_run=True)
+        assert dry_run == {"moved": 2, "sharded": 0, "missing": 0}
+        assert all(os.path.exists(path) for path in flat_paths)
+        
+        stats = await reshard(TestAsyncSessionLocal, storage, batch_size=1)
+        assert stats == {"moved": 2, "sharded": 0, "missing": 0}
+        
+        original = storage.location_of("originals", "hash.jpg")
+        thumbnail = storage.location_of("thumbnails", "a_100x100.jpg")
+        assert os.path.exists(original) and os.path.exists(thumbnail)
+        for image in images:
+            await test_db.refresh(image)
+            assert image.original_path == original
+        await test_db.refresh(images[0], ["variants"])
+        assert images[0].variants[0].path == thumbnail
+        
+        again = await reshard(TestAsyncSessionLocal, storage)
+        assert again == {"moved": 0, "sharded": 2, "missing": 0}
+    
+    def test_pack_store_rotates_deletes_and_compacts(self, temp_storage, monkeypatch):
+        """Test packing, segment rotation, cross-process visibility and compaction."""
+        from src.services.pack_storage import PACK_PREFIX, PackStore
+        
+        # Readers see other processes' writes on every lookup
+        monkeypatch.setattr(settings, "PACK_REFRESH_INTERVAL", 0)
+        writer = PackStore(segment_bytes=130)
+        reader = PackStore()
+        
+        locations = [writer.put(f"thumb{i}.jpg", bytes([i]) * 40) for i in range(5)]
+        assert locations[0] == PACK_PREFIX + "thumb0.jpg"
+        # Two 40-byte objects (plus headers) fit per 130-byte segment
+        packs = sorted(name for name in os.listdir(writer.directory) if name.endswith(".pack"))
+        assert len(packs) == 3
+        assert len([name for name in os.listdir(writer.directory) if name.endswith(".idx")]) == 2
+        
+        # A separate instance sees sealed and active segments
+        for i in range(5):
+            assert reader.get(f"thumb{i}.jpg") == bytes([i]) * 40
+        assert reader.get("missing.jpg") is None
+        
+        writer.delete(["thumb0.jpg", "thumb4.jpg"])
+        assert writer.get("thumb0.jpg") is None
+        assert reader.get("thumb0.jpg") is None
+        
+        stats = writer.compact()
+        assert stats["segments"] == 1
+        assert stats["removed"] == 1
+        assert stats["reclaimed_bytes"] > 0
+        for i in (1, 2, 3):
+            assert reader.get(f"thumb{i}.jpg") == bytes([i]) * 40
+            assert writer.get(f"thumb{i}.jpg") == bytes([i]) * 40
+        assert reader.get("thumb0.jpg") is None
+        # Sealed by the compaction, not rewritten: tombstone kept until then
+        assert reader.get("thumb4.jpg") is None
+    
+    def test_writes_after_compaction_survive_reopening(self, temp_storage):
+        """Test that compaction leaves no segment unsealed behind the rewritten ones."""
+        from src.services.pack_storage import PackStore
+        
+        store = PackStore(segment_bytes=130)
+        for i in range(5):
+            store.put(f"thumb{i}.jpg", bytes([i]) * 40)
+        store.delete(["thumb0.jpg"])
+        store.compact()
+        store.put("after.jpg", b"a" * 40)
+        store.put("later.jpg", b"b" * 40)
+        
+        journals = [name for name in os.listdir(store.directory) if name.endswith(".log")
+                    and name != "tombstones.log"]
+        assert len(journals) == 1
+        
+        reopened = PackStore()
+        for i in range(1, 5):
+            assert reopened.get(f"thumb{i}.jpg") == bytes([i]) * 40
+        assert reopened.get("after.jpg") == b"a" * 40
+        assert reopened.get("later.jpg") == b"b" * 40
+        assert reopened.get("thumb0.jpg") is None
+    
+    def test_empty_sealed_index(self, temp_storage):
+        """Test that an empty index (every entry compacted away) finds nothing."""
+        from src.services.pack_storage import _SealedIndex
+        
+        path = os.path.join(temp_storage, "empty.idx")
+        open(path, "wb").close()
+        index = _SealedIndex(path)
+        
+        assert index.find(b"\0" * 16) is None
+        assert list(index.records()) == []
+        index.close()
+    
+    def test_processor_packs_small_thumbnails(self, temp_storage, monkeypatch):
+        """Test that thumbnails under the size limit go to the pack store."""
+        from io import BytesIO
+        from src.config import settings
+        from src.services.pack_storage import is_packed, pack_store, packed_name
+        
+        monkeypatch.setattr(settings, "PACK_ENABLED", True)
+        monkeypatch.setattr(settings, "PACK_MAX_VARIANT_BYTES", 4096)
+        
+        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
+            PILImage.new('RGB', (1600, 900), color=(0, 0, 255)).save(temp_file, 'JPEG')
+            temp_file.flush()
+            
+            try:
+                paths = ImageProcessor.create_thumbnails("packed-id", temp_file.name)
+            finally:
+                os.unlink(temp_file.name)
+        
+        assert is_packed(paths["100x100"])
+        assert not is_packed(paths["1200x1200"])
+        with PILImage.open(BytesIO(pack_store.get(packed_name(paths["100x100"])))) as thumbnail:
+            assert thumbnail.size == (100, 100)
+
+
+class TestLogging:
+    """Test the logging pipeline."""
+    
+    def test_queued_records_are_formatted_by_writer(self, monkeypatch, capsys):
+        """Test that queued records keep lazy arguments and extras and are written on shutdown."""
+        import logging
+        from src.services import logger as logger_module
+        
+        monkeypatch.setattr(settings, "LOG_ASYNC", True)
+        root_logger = logging.getLogger()
+        previous_handlers = root_logger.handlers[:]
+        previous_level = root_logger.level
+        try:
+            logger_module.setup_logging()
+            log = logging.getLogger("tests.logging")
+            log.warning("Queued %s of %d", "record", 2, extra={"image_id": object()})
+            logger_module.shutdown_logging()
+        finally:
+            root_logger.handlers[:] = previous_handlers
+            root_logger.setLevel(previous_level)
+        
+        entry = json.loads(capsys.readouterr().out.strip().splitlines()[-1])
+        assert entry["message"] == "Queued record of 2"
+        assert entry["level"] == "WARNING"
+        assert entry["timestamp"].endswith("Z")
+        assert entry["image_id"].startswith("<object")
+    
+    def test_full_queue_drops_records(self):
+        """Test that a full queue drops records instead of blocking."""
+        import logging
+        import queue
+        from src.services.logger import DeferredQueueHandler
+        
+        handler = DeferredQueueHandler(queue.Queue(1))
+        for _ in range(3):
+            handler.emit(logging.LogRecord("test", logging.INFO, "", 0, "message", (), None))
+        assert handler.dropped == 2
+    
+    def test_dropped_records_are_exported(self):
+        """Test that drops of the installed handler show up in the metrics."""
+        import logging
+        import queue
+        from src.services.logger import DeferredQueueHandler
+        from src.services.metrics import LOG_RECORDS_DROPPED
+        
+        before = LOG_RECORDS_DROPPED._samples()[0][2]
+        handler = DeferredQueueHandler(queue.Queue(1))
+        root = logging.getLogger()
+        root.addHandler(handler)
+        try:
+            for _ in range(3):
+                handler.emit(logging.LogRecord("test", logging.INFO, "", 0, "message", (), None))
+            assert LOG_RECORDS_DROPPED._samples()[0][2] == before + 2
+            assert "log_records_dropped_total" in "\n".join(LOG_RECORDS_DROPPED.render())
+        finally:
+            root.removeHandler(handler)
+    
+    def test_sampling_keeps_warnings(self, monkeypatch):
+        """Test that sampling drops a share of INFO records but never warnings."""
+        import logging
+        import random
+        from src.services.logger import SamplingFilter
+        
+        sampling = SamplingFilter(0.25)
+        monkeypatch.setattr(random, "random", iter([0.1, 0.5, 0.9]).__next__)
+        
+        def record(level):
+            return logging.LogRecord("test", level, "", 0, "message", (), None)
+        
+        kept = record(logging.INFO)
+        assert sampling.filter(kept)
+        assert kept.sample_rate == 0.25
+        assert not sampling.filter(record(logging.INFO))
+        assert not sampling.filter(record(logging.DEBUG))
+        assert sampling.filter(record(logging.WARNING))
+
+
+class TestMetrics:
+    """Test metrics collection and exposition."""
+    
+    def test_histogram_renders_cumulative_buckets(self):
+        """Test the text exposition of a labelled histogram."""
+        from src.services.metrics import Histogram
+        
+        histogram = Histogram("job_seconds", "Job time", ("queue",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            histogram.labels("small").observe(value)
+        
+        lines = histogram.render()
+        assert lines[:2] == ["# HELP job_seconds Job time", "# TYPE job_seconds histogram"]
+        assert lines[2:] == [
+            'job_seconds_bucket{queue="small",le="0.1"} 1',
+            'job_seconds_bucket{queue="small",le="1"} 2',
+            'job_seconds_bucket{queue="small",le="+Inf"} 3',
+            'job_seconds_count{queue="small"} 3',
+            'job_seconds_sum{queue="small"} 5.55',
+        ]
+    
+    def test_thumbnail_timings_are_split_by_stage_and_size(self):
+        """Test that processor timings map onto stage and size labels."""
+        from src.services.metrics import THUMBNAIL_STAGE_DURATION, observe_thumbnail_timings
+        
+        observe_thumbnail_timings({"decode": 0.01, "resize_100x100": 0.002, "encode_100x100": 0.003})
+        
+        text = "\n".join(THUMBNAIL_STAGE_DURATION.render())
+        assert 'thumbnail_stage_duration_seconds_count{stage="decode",size=""}' in text
+        assert 'thumbnail_stage_duration_seconds_count{stage="encode",size="100x100"}' in text
+    
+    @pytest.mark.asyncio
+    async def test_statement_timings_by_operation(self):
+        """Test that an instrumented engine times statements by SQL verb."""
+        from sqlalchemy import text
+        from sqlalchemy.ext.asyncio import create_async_engine
+        from src.database.connection import instrument_engine
+        from src.services.metrics import DB_STATEMENT_DURATION
+        
+        engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+        instrument_engine(engine.sync_engine)
+        before = DB_STATEMENT_DURATION.labels("SELECT")._samples()[-2][2]
+        try:
+            async with engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+        finally:
+            await engine.dispose()
+        assert DB_STATEMENT_DURATION.labels("SELECT")._samples()[-2][2] == before + 1
+    
+    @pytest.mark.asyncio
+    async def test_worker_metrics_listener(self):
+        """Test that the embedded listener answers a scrape."""
+        from src.services.metrics import start_metrics_server
+        
+        # Port 0 disables the listener, so reserve a free port first
+        server = await asyncio.start_server(lambda r, w: None, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        server.close()
+        await server.wait_closed()
+        
+        server = await start_metrics_server("127.0.0.1", port)
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /metrics HTTP/1.1\r\nHost: worker\r\n\r\n")
+            response = await reader.read()
+            writer.close()
+        finally:
+            server.close()
+            await server.wait_closed()
+        
+        assert response.startswith(b"HTTP/1.1 200 OK")
+        assert b"# TYPE worker_queue_lag_seconds histogram" in response
+
+
+class TestTracing:
+    """Test trace context propagation and stage milestones."""
+    
+    def test_traceparent_round_trip(self):
+        """Test parsing and formatting of W3C traceparent headers."""
+        from src.services.tracing import SpanContext
+        
+        header = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+        context = SpanContext.parse(header)
+        assert context == SpanContext("0af7651916cd43dd8448eb211c80319c", "b7ad6b7169203331", True)
+        assert context.to_header() == header
+        assert not SpanContext.parse(header[:-2] + "00").sampled
+        
+        for invalid in (None, "", "garbage", "00-" + "0" * 32 + "-b7ad6b7169203331-01"):
+            assert SpanContext.parse(invalid) is None
+    
+    def test_spans_nest_and_are_logged(self, monkeypatch, caplog):
+        """Test that spans continue the current trace and are written when sampled."""
+        import logging
+        from src.services.tracing import SpanContext, current_span, current_traceparent, span
+        
+        parent = SpanContext("0af7651916cd43dd8448eb211c80319c", "b7ad6b7169203331")
+        with caplog.at_level(logging.INFO, logger="src.services.tracing"):
+            with span("outer", parent) as outer:
+                with span("inner", image_id="x") as inner:
+                    assert current_span() == inner
+                    assert current_traceparent() == inner.to_header()
+            assert current_span() is None
+        
+        assert outer.trace_id == inner.trace_id == parent.trace_id
+        records = {record.span: record for record in caplog.records}
+        assert records["inner"].parent_span_id == outer.span_id
+        assert records["outer"].parent_span_id == parent.span_id
+        assert records["inner"].image_id == "x"
+        
+        # Unsampled new traces are not written
+        monkeypatch.setattr(settings, "TRACE_SAMPLE_RATE", 0)
+        caplog.clear()
+        with caplog.at_level(logging.INFO, logger="src.services.tracing"):
+            with span("dropped") as context:
+                assert not context.sampled
+        assert not caplog.records
+    
+    def test_stage_marks_follow_processor_timings(self):
+        """Test that processor durations become milestones laid end to end."""
+        from src.services.tracing import SpanContext, span
+        from src.worker.main import _stage_marks, _start_marks
+        
+        parent = SpanContext("0af7651916cd43dd8448eb211c80319c", "b7ad6b7169203331", False)
+        with span("process_task", parent):
+            marks = _start_marks(100.0, 101.0)
+            marks.update(_stage_marks(101.0, {
+                "decode": 0.5,
+                "resize_300x300": 0.25,
+                "encode_300x300": 0.25,
+                "total": 1.0
+            }))
+        
+        assert marks == {
+            "trace_id": parent.trace_id,
+            "queued": 100.0,
+            "started": 101.0,
+            "decoded": 101.5,
+            "encoded_300x300": 102.0
+        }
+
+
+class TestThumbnailBenchmark:
+    """Test the thumbnail benchmark tool."""
+    
+    def test_corpus_is_deterministic(self, monkeypatch):
+        """Test that every format and mode is generated, identically in another directory."""
+        from src.tools import benchmark_thumbnails
+        
+        monkeypatch.setitem(benchmark_thumbnails.RESOLUTIONS, "tiny", (64, 48))
+        with tempfile.TemporaryDirectory() as first, tempfile.TemporaryDirectory() as second:
+            corpus = benchmark_thumbnails.build_corpus(first, ["tiny"])
+            again = benchmark_thumbnails.build_corpus(second, ["tiny"])
+            
+            assert [item["sha256"] for item in corpus] == [item["sha256"] for item in again]
+            assert {(item["format"], item["mode"]) for item in corpus} == {
+                (image_format, mode)
+                for image_format, modes in benchmark_thumbnails.FORMAT_MODES.items()
+                for mode in modes
+            }
+            for item in corpus:
+                with PILImage.open(item["path"]) as img:
+                    assert img.format == item["format"]
+                    assert img.mode == item["mode"]
+                    assert img.size == (64, 48)
+    
+    def test_run_reports_every_path(self, monkeypatch):
+        """Test that each path is measured in process and leaves no output behind."""
+        from src.tools import benchmark_thumbnails
+        
+        monkeypatch.setitem(benchmark_thumbnails.RESOLUTIONS, "tiny", (64, 48))
+        storage_path = settings.STORAGE_PATH
+        with tempfile.TemporaryDirectory() as directory:
+            corpus = benchmark_thumbnails.build_corpus(directory, ["tiny"])[:1]
+            report = benchmark_thumbnails.run(
+                corpus, list(benchmark_thumbnails.PATHS), iterations=3, isolated=False
+            )
+        
+        assert settings.STORAGE_PATH == storage_path
+        assert [result["path"] for result in report["results"]] == list(benchmark_thumbnails.PATHS)
+        for result in report["results"]:
+            assert result["iterations"] == 3
+            assert 0 < result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"]
+            assert result["throughput_per_s"] > 0
+            assert result["peak_rss_mb"] > 0
+        assert "decode" in report["results"][0]["stages_ms"]
+        assert "path" not in report["inputs"][0]
+    
+    def test_compare_fails_on_regression(self, capsys):
+        """Test that growth beyond the threshold fails the comparison and smaller growth passes."""
+        from src.tools.benchmark_thumbnails import main
+        
+        def report(p50_ms):
+            return {
+                "corpus_version": 1,
+                "inputs": [{"name": "vga_rgb.jpg", "sha256": "ab"}],
+                "results": [{
+                    "path": "cascaded",
+                    "input": "vga_rgb.jpg",
+                    "p50_ms": p50_ms,
+                    "p95_ms": 20.0,
+                    "peak_rss_mb": 80.0
+                }]
+            }
+        
+        with tempfile.TemporaryDirectory() as directory:
+            paths = {}
+            for name, p50_ms in (("baseline", 10.0), ("slower", 12.0), ("noisy", 10.5)):
+                paths[name] = os.path.join(directory, f"{name}.json")
+                with open(paths[name], "w") as f:
+                    json.dump(report(p50_ms), f)
+            
+            assert main(["compare", paths["baseline"], paths["noisy"], "--threshold", "0.1"]) == 0
+            assert main(["compare", paths["baseline"], paths["slower"], "--threshold", "0.1"]) == 1
+        
+        output = capsys.readouterr().out
+        assert "cascaded vga_rgb.jpg p50_ms: 10.0 -> 12.0 (+20.0%) REGRESSION" in output
+
+
+class TestMemoryBroker:
+    """Test the in-process broker behind memory:// URLs."""
+    
+    @pytest.mark.asyncio
+    async def test_prefetch_limits_unacked_deliveries(self):
+        """Test that a consumer gets at most its prefetch of unacked messages and more after acks."""
+        import aio_pika
+        from src.services.memory_broker import MemoryBroker
+        
+        broker = MemoryBroker()
+        connection = await broker.connect()
+        channel = await connection.channel()
+        await channel.set_qos(prefetch_count=2)
+        queue = await channel.declare_queue("tasks", durable=True)
+        for index in range(5):
+            await channel.default_exchange.publish(
+                aio_pika.Message(str(index).encode(), headers={"n": index}), routing_key="tasks"
+            )
+        
+        received = []
+        
+        async def on_message(message):
+            received.append(message)
+        
+        await queue.consume(on_message)
+        await asyncio.sleep(0)
+        assert [message.body for message in received] == [b"0", b"1"]
+        assert broker.queue_stats("tasks").message_count == 3
+        
+        async with received[0].process():
+            pass
+        await received[1].ack()
+        await asyncio.sleep(0)
+        assert [message.body for message in received[2:]] == [b"2", b"3"]
+        assert received[3].headers == {"n": 3}
+        assert received[3].routing_key == "tasks"
+    
+    @pytest.mark.asyncio
+    async def test_rejected_and_unacked_messages(self):
+        """Test that failed processing drops a message and closing a connection requeues the rest."""
+        import aio_pika
+        from src.services.memory_broker import MemoryBroker
+        
+        broker = MemoryBroker()
+        worker = await broker.connect()
+        channel = await worker.channel()
+        queue = await channel.declare_queue("tasks")
+        received = []
+        
+        async def on_message(message):
+            received.append(message)
+        
+        await queue.consume(on_message)
+        for body in (b"fails", b"pending"):
+            await channel.default_exchange.publish(aio_pika.Message(body), routing_key="tasks")
+        await asyncio.sleep(0)
+        
+        with pytest.raises(ValueError):
+            async with received[0].process():
+                raise ValueError("processing failed")
+        await worker.close()
+        
+        stats = broker.queue_stats("tasks")
+        assert (stats.message_count, stats.consumer_count) == (1, 0)
+        
+        other = await (await broker.connect()).channel()
+        received.clear()
+        await (await other.declare_queue("tasks")).consume(on_message)
+        await asyncio.sleep(0)
+        assert [message.body for message in received] == [b"pending"]
+    
+    @pytest.mark.asyncio
+    async def test_fanout_reaches_every_bound_queue(self, monkeypatch):
+        """Test that status events reach every replica's exclusive queue until it disconnects."""
+        from src.services import rabbitmq_service as rabbitmq_module
+        from src.services.memory_broker import MemoryBroker
+        from src.services.rabbitmq_service import (
+            connect_broker,
+            declare_status_exchange,
+            publish_status_event,
+        )
+        
+        broker = MemoryBroker()
+        monkeypatch.setattr(rabbitmq_module, "memory_broker", broker)
+        replicas = [await connect_broker("memory://") for _ in range(2)]
+        events = []
+        
+        async def on_event(message):
+            events.append(json.loads(message.body))
+        
+        for replica in replicas:
+            channel = await replica.channel()
+            queue = await channel.declare_queue(exclusive=True, auto_delete=True)
+            await queue.bind(await declare_status_exchange(channel))
+            await queue.consume(on_event, no_ack=True)
+        
+        publisher = await (await connect_broker("memory://")).channel()
+        exchange = await declare_status_exchange(publisher)
+        await publish_status_event(exchange, "image-1", "DONE")
+        await asyncio.sleep(0)
+        assert [event["image_id"] for event in events] == ["image-1", "image-1"]
+        
+        await replicas[0].close()
+        await publish_status_event(exchange, "image-2", "DONE")
+        await asyncio.sleep(0)
+        assert [event["image_id"] for event in events] == ["image-1", "image-1", "image-2"]
+
+
+class TestLoadTest:
+    """Test the load-test harness helpers."""
+    
+    def test_uploads_are_unique_valid_jpegs(self):
+        """Test that every upload has distinct bytes but decodes to the same image."""
+        from io import BytesIO
+        from src.tools.load_test import _unique_jpeg
+        
+        buffer = BytesIO()
+        PILImage.new("RGB", (32, 24), (10, 20, 30)).save(buffer, "JPEG")
+        first, second = _unique_jpeg(buffer.getvalue()), _unique_jpeg(buffer.getvalue())
+        
+        assert first != second
+        for data in (first, second):
+            with PILImage.open(BytesIO(data)) as img:
+                img.load()
+                assert img.format == "JPEG"
+                assert img.size == (32, 24)
+    
+    @pytest.mark.asyncio
+    async def test_report_counts_outcomes(self):
+        """Test that uploads are polled until done and outcomes are counted."""
+        from src.tools.load_test import LoadTest
+        
+        class Response:
+            def __init__(self, status_code, body):
+                self.status_code = status_code
+                self._body = body
+            
+            def json(self):
+                return self._body
+        
+        class Client:
+            def __init__(self):
+                self.uploads = 0
+                self.reads = {}
+            
+            async def post(self, url, files):
+                self.uploads += 1
+                if self.uploads == 3:
+                    return Response(500, {"detail": "Internal server error"})
+                return Response(200, {"id": str(self.uploads)})
+            
+            async def get(self, url):
+                image_id = url.rsplit("/", 1)[-1]
+                self.reads[image_id] = self.reads.get(image_id, 0) + 1
+                if image_id == "2":
+                    return Response(200, {"status": "ERROR"})
+                done = self.reads[image_id] > 1
+                return Response(200, {"status": "DONE" if done else "PROCESSING"})
+        
+        load = LoadTest(Client(), b"\xff\xd8\xff\xd9", poll_interval=0, timeout=5)
+        await load.run(rate=1000, duration=0.003)
+        report = load.report()
+        
+        assert report["uploads"]["count"] == 3
+        assert report["uploads"]["rejected"] == 1
+        assert report["reads"]["count"] == 3
+        assert report["time_to_done"]["count"] == 1
+        assert report["time_to_done"]["failed"] == 1
+        assert report["images_per_s"] > 0
+    
+    def test_self_contained_run(self, tmp_path):
+        """Test a short run of the default setup: scratch SQLite and in-process broker."""
+        import subprocess
+        import sys
+        
+        # A fresh process, since settings are read once on import
+        env = {
+            key: value for key, value in os.environ.items()
+            if key not in ("DATABASE_URL", "RABBITMQ_URL", "STORAGE_PATH")
+        }
+        output = tmp_path / "load.json"
+        subprocess.run(
+            [
+                sys.executable, "-m", "src.tools.load_test", "--rate", "4", "--duration", "0.5",
+                "--size", "64x48", "--timeout", "30", "--output", str(output)
+            ],
+            env=env, check=True, capture_output=True, timeout=120
+        )
+        
+        report = json.loads(output.read_text())
+        assert report["config"]["database"] == "sqlite"
+        assert report["config"]["broker"] == "memory"
+        assert report["uploads"]["rejected"] == 0
+        assert report["time_to_done"]["count"] == 2
+
+
+class TestHealthProber:
+    """Test the background dependency checks."""
+    
+    @pytest.mark.asyncio
+    async def test_slow_check_fails_with_timeout(self):
+        """Test that a hanging check is cut off by the timeout and reported as failed."""
+        from src.services.health import HealthProber
+        
+        async def hanging():
+            await asyncio.sleep(60)
+        
+        prober = HealthProber({"database": hanging}, interval=60, timeout=0.01)
+        await asyncio.wait_for(prober.probe_once(), timeout=5)
+        
+        ready, checks = prober.readiness()
+        assert not ready
+        assert checks["database"]["error"] == "Timed out after 0.01s"
+    
+    @pytest.mark.asyncio
+    async def test_stale_results_are_unready(self, monkeypatch):
+        """Test that results older than three intervals no longer count as passing."""
+        import time
+        from src.services.health import HealthProber
+        
+        async def passing():
+            pass
+        
+        prober = HealthProber({"database": passing}, interval=1)
+        prober.start()
+        await asyncio.sleep(0.01)
+        await prober.stop()
+        assert prober.readiness()[0]
+        
+        now = time.monotonic()
+        monkeypatch.setattr(time, "monotonic", lambda: now + 10)
+        ready, checks = prober.readiness()
+        assert not ready
+        assert checks["database"]["error"].startswith("Last checked")
+    
+    @pytest.mark.asyncio
+    async def test_rabbitmq_check_reads_connection_state(self, monkeypatch):
+        """Test that the RabbitMQ check never connects, only reports the connection state."""
+        from src.config import settings
+        from src.services import health
+        from src.services import rabbitmq_service as rabbitmq_module
+        from src.services.memory_broker import MemoryBroker
+        from src.services.rabbitmq_service import RabbitMQService
+        
+        monkeypatch.setattr(settings, "RABBITMQ_URL", "memory://")
+        monkeypatch.setattr(rabbitmq_module, "memory_broker", MemoryBroker())
+        service = RabbitMQService()
+        monkeypatch.setattr(health, "rabbitmq_service", service)
+        
+        with pytest.raises(ConnectionError):
+            await health.check_rabbitmq()
+        assert service.connection is None
+        
+        await service.connect()
+        await health.check_rabbitmq()
+        
+        await service.connection.close()
+        with pytest.raises(ConnectionError):
+            await health.check_rabbitmq()
+        await service.disconnect()